@@ -19,6 +19,7 @@ if root_directory not in sys.path:
 from apps.import_collector import import_collect  # noqa: E402
 from apps.lib.git_operater import get_diff_with_commit  # noqa: E402
 from apps.lib.inputter import variable_input  # noqa: E402
+from apps.lib.llm_ledger import default_ledger_path, llm_ledger  # noqa: E402
 from apps.lib.test_code_generater import (  # noqa: E402
     TestingFlameworkEnum,
     TestScopeEnum,
@@ -212,17 +213,23 @@ def main() -> None:
 
     user_instruction = None
 
-    run_test_code_generator(
-        root_path=root_path,
-        target_relative_path=code_relative_path,
-        reference_relative_paths=reference_relative_paths,
-        test_relative_path=test_relative_path,
-        flamework=testing_framework,
-        scope=test_scope,
-        target_specification=target_specification,
-        supplement=supplement,
-        user_instruction=user_instruction,
-    )
+    try:
+        run_test_code_generator(
+            root_path=root_path,
+            target_relative_path=code_relative_path,
+            reference_relative_paths=reference_relative_paths,
+            test_relative_path=test_relative_path,
+            flamework=testing_framework,
+            scope=test_scope,
+            target_specification=target_specification,
+            supplement=supplement,
+            user_instruction=user_instruction,
+        )
+    finally:
+        # ステージごとのトークン数・時間・料金を表示し、記録をファイルに追記する
+        llm_ledger.print_summary()
+        if llm_ledger.records:
+            llm_ledger.save(default_ledger_path)
 
 
 if __name__ == "__main__":
@@ -32,6 +32,7 @@ default_depth = 999
 default_max_char = 999_999_999
 default_max_token = 125_000
 default_output = cast(OutputType, "code")
+default_tree_max_token = 2_000
 
 
 ModeType = Literal["cursor", "chatgpt", "o1-mini", "gemini1.5pro", "claude", "dify"]
@@ -108,6 +109,7 @@ class MainArgs:
     max_char: int | None
     max_token: int | None
     mode: ModeType | None
+    tree_max_token: int | None
 
 
 def import_collect(
@@ -121,6 +123,7 @@ def import_collect(
     with_prompt: bool = False,
     max_char: int = default_max_char,
     max_token: int = default_max_token,
+    tree_max_token: int = default_tree_max_token,
 ) -> list[str]:
     if target_paths is None:
         target_paths = []
@@ -148,8 +151,6 @@ def import_collect(
         # ファイルの内容を取得
         file_content_collector = FileContentCollector(dependency_file_paths, root_path, no_docstring=no_comment)
         contents = file_content_collector.collect()
-        # ディレクトリ構成図と依存解析のログをコンテンツの先頭に追加する
-        contents.insert(0, path_tree.get_tree_map())
     elif output == "path":
         # 出力形式が"path"の場合の処理
         file_path_formatter = FilePathFormatter(dependency_file_paths, root_path)
@@ -162,6 +163,11 @@ def import_collect(
     optimizer = ContentSizeOptimizer(
         contents, max_char=max_char, max_token=max_token, with_prompt=with_prompt, output=output
     )
+    # ファイルごとのトークン数を付けたディレクトリ構成図をコンテンツの先頭に追加する
+    # 構成図が大きい場合は、tree_max_tokenに収まるように簡略化する
+    for file_path, sized_content in zip(dependency_file_paths, optimizer.calc_sized_contents):
+        path_tree.sizes[file_path] = sized_content.token
+    optimizer.prepend_content(path_tree.get_tree_map(max_tokens=tree_max_token))
     optimized_contents = optimizer.optimize_contents()
     return optimized_contents
 
@@ -201,6 +207,12 @@ def main() -> None:
     parser.add_argument(
         "-mc", "--max_char", type=int, help="Split by a specified number of characters when copying to the clipboard"
     )
+    parser.add_argument(
+        "-tm",
+        "--tree_max_token",
+        type=int,
+        help=f"Compact the directory tree when it exceeds this number of tokens (default: {default_tree_max_token})",
+    )
     parser.add_argument(
         "-m",
         "--mode",
@@ -224,6 +236,7 @@ def main() -> None:
         max_char=args.max_char,
         max_token=args.max_token,
         mode=args.mode,
+        tree_max_token=args.tree_max_token,
     )
 
     if main_args.mode is None:
@@ -338,6 +351,7 @@ def main() -> None:
         with_prompt=main_args.with_prompt,
         max_char=main_args.max_char or default_max_char,
         max_token=main_args.max_token or default_max_token,
+        tree_max_token=main_args.tree_max_token or default_tree_max_token,
     )
 
     # 取得したコードと文字数やトークン数、chunkの数を表示する
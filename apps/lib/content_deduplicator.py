@@ -0,0 +1,171 @@
+import hashlib
+import random
+import re
+from collections import defaultdict
+
+from apps.lib.utils import count_tokens, print_colored
+from apps.lib.web_crawler_scraper import ScrapedData
+
+# MinHashの計算に使うメルセンヌ素数
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def hash_text(text: str) -> int:
+    """テキストから64bitの安定したハッシュ値を計算する"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def normalize_text(text: str) -> str:
+    """比較のために空白を詰めて小文字に揃える"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class ContentDeduplicator:
+    """複数ページに繰り返し出現する段落と、ほぼ重複したページを除去する
+
+    段落(ブロック)のハッシュ値の出現ページ数を数え、min_pages以上のページに出現する段落は最初のページにだけ残す。
+    また、MinHashとLSHでページ同士の類似度を推定し、near_duplicate_threshold以上のページは最初のページだけを残す。
+    """
+
+    min_pages: int
+    min_chars: int
+    near_duplicate_threshold: float
+    shingle_size: int
+    bands: int
+    rows: int
+    permutations: list[tuple[int, int]]
+
+    def __init__(
+        self,
+        min_pages: int = 3,
+        min_chars: int = 20,
+        near_duplicate_threshold: float = 0.9,
+        shingle_size: int = 5,
+        bands: int = 16,
+        rows: int = 4,
+    ):
+        """
+        Args:
+            min_pages (int): このページ数以上に出現する段落を繰り返しと判定する
+            min_chars (int): これ未満の文字数の段落(見出しなど)は除去しない
+            near_duplicate_threshold (float): 推定Jaccard係数がこれ以上のページを重複と判定する
+            shingle_size (int): シングルの単語数(空白で区切らない言語の場合は文字数)
+            bands (int): LSHのバンド数
+            rows (int): LSHの1バンドあたりの行数
+        """
+        self.min_pages = min_pages
+        self.min_chars = min_chars
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = rows
+        # 再現性のために固定のシードでハッシュ関数の係数を生成する
+        generator = random.Random(0)
+        self.permutations = [
+            (generator.randrange(1, MERSENNE_PRIME), generator.randrange(0, MERSENNE_PRIME))
+            for _ in range(bands * rows)
+        ]
+
+    def deduplicate(self, scraped_data: list[ScrapedData]) -> list[ScrapedData]:
+        """繰り返しの段落とほぼ重複したページを除去したスクレイプデータを返す"""
+        deduplicated = self.remove_near_duplicate_pages(scraped_data)
+        deduplicated = self.remove_repeated_paragraphs(deduplicated)
+
+        before_tokens = sum(data.token_size for data in scraped_data)
+        after_tokens = sum(data.token_size for data in deduplicated)
+        print_colored(
+            ("Deduplicated: ", "green"),
+            f"{len(scraped_data)} -> {len(deduplicated)} pages, {before_tokens} -> {after_tokens} tokens",
+        )
+        return deduplicated
+
+    def remove_repeated_paragraphs(self, scraped_data: list[ScrapedData]) -> list[ScrapedData]:
+        """min_pages以上のページに出現する段落を、最初に出現したページ以外から除去する"""
+        # 段落ごとに出現したページ数を数える
+        page_counts: defaultdict[int, int] = defaultdict(int)
+        for data in scraped_data:
+            for paragraph_hash in {hash_text(normalize_text(p)) for p in self.get_paragraphs(data)}:
+                page_counts[paragraph_hash] += 1
+
+        seen: set[int] = set()
+        result: list[ScrapedData] = []
+        for data in scraped_data:
+            paragraphs = self.get_paragraphs(data)
+            kept: list[str] = []
+            for paragraph in paragraphs:
+                paragraph_hash = hash_text(normalize_text(paragraph))
+                is_repeated = len(paragraph) >= self.min_chars and page_counts[paragraph_hash] >= self.min_pages
+                if is_repeated and paragraph_hash in seen:
+                    continue
+                seen.add(paragraph_hash)
+                kept.append(paragraph)
+
+            if len(kept) == len(paragraphs):
+                result.append(data)
+                continue
+            if not kept:
+                continue
+            content = " ".join(kept)
+            result.append(
+                ScrapedData(
+                    url=data.url,
+                    content=content,
+                    token_size=count_tokens(content),
+                    char_size=len(content),
+                    blocks=kept,
+                )
+            )
+        return result
+
+    def remove_near_duplicate_pages(self, scraped_data: list[ScrapedData]) -> list[ScrapedData]:
+        """MinHashで推定した類似度が閾値以上のページを、最初のページ以外から除去する"""
+        buckets: defaultdict[tuple[int, tuple[int, ...]], list[int]] = defaultdict(list)
+        signatures: list[list[int]] = []
+        result: list[ScrapedData] = []
+
+        for data in scraped_data:
+            signature = self.minhash(data.content)
+            bands = [
+                (band, tuple(signature[band * self.rows : (band + 1) * self.rows])) for band in range(self.bands)
+            ]
+
+            # 同じバンドを持つページだけを候補として類似度を比較する
+            candidates = {index for key in bands for index in buckets.get(key, [])}
+            if any(
+                self.estimate_similarity(signature, signatures[index]) >= self.near_duplicate_threshold
+                for index in candidates
+            ):
+                print_colored(("  - Near duplicate: ", "grey"), (data.url, "grey"))
+                continue
+
+            index = len(signatures)
+            signatures.append(signature)
+            for key in bands:
+                buckets[key].append(index)
+            result.append(data)
+        return result
+
+    def get_paragraphs(self, data: ScrapedData) -> list[str]:
+        """スクレイプデータの段落を取得する。段落の情報が無い場合は本文全体を1つの段落とする"""
+        return data.blocks or [data.content]
+
+    def shingles(self, text: str) -> set[str]:
+        """テキストをシングル(連続する単語または文字の組)の集合に変換する"""
+        text = normalize_text(text)
+        tokens: list[str] = text.split(" ")
+        # 空白で区切らない言語(日本語など)の場合は文字単位にする
+        if len(tokens) == 1 or len(text) / len(tokens) > 15:
+            tokens = list(text)
+        if len(tokens) <= self.shingle_size:
+            return {" ".join(tokens)}
+        return {" ".join(tokens[i : i + self.shingle_size]) for i in range(len(tokens) - self.shingle_size + 1)}
+
+    def minhash(self, text: str) -> list[int]:
+        """テキストのMinHashシグネチャを計算する"""
+        hashes = [hash_text(shingle) for shingle in self.shingles(text)]
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.permutations]
+
+    @staticmethod
+    def estimate_similarity(signature_a: list[int], signature_b: list[int]) -> float:
+        """MinHashシグネチャからJaccard係数を推定する"""
+        return sum(a == b for a, b in zip(signature_a, signature_b)) / len(signature_a)
@@ -0,0 +1,27 @@
+import hashlib
+
+
+def hash_content(text: str) -> bytes:
+    """空白の違いを無視して本文のハッシュ値を計算する"""
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).digest()
+
+
+class ContentHashIndex:
+    """本文のハッシュ値から、同じ内容のページを取得済みかを判定する
+
+    URLが異なっていても内容が同じページ(ミラーや別名のパスなど)を、取得した直後に検出する。
+    """
+
+    urls: dict[bytes, str]
+
+    def __init__(self) -> None:
+        self.urls = {}
+
+    def find_duplicate(self, url: str, text: str) -> str | None:
+        """同じ内容のページを取得済みの場合はそのURLを返す。初めての内容の場合は登録してNoneを返す"""
+        if not text.strip():
+            # 本文が無いページ同士は重複として扱わない
+            return None
+        content_hash = hash_content(text)
+        duplicate_url = self.urls.setdefault(content_hash, url)
+        return duplicate_url if duplicate_url != url else None
@@ -0,0 +1,74 @@
+from collections import Counter, defaultdict
+from typing import Literal
+from urllib.parse import urlparse
+
+from apps.lib.html_extractor import TextBlock
+
+BlockClass = Literal["good", "bad", "short"]
+
+
+class ContentScorer:
+    """Readability風のスコアリングでページの本文ブロックを選別する
+
+    テキスト密度、リンク密度、class/id属性のヒント、同じサイトの複数ページで繰り返し出現するブロックの検出により、
+    サイドバーやクッキーバナー、メニューなどの本文以外のブロックを除去する。
+    """
+
+    max_link_density: float
+    min_chars: int
+    min_repeat: int
+    block_counts: defaultdict[str, Counter[int]]
+
+    def __init__(self, max_link_density: float = 0.5, min_chars: int = 40, min_repeat: int = 3):
+        """
+        Args:
+            max_link_density (float): これを超えるリンク密度のブロックを本文以外と判定する
+            min_chars (int): これ未満の文字数のブロックは前後のブロックに応じて判定する
+            min_repeat (int): 同じサイトでこのページ数以上に出現したブロックを本文以外と判定する
+        """
+        self.max_link_density = max_link_density
+        self.min_chars = min_chars
+        self.min_repeat = min_repeat
+        self.block_counts = defaultdict(Counter)
+
+    def select_blocks(self, url: str, blocks: list[TextBlock]) -> list[TextBlock]:
+        """ページのブロックから本文のブロックを選別する"""
+        host = urlparse(url).netloc
+
+        # main要素やarticle要素がある場合は、その中のブロックだけを候補にする
+        candidates = [block for block in blocks if block.in_main] or blocks
+
+        classes = [self.classify_block(host, block) for block in candidates]
+        selected = [
+            block
+            for i, block in enumerate(candidates)
+            if classes[i] == "good" or (classes[i] == "short" and self.is_surrounded_by_good(classes, i))
+        ]
+
+        # 同じサイトの他のページと比較するために、ブロックの出現回数を記録する
+        self.block_counts[host].update({hash(block.text) for block in blocks})
+
+        # 本文と判定されたブロックが無い場合は、本文以外と判定されたもの以外を返す
+        if not selected:
+            selected = [block for i, block in enumerate(candidates) if classes[i] != "bad"]
+        return selected
+
+    def classify_block(self, host: str, block: TextBlock) -> BlockClass:
+        """ブロックを本文(good)、本文以外(bad)、短いブロック(short)に分類する"""
+        if block.negative_hint:
+            return "bad"
+        if block.link_density > self.max_link_density:
+            return "bad"
+        if self.block_counts[host][hash(block.text)] >= self.min_repeat:
+            return "bad"
+        if len(block.text) < self.min_chars:
+            return "short"
+        return "good"
+
+    @staticmethod
+    def is_surrounded_by_good(classes: list[BlockClass], index: int) -> bool:
+        """短いブロックの前後で最も近い短くないブロックが本文であるかを判定する"""
+        previous_class = next((c for c in reversed(classes[:index]) if c != "short"), None)
+        next_class = next((c for c in classes[index + 1 :] if c != "short"), None)
+        neighbors = [c for c in (previous_class, next_class) if c is not None]
+        return len(neighbors) > 0 and all(c == "good" for c in neighbors)
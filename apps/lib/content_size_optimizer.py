@@ -61,6 +61,10 @@ class ContentSizeOptimizer:
             calc_sized_content: CalcSizedContent = self.calc_size_content(content)
             self.calc_sized_contents.append(calc_sized_content)
 
+    def prepend_content(self, content: str) -> None:
+        """先頭にコンテンツを追加する。既に計算したコンテンツのトークン数は計算し直さない"""
+        self.calc_sized_contents.insert(0, self.calc_size_content(content))
+
     # 文字数とトークン数を計算して辞書型にして返す
     def calc_size_content(self, content: str) -> CalcSizedContent:
         token_size = count_tokens(content)
@@ -0,0 +1,78 @@
+import mimetypes
+import os
+from urllib.parse import urlparse
+
+# デフォルトで取得を許可するMIMEタイプ
+DEFAULT_ALLOWED_CONTENT_TYPES = ["text/html", "application/xhtml+xml"]
+
+# HTMLを返すことが多い拡張子(mimetypesでは判定できない、または判定結果がHTMLではないもの)
+HTML_EXTENSIONS = frozenset(["", ".html", ".htm", ".xhtml", ".php", ".asp", ".aspx", ".jsp", ".cgi", ".shtml"])
+
+# ファイルの先頭のバイト列(マジックナンバー)とMIMEタイプの対応
+MAGIC_NUMBERS: list[tuple[bytes, str]] = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"RIFF", "application/octet-stream"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"Rar!", "application/vnd.rar"),
+    (b"ID3", "audio/mpeg"),
+    (b"OggS", "audio/ogg"),
+    (b"\x1aE\xdf\xa3", "video/webm"),
+]
+
+
+def parse_content_type(header: str | None) -> str | None:
+    """Content-Typeヘッダーからパラメーターを除いたMIMEタイプを取得する"""
+    if not header:
+        return None
+    return header.split(";", 1)[0].strip().lower() or None
+
+
+def guess_content_type_from_url(url: str) -> str | None:
+    """URLの拡張子からMIMEタイプを推定する。HTMLの可能性がある場合や判定できない場合はNoneを返す"""
+    path = urlparse(url).path
+    extension = os.path.splitext(path)[1].lower()
+    if extension in HTML_EXTENSIONS:
+        return None
+    content_type, _ = mimetypes.guess_type(path)
+    return content_type
+
+
+def has_unknown_extension(url: str) -> bool:
+    """URLがHTML以外の拡張子を持ち、拡張子からMIMEタイプを判定できないかを判定する"""
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    return extension not in HTML_EXTENSIONS and guess_content_type_from_url(url) is None
+
+
+def sniff_content_type(head: bytes) -> str | None:
+    """本文の先頭のバイト列からMIMEタイプを推定する"""
+    for magic_number, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic_number):
+            return content_type
+    # MP4やQuickTimeなどのISOメディアファイル
+    if head[4:8] == b"ftyp":
+        return "video/mp4"
+    text = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith((b"<!doctype html", b"<html", b"<head", b"<body", b"<!--", b"<div", b"<meta", b"<title")):
+        return "text/html"
+    if text.startswith(b"<?xml"):
+        return "application/xhtml+xml" if b"<html" in text else "application/xml"
+    return None
+
+
+def is_allowed_content_type(content_type: str | None, allowed_content_types: list[str]) -> bool:
+    """MIMEタイプが許可リストに含まれるかを判定する。"text/*" のようなワイルドカードに対応する"""
+    if content_type is None:
+        return False
+    for allowed in allowed_content_types:
+        if allowed.endswith("/*"):
+            if content_type.startswith(allowed[:-1]):
+                return True
+        elif content_type == allowed:
+            return True
+    return False
@@ -0,0 +1,230 @@
+import bisect
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+from urllib.parse import urlparse
+
+from apps.lib.utils import format_number, print_colored
+
+# レイテンシのヒストグラムのバケットの上限(秒)
+LATENCY_BUCKETS: tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class LatencyHistogram:
+    """レイテンシをバケットごとに数えるヒストグラム"""
+
+    counts: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """q(0〜1)分位点が含まれるバケットの上限を返す。最大値を超える場合は最大値を返す"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                upper_bound = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max_seconds
+                return min(upper_bound, self.max_seconds)
+        return self.max_seconds
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_seconds": round(self.mean_seconds, 4),
+            "p50_seconds": self.percentile(0.5),
+            "p90_seconds": self.percentile(0.9),
+            "p99_seconds": self.percentile(0.99),
+            "max_seconds": round(self.max_seconds, 4),
+            "buckets": {
+                **{f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS, self.counts)},
+                "le_inf": self.counts[-1],
+            },
+        }
+
+
+@dataclass
+class TimerStat:
+    """処理時間の合計と回数"""
+
+    count: int = 0
+    total_seconds: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total_seconds, 4),
+            "mean_seconds": round(self.total_seconds / self.count, 6) if self.count else 0.0,
+        }
+
+
+class CrawlMetrics:
+    """クロールのスループットと処理時間を集計する
+
+    ページ数・バイト数のスループット、ホストごとのレイテンシのヒストグラム、解析とトークン数の計算の時間、
+    探索待ちのURL数を記録する。取得スレッドから呼ばれるためスレッドセーフに動作する。
+    """
+
+    live_interval: float
+    started_at: float
+    pages: int
+    bytes: int
+    errors: int
+    status_codes: dict[int, int]
+    host_latencies: dict[str, LatencyHistogram]
+    parse: TimerStat
+    tokenize: TimerStat
+    queue_depth: int
+    max_queue_depth: int
+    in_flight: int
+
+    def __init__(self, live_interval: float = 5.0):
+        """
+        Args:
+            live_interval (float): 途中経過を表示する間隔(秒)
+        """
+        self.live_interval = live_interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """集計をリセットし、計測を開始する"""
+        with self._lock:
+            self.started_at = time.monotonic()
+            self._last_printed_at = self.started_at
+            self.pages = 0
+            self.bytes = 0
+            self.errors = 0
+            self.status_codes = {}
+            self.host_latencies = {}
+            self.parse = TimerStat()
+            self.tokenize = TimerStat()
+            self.queue_depth = 0
+            self.max_queue_depth = 0
+            self.in_flight = 0
+
+    def record_response(self, url: str, status_code: int, seconds: float) -> None:
+        """レスポンスのステータスコードと、レスポンスヘッダーを受け取るまでの時間を記録する"""
+        host = urlparse(url).netloc
+        with self._lock:
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+            self.host_latencies.setdefault(host, LatencyHistogram()).observe(seconds)
+
+    def record_page(self, content_bytes: int) -> None:
+        """取得したページのバイト数を記録する"""
+        with self._lock:
+            self.pages += 1
+            self.bytes += content_bytes
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def record_parse(self, seconds: float) -> None:
+        with self._lock:
+            self.parse.observe(seconds)
+
+    def record_tokenize(self, seconds: float) -> None:
+        with self._lock:
+            self.tokenize.observe(seconds)
+
+    def record_queue(self, queue_depth: int, in_flight: int = 0) -> None:
+        """探索待ちのURL数と、取得・解析中のページ数を記録する"""
+        with self._lock:
+            self.queue_depth = queue_depth
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            self.in_flight = in_flight
+
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def pages_per_second(self) -> float:
+        return self.pages / max(self.elapsed_seconds(), 1e-9)
+
+    def bytes_per_second(self) -> float:
+        return self.bytes / max(self.elapsed_seconds(), 1e-9)
+
+    def summary(self) -> str:
+        """1行の途中経過を返す"""
+        return (
+            f"{self.pages_per_second():.1f} pages/s, {self.bytes_per_second() / 1024:.1f} KiB/s, "
+            f"queue {self.queue_depth}, in flight {self.in_flight}, errors {self.errors}"
+        )
+
+    def print_live_summary(self) -> None:
+        """前回の表示からlive_interval秒以上経っている場合に、途中経過を表示する"""
+        now = time.monotonic()
+        if now - self._last_printed_at < self.live_interval:
+            return
+        self._last_printed_at = now
+        print_colored(("Metrics: ", "magenta"), self.summary())
+
+    def print_summary(self) -> None:
+        """集計結果を表示する。レイテンシの平均が遅いホストから表示する"""
+        print_colored(("Metrics: ", "magenta"), self.summary())
+        print_colored(
+            "  elapsed: ",
+            f"{self.elapsed_seconds():.1f}s",
+            ", pages: ",
+            format_number(self.pages),
+            ", bytes: ",
+            format_number(self.bytes),
+        )
+        print_colored(
+            "  parse: ",
+            f"{self.parse.total_seconds:.2f}s",
+            ", tokenize: ",
+            f"{self.tokenize.total_seconds:.2f}s",
+            ", max queue: ",
+            format_number(self.max_queue_depth),
+        )
+        hosts = sorted(self.host_latencies.items(), key=lambda item: item[1].mean_seconds, reverse=True)
+        for host, histogram in hosts:
+            print_colored(
+                (f"  {host}: ", "grey"),
+                f"{histogram.count} requests, mean {histogram.mean_seconds:.3f}s, ",
+                f"p90 {histogram.percentile(0.9):.3f}s, max {histogram.max_seconds:.3f}s",
+            )
+
+    def to_dict(self) -> dict[str, Any]:
+        """機械で読める形式の集計結果を返す"""
+        with self._lock:
+            return {
+                "elapsed_seconds": round(self.elapsed_seconds(), 4),
+                "pages": self.pages,
+                "bytes": self.bytes,
+                "errors": self.errors,
+                "pages_per_second": round(self.pages_per_second(), 4),
+                "bytes_per_second": round(self.bytes_per_second(), 4),
+                "status_codes": {str(code): count for code, count in sorted(self.status_codes.items())},
+                "parse": self.parse.to_dict(),
+                "tokenize": self.tokenize.to_dict(),
+                "max_queue_depth": self.max_queue_depth,
+                "hosts": {host: histogram.to_dict() for host, histogram in sorted(self.host_latencies.items())},
+            }
+
+    def write_report(self, file_path: str) -> None:
+        """集計結果をJSONファイルに書き出す"""
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        print_colored(("Saved metrics report: ", "green"), file_path)
@@ -7,6 +7,7 @@ from apps.lib.dependency_analyzer.file_analyzer import (
     FileAnalyzerUnknown,
 )
 from apps.lib.enums import ProgramType
+from apps.lib.path_matcher import GLOB_PREFIX, REGEX_PREFIX, PathMatcher
 from apps.lib.utils import make_absolute_path, make_relative_path, print_colored
 
 # デフォルトで無視するディレクトリ名のリスト
@@ -25,6 +26,19 @@ default_ignore_dirs = [
 ]
 
 
+def make_absolute_path_rules(root_path: str, rules: list[str]) -> list[str]:
+    """パスのルール(接頭辞またはglob)が相対パスの場合は絶対パスに変換する。正規表現のルールはそのまま返す"""
+    absolute_rules: list[str] = []
+    for rule in rules:
+        if rule.startswith(REGEX_PREFIX):
+            absolute_rules.append(rule)
+        elif rule.startswith(GLOB_PREFIX):
+            absolute_rules.append(GLOB_PREFIX + make_absolute_path(root_path, rule[len(GLOB_PREFIX) :]))
+        else:
+            absolute_rules.append(make_absolute_path(root_path, rule))
+    return absolute_rules
+
+
 def get_all_file_paths(
     root_path: str,
     scope_paths: list[str] | None = None,
@@ -51,29 +65,25 @@ def get_all_file_paths(
     if extensions is None:
         extensions = (".py", ".js", ".json", ".jsx", ".ts", ".tsx")
 
+    # 探索範囲と無視するパスを、パスの数によらないマッチャーにまとめる
+    scope_matcher = PathMatcher.from_rules(make_absolute_path_rules(root_path, scope_paths))
+    ignore_matcher = PathMatcher.from_rules(make_absolute_path_rules(root_path, ignore_paths))
+    ignore_dir_names = set(ignore_dirs)
+
     all_file_paths: list[str] = []
     for root, dirs, files in os.walk(root_path):
-        # 無視するディレクトリをここで除外
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
+        # 無視するディレクトリをここで除外。無視するパスに一致するディレクトリの中も探索しない
+        dirs[:] = [d for d in dirs if d not in ignore_dir_names and not ignore_matcher.matches(os.path.join(root, d))]
         for file in files:
-            if file.endswith(extensions):
-                all_file_paths.append(os.path.join(root, file))
-
-    if len(scope_paths) > 0:
-        # scope_paths が相対パスの場合は絶対パスに変換する
-        scope_paths = [make_absolute_path(root_path, p) for p in scope_paths]
-
-        # 収集したファイルパスから探索範囲外のパスを除外する。
-        all_file_paths = [p for p in all_file_paths if any([p.startswith(scope_path) for scope_path in scope_paths])]
-
-    if len(ignore_paths) > 0:
-        # ignore_paths が相対パスの場合は絶対パスに変換する
-        ignore_paths = [make_absolute_path(root_path, p) for p in ignore_paths]
-
-        # 収集したファイルパスから無視するパスを除外する。
-        all_file_paths = [
-            p for p in all_file_paths if not any([p.startswith(ignore_path) for ignore_path in ignore_paths])
-        ]
+            if not file.endswith(extensions):
+                continue
+            file_path = os.path.join(root, file)
+            # 探索範囲外のパスと無視するパスを除外する
+            if scope_matcher and not scope_matcher.matches(file_path):
+                continue
+            if ignore_matcher.matches(file_path):
+                continue
+            all_file_paths.append(file_path)
 
     return all_file_paths
 
@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+
+from pypdf import PdfReader
+from pypdf.errors import PyPdfError
+
+from apps.lib.utils import print_colored
+
+# テキストを抽出できるドキュメントのMIMEタイプと、一時ファイルの拡張子
+DOCUMENT_CONTENT_TYPES: dict[str, str] = {
+    "application/pdf": ".pdf",
+}
+
+
+def extract_pdf_pages(file_path: str, start: int, end: int) -> list[str]:
+    """PDFのstartからendの手前までのページからテキストを抽出する
+
+    ワーカープロセスで実行するため、pickleできるようにトップレベルの関数として定義する。
+    """
+    reader = PdfReader(file_path)
+    texts: list[str] = []
+    for index in range(start, end):
+        text = reader.pages[index].extract_text()
+        texts.append(" ".join(text.split()))
+    return texts
+
+
+@dataclass
+class ExtractedDocument:
+    url: str
+    # ページごとのテキスト
+    pages: list[str]
+
+
+@dataclass
+class PendingDocument:
+    url: str
+    file_path: str
+    futures: list[Future[list[str]]]
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+
+class DocumentExtractor:
+    """ダウンロードしたドキュメント(PDF)のテキストを、ワーカープロセスのプールでページごとに抽出する
+
+    submitは抽出の完了を待たずに戻るため、HTMLのクロールを止めずにドキュメントを処理できる。
+    抽出が完了したドキュメントはcollectで受け取り、一時ファイルはその時点で削除する。
+    """
+
+    max_workers: int | None
+    pages_per_task: int
+    pending_documents: list[PendingDocument]
+
+    def __init__(self, max_workers: int | None = None, pages_per_task: int = 10):
+        """
+        Args:
+            max_workers (int | None): ワーカープロセスの数。Noneの場合はCPUの数
+            pages_per_task (int): 1つのタスクで抽出するページ数
+        """
+        self.max_workers = max_workers
+        self.pages_per_task = pages_per_task
+        self.pending_documents = []
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """ワーカープロセスのプールを取得する。最初のドキュメントが来るまでプロセスを起動しない"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    @staticmethod
+    def is_document(content_type: str | None) -> bool:
+        """MIMEタイプがテキストを抽出できるドキュメントかを判定する"""
+        return content_type in DOCUMENT_CONTENT_TYPES
+
+    def submit(self, url: str, file_path: str) -> None:
+        """ドキュメントのテキスト抽出をワーカープロセスに投入する"""
+        try:
+            page_count = len(PdfReader(file_path).pages)
+        except (PyPdfError, OSError, ValueError) as e:
+            print_colored((f"Error reading document {url}: {e}", "red"))
+            self.remove_file(file_path)
+            return
+
+        futures = [
+            self.executor.submit(extract_pdf_pages, file_path, start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+        self.pending_documents.append(PendingDocument(url=url, file_path=file_path, futures=futures))
+        print_colored(("  + Document: ", "cyan"), f"{page_count} pages ", (url, "grey"))
+
+    def collect(self, wait: bool = False) -> list[ExtractedDocument]:
+        """テキストの抽出が完了したドキュメントを取得する
+
+        Args:
+            wait (bool): Trueの場合は投入済みの全てのドキュメントの抽出が完了するまで待つ
+        """
+        extracted_documents: list[ExtractedDocument] = []
+        remaining_documents: list[PendingDocument] = []
+        for document in self.pending_documents:
+            if not wait and not document.done():
+                remaining_documents.append(document)
+                continue
+
+            try:
+                pages = [text for future in document.futures for text in future.result()]
+                extracted_documents.append(ExtractedDocument(url=document.url, pages=[p for p in pages if p]))
+            except Exception as e:
+                print_colored((f"Error extracting document {document.url}: {e}", "red"))
+            finally:
+                self.remove_file(document.file_path)
+        self.pending_documents = remaining_documents
+        return extracted_documents
+
+    def shutdown(self) -> None:
+        """未完了の抽出を取り消し、一時ファイルとワーカープロセスを片付ける"""
+        for document in self.pending_documents:
+            for future in document.futures:
+                future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        for document in self.pending_documents:
+            self.remove_file(document.file_path)
+        self.pending_documents = []
+
+    @staticmethod
+    def remove_file(file_path: str) -> None:
+        """一時ファイルを削除する"""
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,145 @@
+import dataclasses
+import json
+import re
+from typing import Any
+
+import lxml.html
+from lxml import etree
+
+from apps.lib.html_extractor import ExtractedPage, HtmlExtractorLxml, TextBlock
+
+# JSONが埋め込まれるscript要素のtype属性
+JSON_SCRIPT_TYPES = frozenset(["application/json", "application/ld+json"])
+
+# window.__INITIAL_STATE__ = {...} のようなハイドレーション用の代入文
+HYDRATION_PATTERN = re.compile(r"(?:window|self|globalThis)\.__[A-Za-z0-9_]+__\s*=\s*(?=[{\[])")
+
+# 本文ではない値を持つキー
+SKIP_KEYS = frozenset(
+    [
+        "@context",
+        "@id",
+        "@type",
+        "buildId",
+        "className",
+        "compiledSource",
+        "contentType",
+        "href",
+        "id",
+        "image",
+        "locale",
+        "path",
+        "slug",
+        "src",
+        "style",
+        "type",
+        "url",
+    ]
+)
+
+# コードと判定する記号
+CODE_CHARS_PATTERN = re.compile(r"[{};=<>()\[\]]")
+
+
+def find_embedded_json(html: bytes | str) -> list[Any]:
+    """HTMLに埋め込まれたJSON(__NEXT_DATA__、JSON-LD、ハイドレーション用のデータ)を取得する"""
+    try:
+        root = lxml.html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return []
+
+    decoder = json.JSONDecoder()
+    payloads: list[Any] = []
+    for script in root.iter("script"):
+        source = script.text
+        if not source:
+            continue
+        script_type = (script.get("type") or "").split(";", 1)[0].strip().lower()
+        if script_type in JSON_SCRIPT_TYPES or script.get("id") == "__NEXT_DATA__":
+            try:
+                payloads.append(json.loads(source))
+            except json.JSONDecodeError:
+                pass
+            continue
+
+        # JSONとして読める代入文だけを取り出す(JavaScriptのオブジェクトリテラルは対象外)
+        for match in HYDRATION_PATTERN.finditer(source):
+            try:
+                payload, _ = decoder.raw_decode(source, match.end())
+            except json.JSONDecodeError:
+                continue
+            payloads.append(payload)
+    return payloads
+
+
+class EmbeddedJsonExtractor:
+    """クライアントサイドで描画されるページの本文を、HTMLに埋め込まれたJSONから復元する
+
+    Next.jsの__NEXT_DATA__やJSON-LD、window.__XXX__ = {...} のハイドレーション用のデータを走査し、
+    本文らしい文字列を段落として取り出す。ヘッドレスブラウザを使わずに本文を取得できる。
+    """
+
+    min_page_chars: int
+    min_chars: int
+    max_code_ratio: float
+
+    def __init__(self, min_page_chars: int = 200, min_chars: int = 20, max_code_ratio: float = 0.05):
+        """
+        Args:
+            min_page_chars (int): HTMLから抽出した本文がこの文字数未満の場合に、埋め込まれたJSONから復元する
+            min_chars (int): これ未満の文字数の文字列(ラベルや識別子など)は本文として扱わない
+            max_code_ratio (float): コードの記号の割合がこれを超える文字列は本文として扱わない
+        """
+        self.min_page_chars = min_page_chars
+        self.min_chars = min_chars
+        self.max_code_ratio = max_code_ratio
+
+    def recover(self, page: ExtractedPage, html: bytes | str) -> ExtractedPage:
+        """本文がほとんど無いページの場合は、埋め込まれたJSONから復元した本文に置き換える"""
+        page_chars = sum(len(block.text) for block in page.blocks)
+        if page_chars >= self.min_page_chars:
+            return page
+
+        blocks = self.extract(html)
+        if sum(len(block.text) for block in blocks) <= page_chars:
+            return page
+        # リンクや<link rel="canonical">のURLはHTMLから抽出したものを使う
+        return dataclasses.replace(page, blocks=blocks)
+
+    def extract(self, html: bytes | str) -> list[TextBlock]:
+        """埋め込まれたJSONから本文らしい文字列を段落として取り出す"""
+        blocks: list[TextBlock] = []
+        seen: set[str] = set()
+        for payload in find_embedded_json(html):
+            for text in self.extract_texts(payload):
+                if text not in seen:
+                    seen.add(text)
+                    blocks.append(TextBlock(text=text))
+        return blocks
+
+    def extract_texts(self, payload: Any) -> list[str]:
+        """JSONの値を文書順に走査し、本文らしい文字列を取り出す"""
+        texts: list[str] = []
+        # 再帰を使わずにスタックで走査する
+        stack: list[Any] = [payload]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, dict):
+                stack.extend(item for key, item in reversed(value.items()) if key not in SKIP_KEYS)
+            elif isinstance(value, list):
+                stack.extend(reversed(value))
+            elif isinstance(value, str):
+                texts.extend(self.to_texts(value))
+        return texts
+
+    def to_texts(self, value: str) -> list[str]:
+        """文字列が本文らしい場合は、空白を詰めた段落のテキストのリストを返す"""
+        if len(value) < self.min_chars or value.startswith(("http://", "https://", "/", "data:")):
+            return []
+        if "</" in value:
+            # HTMLで書かれた本文(contentHtmlなど)は、見出しも含めてブロックレベル要素ごとの段落に分ける
+            return [block.text for block in HtmlExtractorLxml().extract(value).blocks]
+        if len(CODE_CHARS_PATTERN.findall(value)) / len(value) > self.max_code_ratio:
+            return []
+        text = " ".join(value.split())
+        return [text] if len(text) >= self.min_chars else []
@@ -1,7 +1,13 @@
+import json
 import os
+from abc import ABC, abstractmethod
+from typing import Any, Literal, cast
 
 from apps.lib.utils import print_colored
 
+RecordFormat = Literal["jsonl", "parquet"]
+record_formats = cast(list[str], RecordFormat.__args__)
+
 
 class FileWriter:
     """ファイルに書き出す"""
@@ -35,3 +41,121 @@ class FileWriter:
         if not os.path.exists(self.file_dir):
             print_colored(("\nCreating New Directory: ", "green"), self.file_dir)
             os.makedirs(self.file_dir)
+
+
+class RecordWriterIF(ABC):
+    """レコードを1件ずつファイルに追記するクラスのインターフェース
+
+    全てのレコードをメモリに溜めずに書き出すため、大量のレコードでもメモリ使用量が一定になる。
+    """
+
+    file_path: str
+    file_dir: str
+    record_count: int
+
+    def __init__(self, file_name: str, file_dir: str, extension: str):
+        """ファイル名とファイルのディレクトリを指定する"""
+        self.file_dir = os.path.expanduser(file_dir)
+        self.file_path = os.path.join(self.file_dir, f"{file_name}.{extension}")
+        self.record_count = 0
+
+    def __enter__(self) -> "RecordWriterIF":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    # レコードを書き出す
+    @abstractmethod
+    def write_record(self, record: dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    # ファイルを閉じる
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def create_dir(self) -> None:
+        """ディレクトリが存在しない場合は作成する"""
+        if not os.path.exists(self.file_dir):
+            print_colored(("\nCreating New Directory: ", "green"), self.file_dir)
+            os.makedirs(self.file_dir)
+
+
+class JsonlRecordWriter(RecordWriterIF):
+    """レコードをJSON Linesの1行として追記する"""
+
+    def __init__(self, file_name: str, file_dir: str):
+        super().__init__(file_name, file_dir, extension="jsonl")
+        self.create_dir()
+        self._file = open(self.file_path, "w", encoding="utf-8")
+
+    def write_record(self, record: dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 途中で中断しても、書き出したレコードを他のツールから読めるようにする
+        self._file.flush()
+        self.record_count += 1
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+            print_colored(("Saved to File: ", "green"), f"{self.file_path} ({self.record_count} records)")
+
+
+class ParquetRecordWriter(RecordWriterIF):
+    """レコードをbatch_size件ごとにParquetの行グループとして書き出す
+
+    pyarrowが必要。スキーマは最初の行グループから推定するため、レコードの値にNoneを含めないこと。
+    """
+
+    batch_size: int
+    rows: list[dict[str, Any]]
+
+    def __init__(self, file_name: str, file_dir: str, batch_size: int = 1000):
+        super().__init__(file_name, file_dir, extension="parquet")
+        try:
+            import pyarrow  # noqa: F401
+            import pyarrow.parquet  # noqa: F401
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow. Install it with `pip install pyarrow`.") from e
+        self.batch_size = batch_size
+        self.rows = []
+        self._writer = None
+        self.create_dir()
+
+    def write_record(self, record: dict[str, Any]) -> None:
+        self.rows.append(record)
+        self.record_count += 1
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """溜めているレコードを行グループとして書き出す"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.rows:
+            return
+        if self._writer is None:
+            table = pa.Table.from_pylist(self.rows)
+            self._writer = pq.ParquetWriter(self.file_path, table.schema)
+        else:
+            table = pa.Table.from_pylist(self.rows, schema=self._writer.schema)
+        self._writer.write_table(table)
+        self.rows = []
+
+    def close(self) -> None:
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            print_colored(("Saved to File: ", "green"), f"{self.file_path} ({self.record_count} records)")
+
+
+def get_record_writer(record_format: RecordFormat, file_name: str, file_dir: str) -> RecordWriterIF:
+    """出力形式に対応するレコードの書き出しクラスを取得する"""
+    if record_format == "jsonl":
+        return JsonlRecordWriter(file_name=file_name, file_dir=file_dir)
+    if record_format == "parquet":
+        return ParquetRecordWriter(file_name=file_name, file_dir=file_dir)
+    raise ValueError(f"Unknown record format: {record_format}")
@@ -0,0 +1,169 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.generative_models import GenerativeModel
+from google.generativeai.types.content_types import ContentDict
+
+try:
+    # CachedContentはgoogle-generativeai 0.7以降で使える
+    from google.generativeai import caching  # type: ignore[attr-defined]
+except ImportError:
+    caching = None
+
+# Geminiのコンテキストキャッシュを作成できる最小のトークン数
+MIN_CONTEXT_CACHE_TOKENS = 32_768
+
+
+def is_context_cache_supported() -> bool:
+    """インストールされているgoogle-generativeaiがコンテキストキャッシュに対応しているかを返す"""
+    return caching is not None and hasattr(GenerativeModel, "from_cached_content")
+
+
+def estimate_gemini_tokens(system_instruction: str | None, contents: list[ContentDict]) -> int:
+    """APIを呼ばずにトークン数を少なめに見積もる。1トークンを4文字として数える"""
+    characters = len(system_instruction or "")
+    for content in contents:
+        characters += sum(len(part.get("text", "")) for part in content["parts"])  # type: ignore
+    return characters // 4
+
+
+@dataclass
+class ContextCacheEntry:
+    """作成したコンテキストキャッシュと、それを参照するモデル"""
+
+    cached_content: Any
+    model: GenerativeModel
+    expires_at: float
+
+
+class GeminiContextCache:
+    """システム指示と先頭のメッセージ(プレフィックス)をGeminiのコンテキストキャッシュに保存し、使い回す
+
+    同じプレフィックスで何度も呼び出す場合に、プレフィックスのトークンを毎回送らずに済む。
+    キャッシュはプレフィックスのハッシュごとに作成し、期限が近づいたら延長する。
+    コンテキストキャッシュに対応していないSDKや、最小のトークン数に満たない場合はNoneを返し、通常のモデルを使わせる。
+    """
+
+    ttl: float
+    refresh_margin: float
+    min_tokens: int
+    max_entries: int
+
+    def __init__(
+        self,
+        ttl: float = 10 * 60,
+        refresh_margin: float = 60,
+        min_tokens: int = MIN_CONTEXT_CACHE_TOKENS,
+        max_entries: int = 16,
+    ):
+        """
+        Args:
+            ttl (float): キャッシュの有効期間(秒)。使うたびに延長する
+            refresh_margin (float): 期限までの残りがこの秒数を下回ったら延長する
+            min_tokens (int): キャッシュを作成するプレフィックスの最小のトークン数
+            max_entries (int): 保持するキャッシュの数の上限。超えた場合は最も古く使ったものから削除する
+        """
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, ContextCacheEntry] = OrderedDict()
+        # 作成に失敗したプレフィックス。同じリクエストで失敗を繰り返さない
+        self._failed_keys: set[str] = set()
+
+    @staticmethod
+    def make_key(model_name: str, system_instruction: str | None, contents: list[ContentDict]) -> str:
+        payload = {"model": model_name, "system_instruction": system_instruction, "contents": contents}
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def is_cacheable(self, system_instruction: str | None, contents: list[ContentDict]) -> bool:
+        return is_context_cache_supported() and estimate_gemini_tokens(system_instruction, contents) >= self.min_tokens
+
+    def get_model(
+        self, model_name: str, system_instruction: str | None, contents: list[ContentDict]
+    ) -> GenerativeModel | None:
+        """プレフィックスをキャッシュしたモデルを返す。キャッシュを使えない場合はNoneを返す
+
+        genai.configureでAPIキーを設定してから呼ぶ。
+        """
+        if not self.is_cacheable(system_instruction, contents):
+            return None
+
+        key = self.make_key(model_name, system_instruction, contents)
+        # ロックは辞書の読み書きだけに使い、キャッシュの作成などのAPIの呼び出しは他のスレッドを待たせずに行う
+        with self._lock:
+            if key in self._failed_keys:
+                return None
+            entry = self._entries.get(key)
+
+        evicted: list[ContextCacheEntry] = []
+        try:
+            if entry is None or entry.expires_at <= time.time():
+                created = self._create(model_name, system_instruction, contents)
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and entry.expires_at > time.time():
+                        # 別のスレッドが同時に作成した場合は、先に登録されたものを使う
+                        evicted.append(created)
+                    else:
+                        entry = created
+                        self._entries[key] = entry
+            elif entry.expires_at - time.time() < self.refresh_margin:
+                self._refresh(entry)
+        except google_exceptions.GoogleAPIError as e:
+            # モデルがキャッシュに対応していない場合などは、通常のモデルで続ける
+            print(f"コンテキストキャッシュを使わずに続けます: {e}")
+            with self._lock:
+                self._failed_keys.add(key)
+                self._entries.pop(key, None)
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for oldest in evicted:
+            self._delete(oldest)
+        return entry.model
+
+    def _create(
+        self, model_name: str, system_instruction: str | None, contents: list[ContentDict]
+    ) -> ContextCacheEntry:
+        cached_content = caching.CachedContent.create(  # type: ignore[union-attr]
+            model=model_name,
+            system_instruction=system_instruction,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=self.ttl),
+        )
+        model = GenerativeModel.from_cached_content(cached_content=cached_content)  # type: ignore[attr-defined]
+        return ContextCacheEntry(cached_content=cached_content, model=model, expires_at=time.time() + self.ttl)
+
+    def _refresh(self, entry: ContextCacheEntry) -> None:
+        entry.cached_content.update(ttl=datetime.timedelta(seconds=self.ttl))
+        entry.expires_at = time.time() + self.ttl
+
+    def _delete(self, entry: ContextCacheEntry) -> None:
+        try:
+            entry.cached_content.delete()
+        except google_exceptions.GoogleAPIError:
+            # 期限切れで既に削除されている場合は無視する
+            pass
+
+    def clear(self) -> None:
+        """作成したキャッシュをすべて削除する"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._failed_keys.clear()
+        for entry in entries:
+            self._delete(entry)
@@ -0,0 +1,233 @@
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Literal, cast
+
+import lxml.html
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
+from lxml import etree
+
+ExtractorType = Literal["bs4", "lxml"]
+
+extractor_types = cast(list[str], ExtractorType.__args__)
+
+# 本文以外として除去する要素
+BOILERPLATE_TAGS = frozenset(["header", "footer", "nav", "aside"])
+
+# テキストとして扱わない要素
+NON_TEXT_TAGS = frozenset(["script", "style", "template"])
+
+# テキストブロックの区切りとなるブロックレベル要素
+BLOCK_TAGS = frozenset(
+    (
+        "address article blockquote body dd details dialog div dl dt fieldset figcaption figure form "
+        "h1 h2 h3 h4 h5 h6 hr li main ol p pre section summary table tbody td tfoot th thead title tr ul"
+    ).split()
+)
+
+# 本文を含む要素
+MAIN_TAGS = frozenset(["main", "article"])
+
+# class属性やid属性から本文以外と判定するパターン
+NEGATIVE_HINT_PATTERN = re.compile(
+    r"sidebar|side-bar|menu|breadcrumb|cookie|consent|banner|popup|modal|share|social|"
+    r"related|advert|promo|newsletter|subscribe|pagination",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class TextBlock:
+    """ブロックレベル要素ごとにまとめたテキスト"""
+
+    text: str
+    link_chars: int = 0
+    negative_hint: bool = False
+    in_main: bool = False
+
+    @property
+    def link_density(self) -> float:
+        """テキストのうちリンクテキストが占める割合"""
+        return self.link_chars / max(len(self.text), 1)
+
+
+@dataclass
+class ExtractedPage:
+    """HTMLから抽出した本文テキストとリンク"""
+
+    blocks: list[TextBlock] = field(default_factory=list)
+    links: list[str] = field(default_factory=list)
+    # <link rel="canonical"> で指定されたURL
+    canonical_url: str | None = None
+
+    @property
+    def text(self) -> str:
+        """BeautifulSoupの get_text(separator=" ", strip=True) と同じ形式の本文テキスト"""
+        return " ".join(block.text for block in self.blocks)
+
+
+@dataclass
+class _Context:
+    tag: str
+    in_link: bool
+    negative_hint: bool
+    in_main: bool
+
+
+class _PageBuilder:
+    """走査中の要素の開始・終了・テキストを受け取り、ExtractedPageを組み立てる"""
+
+    def __init__(self) -> None:
+        self.page = ExtractedPage()
+        self.contexts: list[_Context] = [_Context(tag="", in_link=False, negative_hint=False, in_main=False)]
+        self.texts: list[str] = []
+        self.link_chars = 0
+        self.block_context: _Context = self.contexts[0]
+
+    def start(self, tag: str, href: str | None, class_and_id: str, role: str | None, rel: str | None = None) -> None:
+        if tag in BLOCK_TAGS:
+            self.flush()
+        if tag == "a" and href is not None:
+            self.page.links.append(href)
+        if tag == "link" and href and rel and "canonical" in rel.lower().split() and self.page.canonical_url is None:
+            self.page.canonical_url = href
+        parent = self.contexts[-1]
+        self.contexts.append(
+            _Context(
+                tag=tag,
+                in_link=parent.in_link or tag == "a",
+                negative_hint=parent.negative_hint or bool(NEGATIVE_HINT_PATTERN.search(class_and_id)),
+                in_main=parent.in_main or tag in MAIN_TAGS or role == "main",
+            )
+        )
+
+    def end(self, tag: str) -> None:
+        self.contexts.pop()
+        if tag in BLOCK_TAGS:
+            self.flush()
+
+    def text(self, text: str | None) -> None:
+        if not text:
+            return
+        text = text.strip()
+        if not text:
+            return
+        context = self.contexts[-1]
+        if not self.texts:
+            # ブロックの属性は最初のテキストの位置で決める
+            self.block_context = context
+        self.texts.append(text)
+        if context.in_link:
+            self.link_chars += len(text)
+
+    def flush(self) -> None:
+        if self.texts:
+            self.page.blocks.append(
+                TextBlock(
+                    text=" ".join(self.texts),
+                    link_chars=self.link_chars,
+                    negative_hint=self.block_context.negative_hint,
+                    in_main=self.block_context.in_main,
+                )
+            )
+        self.texts = []
+        self.link_chars = 0
+
+    def build(self) -> ExtractedPage:
+        self.flush()
+        return self.page
+
+
+class HtmlExtractorIF(ABC):
+    """HTML抽出クラスのインターフェース"""
+
+    # 本文テキストとリンクを1回の走査で抽出する
+    @abstractmethod
+    def extract(self, html: bytes | str) -> ExtractedPage:
+        raise NotImplementedError
+
+
+class HtmlExtractorBs4(HtmlExtractorIF):
+    """BeautifulSoup(html.parser) を使ったHTML抽出クラス"""
+
+    def extract(self, html: bytes | str) -> ExtractedPage:
+        """本文以外の要素を除きながら、テキストとリンクを抽出する"""
+        soup = BeautifulSoup(html, "html.parser")
+        builder = _PageBuilder()
+
+        # 再帰を使わずにスタックで文書順に走査する
+        stack: list[tuple[Tag | NavigableString, bool]] = [(child, False) for child in reversed(list(soup.children))]
+        while stack:
+            node, is_end = stack.pop()
+            if isinstance(node, Tag):
+                if is_end:
+                    builder.end(node.name)
+                    continue
+                if node.name in BOILERPLATE_TAGS or node.name in NON_TEXT_TAGS:
+                    continue
+                href = node.get("href") if node.name in ("a", "link") else None
+                builder.start(
+                    node.name,
+                    href=str(href) if href is not None else None,
+                    class_and_id=f"{' '.join(node.get_attribute_list('class'))} {node.get('id') or ''}",
+                    role=cast(str | None, node.get("role")),
+                    rel=" ".join(node.get_attribute_list("rel")) if node.name == "link" else None,
+                )
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(list(node.children)))
+            elif type(node) is NavigableString or type(node) is CData:
+                builder.text(node)
+        return builder.build()
+
+
+class HtmlExtractorLxml(HtmlExtractorIF):
+    """lxml(libxml2) を使った高速なHTML抽出クラス"""
+
+    def extract(self, html: bytes | str) -> ExtractedPage:
+        """本文以外の要素を除きながら、テキストとリンクを抽出する"""
+        builder = _PageBuilder()
+        try:
+            root = lxml.html.document_fromstring(html)
+        except (etree.ParserError, ValueError):
+            # 空のドキュメントなど、パースできない場合は空の結果を返す
+            return builder.build()
+
+        # 要素のtextと、要素を抜けた後のtailを文書順に処理する
+        stack: list[tuple[etree._Element, bool]] = [(root, False)]
+        while stack:
+            element, is_end = stack.pop()
+            tag = element.tag
+            if is_end:
+                if isinstance(tag, str) and tag not in BOILERPLATE_TAGS and tag not in NON_TEXT_TAGS:
+                    builder.end(tag)
+                builder.text(element.tail)
+                continue
+
+            # 要素の終了時にtailを処理するため、先に積んでおく
+            stack.append((element, True))
+
+            if not isinstance(tag, str):
+                # コメントや処理命令の本文は無視する
+                continue
+            if tag in BOILERPLATE_TAGS or tag in NON_TEXT_TAGS:
+                continue
+            builder.start(
+                tag,
+                href=element.get("href") if tag in ("a", "link") else None,
+                class_and_id=f"{element.get('class') or ''} {element.get('id') or ''}",
+                role=element.get("role"),
+                rel=element.get("rel") if tag == "link" else None,
+            )
+            builder.text(element.text)
+            stack.extend((child, False) for child in reversed(element))
+        return builder.build()
+
+
+def get_html_extractor(extractor_type: ExtractorType) -> HtmlExtractorIF:
+    """抽出バックエンド名に応じたHTML抽出クラスのインスタンスを返す"""
+    if extractor_type == "bs4":
+        return HtmlExtractorBs4()
+    elif extractor_type == "lxml":
+        return HtmlExtractorLxml()
+    else:
+        raise ValueError(f"extractor must be one of {extractor_types}: {extractor_type}")
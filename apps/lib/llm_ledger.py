@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Iterator
+
+from apps.lib.utils import format_number, print_colored
+
+# 呼び出しの記録を追記するファイルのデフォルトのパス
+default_ledger_path = os.path.join(os.path.expanduser("~"), ".cache", "useful_tools", "llm_ledger.jsonl")
+
+# ステージを指定せずに呼び出した場合のステージ名
+DEFAULT_STAGE = "-"
+
+_current_stage: ContextVar[str] = ContextVar("llm_stage", default=DEFAULT_STAGE)
+
+
+@contextmanager
+def llm_stage(name: str) -> Iterator[None]:
+    """この中で呼び出したLLMを、指定したステージの呼び出しとして記録する。デコレータとしても使える"""
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def get_llm_stage() -> str:
+    return _current_stage.get()
+
+
+@dataclass
+class LlmUsage:
+    """1回の生成の呼び出しで、プロバイダが返したトークン数と最初のトークンを受け取った時刻"""
+
+    started_at: float = field(default_factory=time.monotonic)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    first_token_at: float | None = None
+    # 続きの生成が上限に達し、出力が途中で終わっている可能性があるかどうか
+    truncated: bool = False
+
+    def add_tokens(self, prompt_tokens: int, completion_tokens: int) -> None:
+        # 続きを生成した場合やリトライした場合は、APIの呼び出しごとに加算する
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def mark_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+
+_current_usage: ContextVar[LlmUsage | None] = ContextVar("llm_usage", default=None)
+
+
+@contextmanager
+def track_llm_usage() -> Iterator[LlmUsage]:
+    """この中で呼び出したAPIのトークン数と、最初のトークンを受け取った時刻を集める"""
+    usage = LlmUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def record_llm_tokens(prompt_tokens: int | None, completion_tokens: int | None) -> None:
+    """実行中の呼び出しに、APIのレスポンスのトークン数を加算する"""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add_tokens(prompt_tokens or 0, completion_tokens or 0)
+
+
+def record_llm_first_token() -> None:
+    """実行中の呼び出しで、ストリーミングの最初のトークンを受け取ったことを記録する"""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.mark_first_token()
+
+
+def record_llm_truncated() -> None:
+    """実行中の呼び出しで、続きの生成が上限に達したことを記録する"""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.truncated = True
+
+
+@dataclass
+class LlmCallRecord:
+    """1回の生成の呼び出しの記録"""
+
+    stage: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency_seconds: float
+    # ストリーミングでない場合はNone
+    ttft_seconds: float | None
+    cost: float
+    cached: bool = False
+    created_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class LlmLedgerSummary:
+    """ステージやモデルごとの呼び出しの集計"""
+
+    calls: int = 0
+    cached_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_seconds: float = 0.0
+    cost: float = 0.0
+    # 最初のトークンまでの時間を計測した、ストリーミングの呼び出し
+    streamed_calls: int = 0
+    ttft_seconds: float = 0.0
+
+    def add(self, record: LlmCallRecord) -> None:
+        self.calls += 1
+        self.cached_calls += int(record.cached)
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.latency_seconds += record.latency_seconds
+        self.cost += record.cost
+        if record.ttft_seconds is not None:
+            self.streamed_calls += 1
+            self.ttft_seconds += record.ttft_seconds
+
+    @property
+    def mean_ttft_seconds(self) -> float | None:
+        return self.ttft_seconds / self.streamed_calls if self.streamed_calls else None
+
+
+class LlmLedger:
+    """LLMの呼び出しごとのモデル・トークン数・レイテンシ・最初のトークンまでの時間・推定の料金を記録する
+
+    ステージごとに集計し、時間や料金のかかっているステージを見つけられるようにする。
+    複数のスレッドから呼ばれるためスレッドセーフに動作する。
+    """
+
+    records: list[LlmCallRecord]
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.records = []
+
+    def reset(self) -> None:
+        with self._lock:
+            self.records = []
+
+    @contextmanager
+    def track(self) -> Iterator[LlmUsage]:
+        """この中で呼び出したAPIのトークン数と、最初のトークンを受け取った時刻を集める"""
+        with track_llm_usage() as usage:
+            yield usage
+
+    def add(
+        self,
+        model: str,
+        usage: LlmUsage,
+        input_cost: float,
+        output_cost: float,
+        cached: bool = False,
+    ) -> LlmCallRecord:
+        """呼び出しを記録する
+
+        Args:
+            model (str): 生成したモデルの名前
+            usage (LlmUsage): trackで集めたトークン数と時刻
+            input_cost (float): 入力の100万トークンあたりの料金(USD)
+            output_cost (float): 出力の100万トークンあたりの料金(USD)
+            cached (bool): レスポンスのキャッシュから返したかどうか
+        """
+        now = time.monotonic()
+        record = LlmCallRecord(
+            stage=get_llm_stage(),
+            model=model,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            latency_seconds=now - usage.started_at,
+            ttft_seconds=None if usage.first_token_at is None else usage.first_token_at - usage.started_at,
+            cost=(usage.prompt_tokens * input_cost + usage.completion_tokens * output_cost) / 1_000_000,
+            cached=cached,
+        )
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    def summarize(self, key: str = "stage") -> dict[str, LlmLedgerSummary]:
+        """記録をstageやmodelごとに集計する"""
+        summaries: dict[str, LlmLedgerSummary] = {}
+        with self._lock:
+            for record in self.records:
+                summaries.setdefault(getattr(record, key), LlmLedgerSummary()).add(record)
+        return summaries
+
+    def print_summary(self) -> None:
+        """ステージごとの集計を、料金の高い順に表示する"""
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return
+        total = LlmLedgerSummary()
+        for record in records:
+            total.add(record)
+        summaries = self.summarize("stage")
+
+        print_colored(
+            ("LLM usage: ", "magenta"),
+            f"{total.calls} calls, ",
+            f"{format_number(total.prompt_tokens)} prompt / {format_number(total.completion_tokens)} completion tokens, ",
+            f"{total.latency_seconds:.1f}s, ${total.cost:.4f}",
+        )
+        for stage, summary in sorted(summaries.items(), key=lambda item: item[1].cost, reverse=True):
+            mean_ttft_seconds = summary.mean_ttft_seconds
+            print_colored(
+                (f"  {stage}: ", "grey"),
+                f"{summary.calls} calls ({summary.cached_calls} cached), ",
+                f"{format_number(summary.prompt_tokens)} / {format_number(summary.completion_tokens)} tokens, ",
+                f"{summary.latency_seconds:.1f}s",
+                f" (ttft {mean_ttft_seconds:.2f}s)" if mean_ttft_seconds is not None else "",
+                f", ${summary.cost:.4f}",
+            )
+
+    def save(self, file_path: str = default_ledger_path) -> None:
+        """記録をJSON Linesのファイルに追記する"""
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            records = list(self.records)
+        with open(file_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+        print_colored(("Saved LLM ledger: ", "green"), file_path)
+
+
+# プロセス全体で共有する記録
+llm_ledger = LlmLedger()
@@ -0,0 +1,238 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Literal, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+R = TypeVar("R")
+
+CircuitState = Literal["closed", "open", "half_open"]
+
+# レート制限のエラー
+RATE_LIMIT_ERRORS: tuple[type[Exception], ...] = (
+    RateLimitError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+)
+
+# 時間をおけば成功する可能性があるエラー
+TRANSIENT_ERRORS: tuple[type[Exception], ...] = (
+    APIConnectionError,
+    google_exceptions.ServerError,
+    google_exceptions.RetryError,
+)
+
+
+class CircuitOpenError(Exception):
+    """失敗が続いているため、呼び出しを止めている場合のエラー"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open. Retry after {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    return isinstance(error, RATE_LIMIT_ERRORS)
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """リトライする価値のあるエラーかどうかを返す。リクエストの内容や認証の誤りはリトライしない"""
+    if is_rate_limit_error(error) or isinstance(error, TRANSIENT_ERRORS):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def get_retry_after(error: BaseException) -> float | None:
+    """レスポンスのヘッダーで指定された、リトライまでの秒数を返す"""
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTPの日付の形式の場合は使わない
+        pass
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """リトライの回数と待ち時間の決め方"""
+
+    max_retries: int = 5
+    # 1回目のリトライまでの待ち時間(秒)。リトライのたびにmultiplier倍にする
+    initial_delay: float = 1.0
+    multiplier: float = 2.0
+    max_delay: float = 30.0
+    # レート制限の場合の、1回目のリトライまでの待ち時間(秒)
+    rate_limit_delay: float = 5.0
+    # 待ち時間をランダムに短くする割合。同時にリトライするリクエストの時刻をずらす
+    jitter: float = 0.5
+
+    def get_delay(self, attempt: int, error: BaseException | None = None) -> float:
+        """attempt回目(0始まり)のリトライまでの待ち時間を返す"""
+        initial_delay = self.rate_limit_delay if error is not None and is_rate_limit_error(error) else self.initial_delay
+        delay = min(initial_delay * self.multiplier**attempt, self.max_delay)
+        delay *= 1 - random.uniform(0, self.jitter)
+        retry_after = get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            # サーバーが指定した時間より前にはリトライしない
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """失敗が続いた呼び出し先を一定時間止める
+
+    連続してfailure_threshold回失敗したら、reset_timeout秒の間は呼び出さずにCircuitOpenErrorを送出する。
+    時間が経ったら1回だけ試し、成功すれば元に戻し、失敗すればまた止める。
+    """
+
+    name: str
+    failure_threshold: int
+    reset_timeout: float
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state: CircuitState = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    def before_call(self) -> None:
+        """呼び出せない場合はCircuitOpenErrorを送出する"""
+        with self._lock:
+            if self._state == "closed":
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if self._state == "open" and elapsed >= self.reset_timeout:
+                self._state = "half_open"
+                return
+            # 試しの呼び出しの結果が出るまでは、他の呼び出しを止める
+            raise CircuitOpenError(self.name, max(self.reset_timeout - elapsed, 0.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """呼び出し先の障害と関係のないエラーで終わった呼び出しを記録する
+
+        失敗の回数には数えない。試しの呼び出しだった場合は、結果が分からないため止めた状態に戻し、時間をおいて再び試す。
+        """
+        with self._lock:
+            if self._state == "half_open":
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+
+class CircuitBreakerRegistry:
+    """呼び出し先の名前ごとのCircuitBreakerを保持する"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+                self._breakers[name] = breaker
+            return breaker
+
+    def clear(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+
+
+# プロセス全体で共有するCircuitBreaker
+circuit_breakers = CircuitBreakerRegistry()
+
+
+def print_retry(attempt: int, policy: RetryPolicy, delay: float, error: BaseException) -> None:
+    print(f"エラーが発生しました。{delay:.1f}秒後にリトライします（{attempt + 1}/{policy.max_retries}）: {error}")
+
+
+def call_with_retry(func: Callable[[], R], policy: RetryPolicy, breaker: CircuitBreaker | None = None) -> R:
+    """リトライできるエラーの場合は、待ち時間をおいて呼び出し直す
+
+    Raises:
+        CircuitOpenError: 呼び出し先の失敗が続いていて、呼び出せない場合
+    """
+    for attempt in range(policy.max_retries + 1):
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = func()
+        except BaseException as e:
+            # 中断やリトライしないエラーでも、試しの呼び出しの枠を空ける
+            if not isinstance(e, Exception) or not is_retryable_error(e):
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt == policy.max_retries:
+                raise
+            delay = policy.get_delay(attempt, e)
+            print_retry(attempt, policy, delay, e)
+            time.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+    raise AssertionError("unreachable")
+
+
+async def acall_with_retry(
+    func: Callable[[], Awaitable[R]], policy: RetryPolicy, breaker: CircuitBreaker | None = None
+) -> R:
+    """call_with_retryの非同期版"""
+    for attempt in range(policy.max_retries + 1):
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await func()
+        except BaseException as e:
+            # 中断やリトライしないエラーでも、試しの呼び出しの枠を空ける
+            if not isinstance(e, Exception) or not is_retryable_error(e):
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt == policy.max_retries:
+                raise
+            delay = policy.get_delay(attempt, e)
+            print_retry(attempt, policy, delay, e)
+            await asyncio.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+    raise AssertionError("unreachable")
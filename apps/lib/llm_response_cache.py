@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any
+
+# ディスクに保存するキャッシュのデフォルトのパス
+default_cache_path = os.path.join(os.path.expanduser("~"), ".cache", "useful_tools", "llm_response_cache.sqlite3")
+
+
+def make_cache_key(
+    model_name: str,
+    temp: float | None,
+    max_tokens: int | None,
+    messages: list[dict[str, str]],
+    output_schema: dict[str, Any] | None = None,
+    provider: str | None = None,
+    base_url: str | None = None,
+) -> str:
+    """プロバイダ・接続先・モデル名・温度・最大トークン数・メッセージ・出力のスキーマからキャッシュのキーを作る"""
+    payload = {
+        "provider": provider,
+        "base_url": base_url,
+        "model": model_name,
+        "temp": temp,
+        "max_tokens": max_tokens,
+        "messages": messages,
+        "output_schema": output_schema,
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class LlmResponseCacheIF(ABC):
+    """LLMのレスポンスのキャッシュのインターフェース"""
+
+    @abstractmethod
+    def get(self, key: str) -> str | None:
+        """キーに対応するレスポンスを返す。無い場合はNoneを返す"""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        """キーに対応するレスポンスを保存する"""
+        pass
+
+
+class MemoryLlmResponseCache(LlmResponseCacheIF):
+    """最も古く使ったものから破棄する、メモリ上のキャッシュ"""
+
+    max_size: int
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, str] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+class SqliteLlmResponseCache(LlmResponseCacheIF):
+    """SQLiteのファイルに保存するキャッシュ。プロセスを再起動しても使える"""
+
+    file_path: str
+    ttl: float | None
+
+    def __init__(self, file_path: str = default_cache_path, ttl: float | None = 7 * 24 * 60 * 60):
+        """
+        Args:
+            file_path (str): SQLiteのファイルのパス。最初に使うときに作成する
+            ttl (float | None): レスポンスを使う期間(秒)。Noneの場合は期限なし
+        """
+        self.file_path = file_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.file_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self.connect().execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            return None
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)", (key, value, time.time())
+            )
+            connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class TieredLlmResponseCache(LlmResponseCacheIF):
+    """複数のキャッシュを順に参照する。後ろのキャッシュで見つかった場合は、前のキャッシュにも保存する"""
+
+    caches: list[LlmResponseCacheIF]
+
+    def __init__(self, caches: list[LlmResponseCacheIF]):
+        self.caches = caches
+
+    def get(self, key: str) -> str | None:
+        for index, cache in enumerate(self.caches):
+            value = cache.get(key)
+            if value is not None:
+                for upper_cache in self.caches[:index]:
+                    upper_cache.set(key, value)
+                return value
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        for cache in self.caches:
+            cache.set(key, value)
+
+
+def get_llm_response_cache(file_path: str | None = default_cache_path, max_size: int = 256) -> LlmResponseCacheIF:
+    """メモリ上のキャッシュと、file_pathを指定した場合はSQLiteのキャッシュを組み合わせたキャッシュを返す"""
+    memory_cache = MemoryLlmResponseCache(max_size=max_size)
+    if file_path is None:
+        return memory_cache
+    return TieredLlmResponseCache([memory_cache, SqliteLlmResponseCache(file_path)])
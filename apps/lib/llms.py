@@ -1,24 +1,56 @@
+import asyncio
 import textwrap
-import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from enum import Enum
-from typing import Any, Literal, TypeVar
+from typing import Any, Awaitable, Callable, ClassVar, Iterator, Literal, TypeVar
 
 import google.generativeai as genai
 import instructor
-from google.api_core import exceptions as google_exceptions
 from google.generativeai.generative_models import GenerativeModel
 from google.generativeai.types.content_types import ContentDict
 from google.generativeai.types.generation_types import (
+    AsyncGenerateContentResponse,
     GenerateContentResponse,
     GenerationConfig,
 )
+from httpx import Limits
 from instructor import Mode, from_openai
-from openai import OpenAI, OpenAIError, Stream
+from openai import (
+    NOT_GIVEN,
+    AsyncOpenAI,
+    AsyncStream,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+    Stream,
+)
+from openai.types import CompletionUsage
 from openai.types.chat import ChatCompletionChunk, ChatCompletionMessageParam
-from pydantic import BaseModel, Field
-from rich.console import Console
-from rich.live import Live
-from rich.markdown import Markdown
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from apps.lib.gemini_context_cache import GeminiContextCache
+from apps.lib.llm_ledger import (
+    LlmLedger,
+    LlmUsage,
+    llm_ledger,
+    record_llm_first_token,
+    record_llm_tokens,
+    record_llm_truncated,
+    track_llm_usage,
+)
+from apps.lib.llm_resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    acall_with_retry,
+    call_with_retry,
+    circuit_breakers,
+    is_retryable_error,
+)
+from apps.lib.llm_response_cache import LlmResponseCacheIF, make_cache_key
+from apps.lib.streaming_printer import StreamingPrinter
 
 
 class LlmProvider(Enum):
@@ -33,71 +65,267 @@ class LlmModel(BaseModel):
 
     name: str
     provider: LlmProvider
+    # 出力の最大トークン数
     max_tokens: int
+    # 入力と出力を合わせた最大トークン数
+    context_window: int
+    # 入力と出力の100万トークンあたりの料金(USD)。Geminiは128Kトークン以下のプロンプトの料金
+    input_cost: float
+    output_cost: float
 
 
 class LlmModelEnum(Enum):
     """LLMのモデル"""
 
-    GEMINI15FLASH = LlmModel(name="models/gemini-1.5-flash-002", provider=LlmProvider.GEMINI, max_tokens=8100)
-    GEMINI15FLASH_LATEST = LlmModel(name="models/gemini-1.5-flash-latest", provider=LlmProvider.GEMINI, max_tokens=8100)
-    GEMINI15PRO = LlmModel(name="models/gemini-1.5-pro-002", provider=LlmProvider.GEMINI, max_tokens=8100)
-    GEMINI15PRO_LATEST = LlmModel(name="models/gemini-1.5-pro-latest", provider=LlmProvider.GEMINI, max_tokens=8100)
-    GPT4O = LlmModel(name="gpt-4o", provider=LlmProvider.OPENAI, max_tokens=4096)
-    GPT4O_MINI = LlmModel(name="gpt-4o-mini", provider=LlmProvider.OPENAI, max_tokens=4096)
+    GEMINI15FLASH = LlmModel(
+        name="models/gemini-1.5-flash-002",
+        provider=LlmProvider.GEMINI,
+        max_tokens=8100,
+        context_window=1_048_576,
+        input_cost=0.075,
+        output_cost=0.3,
+    )
+    GEMINI15FLASH_LATEST = LlmModel(
+        name="models/gemini-1.5-flash-latest",
+        provider=LlmProvider.GEMINI,
+        max_tokens=8100,
+        context_window=1_048_576,
+        input_cost=0.075,
+        output_cost=0.3,
+    )
+    GEMINI15PRO = LlmModel(
+        name="models/gemini-1.5-pro-002",
+        provider=LlmProvider.GEMINI,
+        max_tokens=8100,
+        context_window=2_097_152,
+        input_cost=1.25,
+        output_cost=5.0,
+    )
+    GEMINI15PRO_LATEST = LlmModel(
+        name="models/gemini-1.5-pro-latest",
+        provider=LlmProvider.GEMINI,
+        max_tokens=8100,
+        context_window=2_097_152,
+        input_cost=1.25,
+        output_cost=5.0,
+    )
+    GPT4O = LlmModel(
+        name="gpt-4o",
+        provider=LlmProvider.OPENAI,
+        max_tokens=4096,
+        context_window=128_000,
+        input_cost=2.5,
+        output_cost=10.0,
+    )
+    GPT4O_MINI = LlmModel(
+        name="gpt-4o-mini",
+        provider=LlmProvider.OPENAI,
+        max_tokens=4096,
+        context_window=128_000,
+        input_cost=0.15,
+        output_cost=0.6,
+    )
+
+
+def record_gemini_usage(response: GenerateContentResponse | AsyncGenerateContentResponse) -> None:
+    """Geminiのレスポンスのトークン数を記録する"""
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata is not None:
+        record_llm_tokens(usage_metadata.prompt_token_count, usage_metadata.candidates_token_count)
+
+
+def record_openai_usage(usage: CompletionUsage | None) -> None:
+    """OpenAIのレスポンスのトークン数を記録する"""
+    if usage is not None:
+        record_llm_tokens(usage.prompt_tokens, usage.completion_tokens)
 
 
 def streaming_print_gemini(response: GenerateContentResponse, markdown: bool = False) -> str:
-    # Rich consoleを初期化
-    console = Console()
-    # マークダウンテキストを格納する変数
-    full_text = ""
-
-    if markdown is True:
-        # Liveコンテキストを使用してストリーミング出力を表示
-        with Live(console=console, refresh_per_second=1) as live:
-            for chunk in response:
-                if chunk.text:
-                    full_text += chunk.text
-                    # 現在のマークダウンテキストをレンダリング
-                    live.update(Markdown(full_text))
-    else:
+    with StreamingPrinter(markdown=markdown) as printer:
         for chunk in response:
             if chunk.text:
-                full_text += chunk.text
-                print(chunk.text, end="")
+                record_llm_first_token()
+                printer.write(chunk.text)
 
-    return full_text
+    return printer.get_text()
 
 
 def streaming_print_openai(response: Stream[ChatCompletionChunk], markdown: bool = False) -> tuple[str, str | None]:
-    full_text = ""
     finish_reason: str | None = None
-    console = Console()
-
-    if markdown is True:
-        with Live(console=console, refresh_per_second=1) as live:
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
-                    full_text += content
-                    live.update(Markdown(full_text))
-                finish_reason = chunk.choices[0].finish_reason
-    else:
+
+    with StreamingPrinter(markdown=markdown) as printer:
         for chunk in response:
+            # include_usageを指定した場合、最後のチャンクはchoicesが空でトークン数だけを含む
+            record_openai_usage(chunk.usage)
+            if not chunk.choices:
+                continue
             if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                full_text += content
-                print(content, end="")
+                record_llm_first_token()
+                printer.write(chunk.choices[0].delta.content)
+            finish_reason = chunk.choices[0].finish_reason
+
+    return printer.get_text(), finish_reason
 
+
+async def astreaming_print_gemini(response: AsyncGenerateContentResponse, markdown: bool = False) -> str:
+    """streaming_print_geminiの非同期版"""
+    with StreamingPrinter(markdown=markdown) as printer:
+        async for chunk in response:
+            if chunk.text:
+                record_llm_first_token()
+                printer.write(chunk.text)
+
+    return printer.get_text()
+
+
+async def astreaming_print_openai(
+    response: AsyncStream[ChatCompletionChunk], markdown: bool = False
+) -> tuple[str, str | None]:
+    """streaming_print_openaiの非同期版"""
+    finish_reason: str | None = None
+
+    with StreamingPrinter(markdown=markdown) as printer:
+        async for chunk in response:
+            record_openai_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].delta.content is not None:
+                record_llm_first_token()
+                printer.write(chunk.choices[0].delta.content)
             finish_reason = chunk.choices[0].finish_reason
 
-    return full_text, finish_reason
+    return printer.get_text(), finish_reason
+
+
+class LlmClientPool:
+    """プロバイダのクライアントを使い回し、HTTPの接続を維持する
+
+    OpenAIのクライアントはAPIキーとbase_urlごとに1つ作る。非同期のクライアントの接続はイベントループをまたいで
+    使えないため、さらにイベントループごとに作る。Geminiはgenai.configureをAPIキーが変わった場合だけ呼び、
+    GenerativeModelをモデル名・システム指示・生成の設定ごとに使い回す。
+    """
+
+    max_connections: int
+    max_gemini_models: int
+
+    def __init__(self, max_connections: int = 20, max_gemini_models: int = 32):
+        """
+        Args:
+            max_connections (int): OpenAIのクライアントごとの同時接続数の上限
+            max_gemini_models (int): 使い回すGenerativeModelの数の上限。超えた場合は最も古く使ったものから破棄する
+        """
+        self.max_connections = max_connections
+        self.max_gemini_models = max_gemini_models
+        self._lock = threading.Lock()
+        self._openai_clients: dict[tuple[str | None, str | None], OpenAI] = {}
+        self._async_openai_clients: dict[
+            tuple[str | None, str | None, int], tuple[asyncio.AbstractEventLoop, AsyncOpenAI]
+        ] = {}
+        self._gemini_api_key: str | None = None
+        self._gemini_models: OrderedDict[tuple[Any, ...], GenerativeModel] = OrderedDict()
+
+    def get_limits(self) -> Limits:
+        return Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+
+    def get_openai(self, api_key: str | None = None, base_url: str | None = None) -> OpenAI:
+        """APIキーとbase_urlごとのOpenAIのクライアントを返す"""
+        key = (api_key, base_url)
+        with self._lock:
+            client = self._openai_clients.get(key)
+            if client is None:
+                # リトライはLlmClientBaseでまとめて行うため、SDKのリトライは無効にする
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=self.get_limits()),
+                )
+                self._openai_clients[key] = client
+            return client
+
+    def get_async_openai(self, api_key: str | None = None, base_url: str | None = None) -> AsyncOpenAI:
+        """実行中のイベントループで使う、APIキーとbase_urlごとの非同期のOpenAIのクライアントを返す"""
+        loop = asyncio.get_running_loop()
+        key = (api_key, base_url, id(loop))
+        with self._lock:
+            # 終了したイベントループのクライアントは使えないため破棄する
+            closed_keys = [k for k, (client_loop, _) in self._async_openai_clients.items() if client_loop.is_closed()]
+            for closed_key in closed_keys:
+                del self._async_openai_clients[closed_key]
+
+            entry = self._async_openai_clients.get(key)
+            if entry is None or entry[0] is not loop:
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=self.get_limits()),
+                )
+                entry = (loop, client)
+                self._async_openai_clients[key] = entry
+            return entry[1]
+
+    def configure_gemini(self, api_key: str | None = None) -> None:
+        """GeminiのAPIキーを設定する"""
+        with self._lock:
+            # genai.configureは全体の設定を作り直すため、APIキーが変わった場合だけ呼ぶ
+            if api_key is not None and api_key != self._gemini_api_key:
+                genai.configure(api_key=api_key)
+                self._gemini_api_key = api_key
+                self._gemini_models.clear()
+
+    def get_gemini_model(
+        self,
+        model_name: str,
+        api_key: str | None = None,
+        system_instruction: str | None = None,
+        generation_config: GenerationConfig | None = None,
+    ) -> GenerativeModel:
+        """モデル名・システム指示・生成の設定ごとのGenerativeModelを返す"""
+        config_key = (
+            None
+            if generation_config is None
+            else (generation_config.temperature, generation_config.max_output_tokens)
+        )
+        key = (model_name, system_instruction, config_key)
+        self.configure_gemini(api_key)
+        with self._lock:
+            model = self._gemini_models.get(key)
+            if model is None:
+                model = GenerativeModel(
+                    model_name=model_name,
+                    system_instruction=system_instruction,
+                    generation_config=generation_config,
+                )
+                self._gemini_models[key] = model
+                if len(self._gemini_models) > self.max_gemini_models:
+                    self._gemini_models.popitem(last=False)
+            else:
+                self._gemini_models.move_to_end(key)
+            return model
+
+    def close(self) -> None:
+        """同期のクライアントの接続を閉じ、すべてのクライアントを破棄する"""
+        with self._lock:
+            for client in self._openai_clients.values():
+                client.close()
+            self._openai_clients.clear()
+            self._async_openai_clients.clear()
+            self._gemini_models.clear()
+
+
+# プロセス全体で共有するクライアントのプール
+llm_client_pool = LlmClientPool()
+
+# プロセス全体で共有するGeminiのコンテキストキャッシュ
+gemini_context_cache = GeminiContextCache()
 
 
 class LlmMessage(BaseModel):
     role: Literal["system", "user", "assistant"]
     content: str
+    # Trueの場合、複数の呼び出しで共通のプレフィックスとしてプロバイダにキャッシュさせる
+    cache: bool = Field(default=False)
 
     def format_gemini(self) -> ContentDict | None:
         # roleをgeminiのものに変換
@@ -130,9 +358,20 @@ class LlmMessages(BaseModel):
         """Geminiのメッセージをフォーマットする"""
         return [message.format_gemini() for message in self.messages if message.format_gemini() is not None]
 
+    def split_cached_prefix(self) -> tuple["LlmMessages", "LlmMessages"]:
+        """キャッシュさせるメッセージ(プレフィックス)と、それ以外のメッセージに分ける"""
+        prefix = [message for message in self.messages if message.cache]
+        rest = [message for message in self.messages if not message.cache]
+        return LlmMessages(messages=prefix), LlmMessages(messages=rest)
+
     def format_openai(self) -> list[ChatCompletionMessageParam]:
-        """OpenAIのメッセージをフォーマットする"""
-        return [message.format_openai() for message in self.messages]
+        """OpenAIのメッセージをフォーマットする
+
+        OpenAIは先頭が一致するリクエストのプレフィックスを自動でキャッシュするため、
+        キャッシュさせるメッセージを呼び出しごとのシステム指示よりも前に置く。
+        """
+        prefix, rest = self.split_cached_prefix()
+        return [message.format_openai() for message in prefix.messages + rest.messages]
 
     def format_instructor(self) -> list[ChatCompletionMessageParam]:
         """Instructorのメッセージをフォーマットする"""
@@ -151,13 +390,86 @@ class LlmMessages(BaseModel):
             return None
 
 
+def to_llm_messages(messages: LlmMessages | str) -> LlmMessages:
+    """文字列の場合は、ユーザーのメッセージだけを含むLlmMessagesに変換する"""
+    if isinstance(messages, str):
+        return LlmMessages(messages=[LlmMessage(role="user", content=messages)])
+    return messages
+
+
+# 出力が長さの上限で途切れた場合に、続きを生成させる指示
+CONTINUATION_PROMPT = (
+    "Resume text generation from the point of interruption. "
+    "Do not preface or explain the process of combining text, as we will do that for you. "
+    "Please continue generating continuously."
+)
+
+
+def merge_continuation(output_text: str, continuation: str, min_overlap: int = 10, max_overlap: int = 1_000) -> str:
+    """続きの出力を連結する
+
+    続きの先頭で、これまでの出力の末尾を繰り返している場合は重複を取り除く。
+    コードブロックの途中で途切れた場合に、続きがコードブロックを開き直していれば、その行も取り除く。
+
+    Args:
+        output_text (str): これまでの出力
+        continuation (str): 続きの出力
+        min_overlap (int): 重複とみなす最短の文字数。短い一致を偶然の一致と区別する
+        max_overlap (int): 重複を探す最長の文字数
+    """
+    if not output_text:
+        return continuation
+
+    # コードブロックの途中の場合は、続きの先頭のコードブロックの開始行を取り除く
+    fence_count = sum(1 for line in output_text.splitlines() if line.lstrip().startswith("```"))
+    if fence_count % 2 == 1 and continuation.lstrip().startswith("```"):
+        first_line_end = continuation.find("\n")
+        continuation = "" if first_line_end == -1 else continuation[first_line_end + 1 :]
+
+    for size in range(min(len(output_text), len(continuation), max_overlap), min_overlap - 1, -1):
+        if output_text.endswith(continuation[:size]):
+            return output_text + continuation[size:]
+    return output_text + continuation
+
+
+def print_failover(model: LlmModelEnum, next_model: LlmModelEnum, error: BaseException) -> None:
+    print(f"{model.value.name} で生成できないため、{next_model.value.name} に切り替えます: {error}")
+
+
+def print_continuation_limit_warning(max_continuations: int) -> None:
+    print(f"続きの生成が上限({max_continuations}回)に達したため、出力が途中で終わっている可能性があります")
+
+
 T = TypeVar("T", bound=BaseModel)
+R = TypeVar("R")
 
 
 class LlmClientBase(BaseModel):
-    """LLMクライアントの基底クラス"""
+    """LLMクライアントの基底クラス
+
+    cacheを指定した場合、温度が0の呼び出しのレスポンスをキャッシュし、同じリクエストではAPIを呼ばない。
+    呼び出しごとのモデル・トークン数・レイテンシ・料金はledgerに記録する。
+    APIの呼び出しはretry_policyに従ってリトライし、失敗が続くモデルはCircuitBreakerで一時的に止める。
+    それでも失敗した場合は、fallback_modelsのモデルで順に生成し直す。
+    サブクラスは_generate_textなどの、メッセージとモデルが決まった後の処理を実装する。
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    DEFAULT_MODEL: ClassVar[LlmModelEnum]
 
     api_key: str | None = Field(default=None)
+    base_url: str | None = Field(default=None)
+    cache: LlmResponseCacheIF | None = Field(default=None)
+    # 出力が長さの上限で途切れた場合に、続きを生成する回数の上限
+    max_continuations: int = Field(default=5)
+    # 続きを生成する場合に、履歴として送るこれまでの出力の末尾の文字数
+    continuation_tail_chars: int = Field(default=4_000)
+    retry_policy: RetryPolicy = Field(default_factory=RetryPolicy)
+    # 指定したモデルで生成できない場合に、順に切り替えるモデル
+    fallback_models: list[LlmModelEnum] = Field(default=[])
+    # 呼び出しごとのトークン数・レイテンシ・料金を記録する。Noneの場合は記録しない
+    ledger: LlmLedger | None = Field(default_factory=lambda: llm_ledger)
 
     def generate_text(
         self,
@@ -169,7 +481,23 @@ class LlmClientBase(BaseModel):
         **kwargs: Any,
     ) -> str:
         """テキストを生成する"""
-        raise NotImplementedError
+        messages = to_llm_messages(messages)
+        llm_model = llm_model or self.DEFAULT_MODEL
+        cache_key = self.get_cache_key(messages, llm_model, temp, max_tokens)
+        with self.track_usage() as usage:
+            cached_text = self.load_cached_text(cache_key, stream)
+            if cached_text is not None:
+                self.add_ledger_record(llm_model, usage, cached=True)
+                return cached_text
+
+            output_text, used_model = self.run_with_failover(
+                llm_model, lambda model: self._generate_text(messages, model, temp, max_tokens, stream, **kwargs)
+            )
+            self.add_ledger_record(used_model, usage)
+        # 続きの生成が上限に達して途中で終わった出力はキャッシュしない
+        if used_model == llm_model and not usage.truncated:
+            self.save_cache(cache_key, output_text)
+        return output_text
 
     def generate_pydantic(
         self,
@@ -181,36 +509,286 @@ class LlmClientBase(BaseModel):
         **kwargs: Any,
     ) -> T:
         """指定したPydanticのモデルに構造化する"""
+        messages = to_llm_messages(messages)
+        llm_model = llm_model or self.DEFAULT_MODEL
+        cache_key = self.get_cache_key(messages, llm_model, temp, max_tokens, output_type)
+        with self.track_usage() as usage:
+            cached_data = self.load_cached_pydantic(output_type, cache_key)
+            if cached_data is not None:
+                self.add_ledger_record(llm_model, usage, cached=True)
+                return cached_data
+
+            output_data, used_model = self.run_with_failover(
+                llm_model,
+                lambda model: self._generate_pydantic(output_type, messages, model, temp, max_tokens, **kwargs),
+            )
+            self.add_ledger_record(used_model, usage)
+        if used_model == llm_model:
+            self.save_cache(cache_key, output_data.model_dump_json())
+        return output_data
+
+    async def agenerate_text(
+        self,
+        messages: LlmMessages | str,
+        llm_model: LlmModelEnum | None = None,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> str:
+        """テキストを非同期に生成する"""
+        messages = to_llm_messages(messages)
+        llm_model = llm_model or self.DEFAULT_MODEL
+        cache_key = self.get_cache_key(messages, llm_model, temp, max_tokens)
+        with self.track_usage() as usage:
+            cached_text = self.load_cached_text(cache_key, stream)
+            if cached_text is not None:
+                self.add_ledger_record(llm_model, usage, cached=True)
+                return cached_text
+
+            output_text, used_model = await self.arun_with_failover(
+                llm_model, lambda model: self._agenerate_text(messages, model, temp, max_tokens, stream, **kwargs)
+            )
+            self.add_ledger_record(used_model, usage)
+        # 続きの生成が上限に達して途中で終わった出力はキャッシュしない
+        if used_model == llm_model and not usage.truncated:
+            self.save_cache(cache_key, output_text)
+        return output_text
+
+    async def agenerate_pydantic(
+        self,
+        output_type: type[T],
+        messages: LlmMessages | str,
+        llm_model: LlmModelEnum | None = None,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        **kwargs: Any,
+    ) -> T:
+        """指定したPydanticのモデルに非同期に構造化する"""
+        messages = to_llm_messages(messages)
+        llm_model = llm_model or self.DEFAULT_MODEL
+        cache_key = self.get_cache_key(messages, llm_model, temp, max_tokens, output_type)
+        with self.track_usage() as usage:
+            cached_data = self.load_cached_pydantic(output_type, cache_key)
+            if cached_data is not None:
+                self.add_ledger_record(llm_model, usage, cached=True)
+                return cached_data
+
+            output_data, used_model = await self.arun_with_failover(
+                llm_model,
+                lambda model: self._agenerate_pydantic(output_type, messages, model, temp, max_tokens, **kwargs),
+            )
+            self.add_ledger_record(used_model, usage)
+        if used_model == llm_model:
+            self.save_cache(cache_key, output_data.model_dump_json())
+        return output_data
+
+    def _generate_text(
+        self,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> str:
+        raise NotImplementedError
+
+    def _generate_pydantic(
+        self,
+        output_type: type[T],
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        **kwargs: Any,
+    ) -> T:
+        raise NotImplementedError
+
+    async def _agenerate_text(
+        self,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> str:
         raise NotImplementedError
 
+    async def _agenerate_pydantic(
+        self,
+        output_type: type[T],
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        **kwargs: Any,
+    ) -> T:
+        raise NotImplementedError
+
+    @contextmanager
+    def track_usage(self) -> Iterator[LlmUsage]:
+        """この中で呼び出したAPIのトークン数と、最初のトークンを受け取った時刻を集める
+
+        ledgerに記録しない場合も、出力が途中で終わったかどうかを判定するために集める。
+        """
+        with track_llm_usage() as usage:
+            yield usage
+
+    def add_ledger_record(self, llm_model: LlmModelEnum, usage: LlmUsage, cached: bool = False) -> None:
+        if self.ledger is not None:
+            self.ledger.add(
+                llm_model.value.name, usage, llm_model.value.input_cost, llm_model.value.output_cost, cached=cached
+            )
+
+    def get_circuit_breaker(self, llm_model: LlmModelEnum) -> CircuitBreaker:
+        """モデルごとのCircuitBreakerを返す。レート制限や障害はモデルごとに起きるため、モデルごとに止める"""
+        return circuit_breakers.get(f"{llm_model.value.provider.value}:{llm_model.value.name}")
+
+    def call_api(self, llm_model: LlmModelEnum, func: Callable[[], R]) -> R:
+        """APIを呼び出す。リトライできるエラーの場合は待ち時間をおいて呼び出し直す"""
+        return call_with_retry(func, self.retry_policy, self.get_circuit_breaker(llm_model))
+
+    async def acall_api(self, llm_model: LlmModelEnum, func: Callable[[], Awaitable[R]]) -> R:
+        """call_apiの非同期版"""
+        return await acall_with_retry(func, self.retry_policy, self.get_circuit_breaker(llm_model))
+
+    def get_candidate_models(self, llm_model: LlmModelEnum) -> list[LlmModelEnum]:
+        """生成を試すモデルを、試す順に返す"""
+        return [llm_model, *(model for model in self.fallback_models if model != llm_model)]
+
+    def run_with_failover(
+        self, llm_model: LlmModelEnum, generate: Callable[[LlmModelEnum], R]
+    ) -> tuple[R, LlmModelEnum]:
+        """モデルで生成できない場合は、次のモデルに切り替えて生成し直す。結果と生成したモデルを返す"""
+        models = self.get_candidate_models(llm_model)
+        for index, model in enumerate(models):
+            try:
+                return generate(model), model
+            except Exception as e:
+                if index == len(models) - 1 or not (isinstance(e, CircuitOpenError) or is_retryable_error(e)):
+                    raise
+                print_failover(model, models[index + 1], e)
+        raise AssertionError("unreachable")
+
+    async def arun_with_failover(
+        self, llm_model: LlmModelEnum, generate: Callable[[LlmModelEnum], Awaitable[R]]
+    ) -> tuple[R, LlmModelEnum]:
+        """run_with_failoverの非同期版"""
+        models = self.get_candidate_models(llm_model)
+        for index, model in enumerate(models):
+            try:
+                return await generate(model), model
+            except Exception as e:
+                if index == len(models) - 1 or not (isinstance(e, CircuitOpenError) or is_retryable_error(e)):
+                    raise
+                print_failover(model, models[index + 1], e)
+        raise AssertionError("unreachable")
+
+    def build_continuation_messages(self, messages: LlmMessages, output_text: str) -> LlmMessages:
+        """元のメッセージに、これまでの出力の末尾と続きの指示を加えたメッセージを作る
+
+        これまでの出力をすべて送ると、続きを生成するたびに送るトークン数が増えるため、末尾だけを送る。
+        """
+        return LlmMessages(
+            messages=[
+                *messages.messages,
+                LlmMessage(role="assistant", content=output_text[-self.continuation_tail_chars :]),
+                LlmMessage(role="user", content=CONTINUATION_PROMPT),
+            ]
+        )
+
+    def get_cache_key(
+        self,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None,
+        max_tokens: int | None,
+        output_type: type[BaseModel] | None = None,
+    ) -> str | None:
+        """キャッシュを使う場合はキーを返す。出力が毎回変わる温度が0以外の呼び出しはキャッシュしない
+
+        同じモデル名でも接続先のサーバーが違えば出力が違うため、プロバイダとbase_urlもキーに含める。
+        """
+        if self.cache is None or temp != 0:
+            return None
+        return make_cache_key(
+            provider=llm_model.value.provider.value,
+            base_url=self.base_url,
+            model_name=llm_model.value.name,
+            temp=temp,
+            max_tokens=max_tokens,
+            messages=[message.model_dump(mode="json", exclude={"cache"}) for message in messages.messages],
+            output_schema=output_type.model_json_schema() if output_type is not None else None,
+        )
+
+    def load_cached_text(self, cache_key: str | None, stream: bool = False) -> str | None:
+        if cache_key is None or self.cache is None:
+            return None
+        cached_text = self.cache.get(cache_key)
+        if cached_text is not None and stream is True:
+            # ストリーミングの場合は、生成した場合と同じようにターミナルに表示する
+            print(cached_text)
+        return cached_text
+
+    def load_cached_pydantic(self, output_type: type[T], cache_key: str | None) -> T | None:
+        if cache_key is None or self.cache is None:
+            return None
+        cached_json = self.cache.get(cache_key)
+        if cached_json is None:
+            return None
+        try:
+            return output_type.model_validate_json(cached_json)
+        except ValidationError:
+            return None
+
+    def save_cache(self, cache_key: str | None, value: str) -> None:
+        if cache_key is not None and self.cache is not None:
+            self.cache.set(cache_key, value)
+
 
 class GeminiClient(LlmClientBase):
     """Geminiクライアント"""
 
-    DEFAULT_MODEL: LlmModelEnum = LlmModelEnum.GEMINI15FLASH
+    DEFAULT_MODEL: ClassVar[LlmModelEnum] = LlmModelEnum.GEMINI15FLASH
+
+    def get_model_and_contents(
+        self, messages: LlmMessages, llm_model: LlmModelEnum
+    ) -> tuple[GenerativeModel, list[ContentDict]]:
+        """生成に使うモデルと、送るメッセージを返す
+
+        キャッシュさせるメッセージがあり、コンテキストキャッシュを使える場合は、それらをキャッシュしたモデルを返す。
+        キャッシュを呼び出しごとに異なるシステム指示と共有するため、
+        システム指示はキャッシュに含めず、ユーザーのメッセージとして先頭に送る。
+        """
+        prefix, rest = messages.split_cached_prefix()
+        if prefix.messages:
+            llm_client_pool.configure_gemini(self.api_key)
+            model = gemini_context_cache.get_model(
+                llm_model.value.name, prefix.extract_instruction(), prefix.format_gemini()
+            )
+            if model is not None:
+                contents = rest.format_gemini()
+                instruction = rest.extract_instruction()
+                if instruction is not None:
+                    contents.insert(0, {"role": "user", "parts": [{"text": instruction}]})
+                return model, contents
+
+        model = llm_client_pool.get_gemini_model(
+            llm_model.value.name, api_key=self.api_key, system_instruction=messages.extract_instruction()
+        )
+        return model, messages.format_gemini()
 
-    def generate_text(
+    def _generate_text(
         self,
-        messages: LlmMessages | str,
-        llm_model: LlmModelEnum | None = None,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
         temp: float | None = None,
         max_tokens: int | None = None,
         stream: bool = False,
         **kwargs: Any,
     ) -> str:
-        # APIキーの設定
-        if self.api_key is not None:
-            genai.configure(api_key=self.api_key)
-
-        # メッセージが文字列の場合は、LlmMessagesに変換
-        if isinstance(messages, str):
-            messages = LlmMessages(messages=[LlmMessage(role="user", content=messages)])
-
-        # モデルの準備
-        if llm_model is None:
-            llm_model = self.DEFAULT_MODEL
-        llm = GenerativeModel(model_name=llm_model.value.name, system_instruction=messages.extract_instruction())
-
         # 設定の準備
         generation_config = GenerationConfig(
             temperature=temp,
@@ -219,72 +797,47 @@ class GeminiClient(LlmClientBase):
 
         # 出力する文字列
         output_text = ""
+        request_messages = messages
 
-        # レスポンスの生成
-        max_retries = 30
-        retry_delay = 1  # 初期遅延（秒）
-        is_finished = False
-
-        while not is_finished:
-            for attempt in range(max_retries):
-                try:
-                    response = llm.generate_content(
-                        messages.format_gemini(), generation_config=generation_config, stream=stream
-                    )
-                    if stream is True:
-                        generated_text = streaming_print_gemini(response)
-                    else:
-                        generated_text = response.text
-
-                    output_text += generated_text
-
-                    break  # 成功した場合、ループを抜ける
-                except google_exceptions.GoogleAPIError as e:
-                    if attempt == max_retries - 1:  # 最後の試行の場合
-                        raise  # エラーを再発生させる
-                    print(f"エラーが発生しました。リトライします（{attempt + 1}/{max_retries}）: {e}")
-
-                    # retry_delayは最大で10秒にする
-                    if retry_delay > 10:
-                        retry_delay = 10
-
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数バックオフ
+        for _ in range(self.max_continuations + 1):
+            # モデルの準備
+            llm, contents = self.get_model_and_contents(request_messages, llm_model)
+
+            # レスポンスの生成
+            def generate() -> tuple[str, GenerateContentResponse]:
+                response = llm.generate_content(contents, generation_config=generation_config, stream=stream)
+                text = streaming_print_gemini(response) if stream is True else response.text
+                record_gemini_usage(response)
+                return text, response
+
+            generated_text, response = self.call_api(llm_model, generate)
+            output_text = merge_continuation(output_text, generated_text)
 
             # 生成が完了したかどうかを確認
-            if max_tokens is None and response.candidates[0].finish_reason.value == 2:
-                # 次の生成のために、これまでの出力を履歴に追加
-                messages.append(LlmMessage(role="assistant", content=generated_text))
-                messages.append(
-                    LlmMessage(
-                        role="user",
-                        content="Resume text generation from the point of interruption. Do not preface or explain the process of combining text, as we will do that for you. Please continue generating continuously.",
-                    )
-                )
-            else:
-                is_finished = True
-                # ストリーミングの場合は、ターミナルの表示を改行する
-                if stream is True:
-                    print()
+            if max_tokens is not None or response.candidates[0].finish_reason.value != 2:
+                break
+            # 次の生成では、これまでの出力の末尾だけを履歴に追加する
+            request_messages = self.build_continuation_messages(messages, output_text)
+        else:
+            print_continuation_limit_warning(self.max_continuations)
+            record_llm_truncated()
+
+        # ストリーミングの場合は、ターミナルの表示を改行する
+        if stream is True:
+            print()
 
         return output_text
 
-    def generate_pydantic(
+    def _generate_pydantic(
         self,
         output_type: type[T],
-        messages: LlmMessages | str,
-        llm_model: LlmModelEnum | None = None,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
         temp: float | None = None,
         max_tokens: int | None = None,
         **kwargs: Any,
     ) -> T:
-        # APIキーの設定
-        if self.api_key is not None:
-            genai.configure(api_key=self.api_key)
-
         # メッセージのフォーマット
-        if isinstance(messages, str):
-            messages = LlmMessages(messages=[LlmMessage(role="user", content=messages)])
         gemini_messages = messages.format_gemini()
 
         # 設定の準備
@@ -294,31 +847,97 @@ class GeminiClient(LlmClientBase):
         )
 
         # モデルの準備
-        if llm_model is None:
-            llm_model = self.DEFAULT_MODEL
-
-        model = GenerativeModel(
-            model_name=llm_model.value.name,
-            generation_config=generation_config,
+        model = llm_client_pool.get_gemini_model(
+            llm_model.value.name, api_key=self.api_key, generation_config=generation_config
         )
 
-        print("model: ", model)
-
         client = instructor.from_gemini(
             client=model,
             mode=instructor.Mode.GEMINI_JSON,
         )
 
-        print("client: ", client)
-        print("gemini_messages: ", gemini_messages)
-        print("output_type: ", output_type)
+        resp_data, completion = self.call_api(
+            llm_model,
+            lambda: client.messages.create_with_completion(
+                messages=gemini_messages,
+                response_model=output_type,
+            ),
+        )
+        record_gemini_usage(completion)
 
-        resp_data = client.messages.create(
-            messages=gemini_messages,
-            response_model=output_type,
+        if not isinstance(resp_data, output_type):
+            raise ValueError(f"Invalid response: {resp_data}")
+
+        return resp_data
+
+    async def _agenerate_text(
+        self,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> str:
+        generation_config = GenerationConfig(
+            temperature=temp,
+            max_output_tokens=max_tokens or llm_model.value.max_tokens,
+        )
+
+        output_text = ""
+        request_messages = messages
+
+        for _ in range(self.max_continuations + 1):
+            llm, contents = self.get_model_and_contents(request_messages, llm_model)
+
+            async def generate() -> tuple[str, AsyncGenerateContentResponse]:
+                response = await llm.generate_content_async(
+                    contents, generation_config=generation_config, stream=stream
+                )
+                text = await astreaming_print_gemini(response) if stream is True else response.text
+                record_gemini_usage(response)
+                return text, response
+
+            generated_text, response = await self.acall_api(llm_model, generate)
+            output_text = merge_continuation(output_text, generated_text)
+
+            # 生成が完了したかどうかを確認
+            if max_tokens is not None or response.candidates[0].finish_reason.value != 2:
+                break
+            request_messages = self.build_continuation_messages(messages, output_text)
+        else:
+            print_continuation_limit_warning(self.max_continuations)
+            record_llm_truncated()
+
+        if stream is True:
+            print()
+
+        return output_text
+
+    async def _agenerate_pydantic(
+        self,
+        output_type: type[T],
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        **kwargs: Any,
+    ) -> T:
+        model = llm_client_pool.get_gemini_model(
+            llm_model.value.name,
+            api_key=self.api_key,
+            generation_config=GenerationConfig(temperature=temp, max_output_tokens=max_tokens),
         )
 
-        print("resp_data: ", resp_data)
+        client = instructor.from_gemini(client=model, mode=instructor.Mode.GEMINI_JSON, use_async=True)
+        resp_data, completion = await self.acall_api(
+            llm_model,
+            lambda: client.messages.create_with_completion(
+                messages=messages.format_gemini(),
+                response_model=output_type,
+            ),
+        )
+        record_gemini_usage(completion)
 
         if not isinstance(resp_data, output_type):
             raise ValueError(f"Invalid response: {resp_data}")
@@ -329,12 +948,12 @@ class GeminiClient(LlmClientBase):
 class OpenAiClient(LlmClientBase):
     """OpenAIクライアント"""
 
-    DEFAULT_MODEL: LlmModelEnum = LlmModelEnum.GPT4O_MINI
+    DEFAULT_MODEL: ClassVar[LlmModelEnum] = LlmModelEnum.GPT4O_MINI
 
-    def generate_text(
+    def _generate_text(
         self,
-        messages: LlmMessages | str,
-        llm_model: LlmModelEnum | None = None,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
         temp: float | None = None,
         max_tokens: int | None = None,
         stream: bool = False,
@@ -342,111 +961,155 @@ class OpenAiClient(LlmClientBase):
     ) -> str:
         """テキストを生成する"""
         # モデルの準備
-        model = OpenAI(api_key=self.api_key)
-
-        # メッセージのフォーマット
-        if isinstance(messages, str):
-            messages = LlmMessages(messages=[LlmMessage(role="user", content=messages)])
-        openai_messages = messages.format_openai()
+        model = llm_client_pool.get_openai(api_key=self.api_key, base_url=self.base_url)
 
         output_text = ""
-
-        # レスポンスの生成
-        if llm_model is None:
-            llm_model = self.DEFAULT_MODEL
-
-        max_retries = 3
-        retry_delay = 1  # 初期遅延（秒）
-        is_finished = False
-
-        while not is_finished:
-            for attempt in range(max_retries):
-                try:
-                    response = model.chat.completions.create(
-                        model=llm_model.value.name,
-                        messages=openai_messages,
-                        temperature=temp,
-                        max_tokens=max_tokens or llm_model.value.max_tokens,
-                        stream=stream,
-                    )
-                    break  # 成功した場合、ループを抜ける
-                except OpenAIError as e:
-                    if attempt == max_retries - 1:  # 最後の試行の場合
-                        raise  # エラーを再発生させる
-                    print(f"エラーが発生しました。リトライします（{attempt + 1}/{max_retries}）: {e}")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数バックオフ
+        request_messages = messages
+
+        for _ in range(self.max_continuations + 1):
+            # レスポンスの生成
+            openai_messages = request_messages.format_openai()
+            response = self.call_api(
+                llm_model,
+                lambda: model.chat.completions.create(
+                    model=llm_model.value.name,
+                    messages=openai_messages,
+                    temperature=temp,
+                    max_tokens=max_tokens or llm_model.value.max_tokens,
+                    stream=stream,
+                    # ストリーミングの場合も、最後のチャンクでトークン数を受け取る
+                    stream_options={"include_usage": True} if stream else NOT_GIVEN,
+                ),
+            )
 
             # ストリーミングの場合は、ストリーミングを返す. responseの型がStream[ChatCompletionChunk]の場合はこの処理を行う
             if isinstance(response, Stream):
                 generated_text, finish_reason = streaming_print_openai(response)
-                output_text += generated_text
-
-                # 生成が完了したかどうかを確認
-                if finish_reason == "length":
-                    is_finished = False
-                else:
-                    is_finished = True
-
             else:
                 generated_text = response.choices[0].message.content or ""
-                output_text += generated_text
-
-                # 生成が完了したかどうかを確認
-                if response.choices[0].finish_reason == "length":
-                    is_finished = False
-                else:
-                    is_finished = True
+                finish_reason = response.choices[0].finish_reason
+                record_openai_usage(response.usage)
+            output_text = merge_continuation(output_text, generated_text)
 
-            # 生成が完了していない場合は、次の生成のために、これまでの出力を履歴に追加
-            if is_finished is False and max_tokens is not None:
-                # 次の生成のために、これまでの出力を履歴に追加
-                messages.append(LlmMessage(role="assistant", content=generated_text))
-                messages.append(LlmMessage(role="user", content="go on"))
+            # 生成が完了したかどうかを確認
+            if max_tokens is not None or finish_reason != "length":
+                break
+            # 次の生成では、これまでの出力の末尾だけを履歴に追加する
+            request_messages = self.build_continuation_messages(messages, output_text)
+        else:
+            print_continuation_limit_warning(self.max_continuations)
+            record_llm_truncated()
 
         return output_text
 
-    def generate_pydantic(
+    def _generate_pydantic(
         self,
         output_type: type[T],
-        messages: LlmMessages | str,
-        llm_model: LlmModelEnum | None = None,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
         temp: float | None = None,
         max_tokens: int | None = None,
         **kwargs: Any,
     ) -> T:
         """指定したPydanticのモデルに構造化する"""
         # モデルの準備
-        model = OpenAI(api_key=self.api_key)
+        model = llm_client_pool.get_openai(api_key=self.api_key, base_url=self.base_url)
 
         # メッセージのフォーマット
-        if isinstance(messages, str):
-            messages = LlmMessages(messages=[LlmMessage(role="user", content=messages)])
         openai_messages = messages.format_openai()
 
         # レスポンスの生成
-        if llm_model is None:
-            llm_model = self.DEFAULT_MODEL
+        response = self.call_api(
+            llm_model,
+            lambda: model.beta.chat.completions.parse(
+                model=llm_model.value.name,
+                messages=openai_messages,
+                response_format=output_type,
+                temperature=temp,
+                max_tokens=max_tokens or llm_model.value.max_tokens,
+            ),
+        )
+        record_openai_usage(response.usage)
 
-        max_retries = 3
-        retry_delay = 1  # 初期遅延（秒）
+        parsed_data = response.choices[0].message.parsed
 
-        for attempt in range(max_retries):
-            try:
-                response = model.beta.chat.completions.parse(
+        if not isinstance(parsed_data, output_type):
+            raise ValueError(f"Invalid response: {parsed_data}")
+
+        return parsed_data
+
+    async def _agenerate_text(
+        self,
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> str:
+        """テキストを非同期に生成する"""
+        model = llm_client_pool.get_async_openai(api_key=self.api_key, base_url=self.base_url)
+
+        output_text = ""
+        request_messages = messages
+
+        for _ in range(self.max_continuations + 1):
+            openai_messages = request_messages.format_openai()
+            response = await self.acall_api(
+                llm_model,
+                lambda: model.chat.completions.create(
                     model=llm_model.value.name,
                     messages=openai_messages,
-                    response_format=output_type,
                     temperature=temp,
                     max_tokens=max_tokens or llm_model.value.max_tokens,
-                )
-                break  # 成功した場合、ループを抜ける
-            except OpenAIError as e:
-                if attempt == max_retries - 1:  # 最後の試行の場合
-                    raise  # エラーを再発生させる
-                print(f"エラーが発生しました。リトライします（{attempt + 1}/{max_retries}）: {e}")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # 指数バックオフ
+                    stream=stream,
+                    # ストリーミングの場合も、最後のチャンクでトークン数を受け取る
+                    stream_options={"include_usage": True} if stream else NOT_GIVEN,
+                ),
+            )
+
+            if isinstance(response, AsyncStream):
+                generated_text, finish_reason = await astreaming_print_openai(response)
+            else:
+                generated_text = response.choices[0].message.content or ""
+                finish_reason = response.choices[0].finish_reason
+                record_openai_usage(response.usage)
+            output_text = merge_continuation(output_text, generated_text)
+
+            # 生成が完了したかどうかを確認
+            if max_tokens is not None or finish_reason != "length":
+                break
+            request_messages = self.build_continuation_messages(messages, output_text)
+        else:
+            print_continuation_limit_warning(self.max_continuations)
+            record_llm_truncated()
+
+        return output_text
+
+    async def _agenerate_pydantic(
+        self,
+        output_type: type[T],
+        messages: LlmMessages,
+        llm_model: LlmModelEnum,
+        temp: float | None = None,
+        max_tokens: int | None = None,
+        **kwargs: Any,
+    ) -> T:
+        """指定したPydanticのモデルに非同期に構造化する"""
+        model = llm_client_pool.get_async_openai(api_key=self.api_key, base_url=self.base_url)
+        openai_messages = messages.format_openai()
+
+        response = await self.acall_api(
+            llm_model,
+            lambda: model.beta.chat.completions.parse(
+                model=llm_model.value.name,
+                messages=openai_messages,
+                response_format=output_type,
+                temperature=temp,
+                max_tokens=max_tokens or llm_model.value.max_tokens,
+            ),
+        )
+        record_openai_usage(response.usage)
 
         parsed_data = response.choices[0].message.parsed
 
@@ -531,12 +1194,17 @@ def convert_text_to_pydantic_with_instructor(output_type: type[T], text: str) ->
         ]
     )
 
-    client = from_openai(OpenAI(), mode=Mode.TOOLS_STRICT)
+    client = from_openai(llm_client_pool.get_openai(), mode=Mode.TOOLS_STRICT)
 
-    resp = client.chat.completions.create(
-        response_model=output_type,
-        messages=messages.format_instructor(),
-        model="gpt-4o-mini",
+    # プールのクライアントはSDKのリトライを無効にしているため、OpenAiClientのリトライを通して呼び出す
+    llm_model = LlmModelEnum.GPT4O_MINI
+    resp = OpenAiClient().call_api(
+        llm_model,
+        lambda: client.chat.completions.create(
+            response_model=output_type,
+            messages=messages.format_instructor(),
+            model=llm_model.value.name,
+        ),
     )
 
     return resp
@@ -0,0 +1,123 @@
+import fnmatch
+import re
+from typing import Literal
+
+# globとして扱う文字。?はURLのクエリにも使われるため、?だけを含むルールはglobとして扱わない
+GLOB_CHARS = frozenset("*[")
+
+# globとして扱うルールの接頭辞。?だけを使うglobはこの接頭辞を付けて指定する
+GLOB_PREFIX = "glob:"
+
+# 正規表現として扱うルールの接頭辞
+REGEX_PREFIX = "re:"
+
+
+def is_pattern_rule(rule: str) -> bool:
+    """ルールがglobまたは正規表現かどうかを返す"""
+    return rule.startswith((REGEX_PREFIX, GLOB_PREFIX)) or bool(GLOB_CHARS.intersection(rule))
+
+
+class PrefixTrie:
+    """文字単位のトライ木。文字列がいずれかの接頭辞で始まるかを、接頭辞の数によらず判定する"""
+
+    # 接頭辞の終端を表すキー
+    END = ""
+
+    def __init__(self, prefixes: list[str] | None = None):
+        self.root: dict[str, dict] = {}
+        for prefix in prefixes or []:
+            self.add(prefix)
+
+    def __bool__(self) -> bool:
+        return bool(self.root)
+
+    def add(self, prefix: str) -> None:
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[self.END] = {}
+
+    def has_prefix_of(self, text: str) -> bool:
+        """textがいずれかの接頭辞で始まるかを判定する"""
+        node = self.root
+        if self.END in node:
+            return True
+        for char in text:
+            next_node = node.get(char)
+            if next_node is None:
+                return False
+            node = next_node
+            if self.END in node:
+                return True
+        return False
+
+
+class PathMatcher:
+    """URLやファイルパスを、接頭辞・部分一致・glob・正規表現のルールでまとめて判定する
+
+    接頭辞はトライ木に、部分一致と正規表現は1つの正規表現に、globは先頭から一致させる1つの正規表現にまとめる。
+    判定ごとにルールを順に走査しないため、ルールの数が増えても判定のコストがほとんど変わらない。
+    """
+
+    prefix_trie: PrefixTrie
+    search_pattern: re.Pattern[str] | None
+    glob_pattern: re.Pattern[str] | None
+
+    def __init__(
+        self,
+        prefixes: list[str] | None = None,
+        substrings: list[str] | None = None,
+        globs: list[str] | None = None,
+        regexes: list[str] | None = None,
+    ):
+        """
+        Args:
+            prefixes (list[str] | None): この文字列で始まる場合に一致とする
+            substrings (list[str] | None): この文字列を含む場合に一致とする
+            globs (list[str] | None): 文字列全体がこのglobパターンに一致する場合に一致とする
+            regexes (list[str] | None): この正規表現が文字列のどこかに一致する場合に一致とする
+        """
+        self.prefix_trie = PrefixTrie(prefixes)
+
+        search_patterns = [re.escape(substring) for substring in substrings or []] + list(regexes or [])
+        self.search_pattern = re.compile("|".join(f"(?:{p})" for p in search_patterns)) if search_patterns else None
+
+        glob_patterns = [fnmatch.translate(glob) for glob in globs or []]
+        self.glob_pattern = re.compile("|".join(glob_patterns)) if glob_patterns else None
+
+    @classmethod
+    def from_rules(cls, rules: list[str], literal: Literal["prefix", "substring"] = "prefix") -> "PathMatcher":
+        """文字列のルールから作成する
+
+        "re:" で始まるルールは正規表現、"glob:" で始まるルールと * か [ を含むルールはglob、
+        それ以外はliteralの方法で一致させる。
+        """
+        literals: list[str] = []
+        globs: list[str] = []
+        regexes: list[str] = []
+        for rule in rules:
+            if rule.startswith(REGEX_PREFIX):
+                regexes.append(rule[len(REGEX_PREFIX) :])
+            elif rule.startswith(GLOB_PREFIX):
+                globs.append(rule[len(GLOB_PREFIX) :])
+            elif GLOB_CHARS.intersection(rule):
+                globs.append(rule)
+            else:
+                literals.append(rule)
+        if literal == "prefix":
+            return cls(prefixes=literals, globs=globs, regexes=regexes)
+        return cls(substrings=literals, globs=globs, regexes=regexes)
+
+    def __bool__(self) -> bool:
+        """ルールが1つでもあるかを返す"""
+        return bool(self.prefix_trie) or self.search_pattern is not None or self.glob_pattern is not None
+
+    def matches(self, text: str) -> bool:
+        """文字列がいずれかのルールに一致するかを判定する"""
+        if self.prefix_trie.has_prefix_of(text):
+            return True
+        if self.search_pattern is not None and self.search_pattern.search(text):
+            return True
+        if self.glob_pattern is not None and self.glob_pattern.match(text):
+            return True
+        return False
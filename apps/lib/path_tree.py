@@ -1,23 +1,101 @@
 import os
 from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable
 from urllib.parse import urlparse
 
-from apps.lib.utils import format_content, make_relative_path, print_colored
+from apps.lib.utils import count_tokens, format_content, format_number, make_relative_path, print_colored
+
+# 簡略表示で1つのディレクトリに表示する子の数の上限
+default_max_entries = 20
+
+
+def is_url_path(path: str) -> bool:
+    return path.startswith("http://") or path.startswith("https://")
+
+
+@dataclass
+class TreeNodeStat:
+    """ノード以下のファイル数とトークン数の合計、木の高さ"""
+
+    files: int = 0
+    tokens: int = 0
+    height: int = 0
 
 
 class PathTree:
+    """パスまたはURLのリストを木構造で表示する
+
+    URLかパスかの判定はパスを追加するときに1回ずつだけ行い、木構造への追加と表示はパスの数に比例する時間で行う。
+    """
+
     paths: list[str]
     root_path: str | None
+    sizes: dict[str, int]
     tree: defaultdict[str, dict] = defaultdict(dict)
 
-    def __init__(self, paths: list[str], root_path: str | None = None):
-        self.paths = paths
+    def __init__(self, paths: list[str], root_path: str | None = None, sizes: dict[str, int] | None = None):
+        """
+        Args:
+            paths (list[str]): パスまたはURLのリスト
+            root_path (str | None): 起点となるパス。指定しない場合はpathsの共通のルートを使う
+            sizes (dict[str, int] | None): パスごとのトークン数。簡略表示でディレクトリごとの合計を表示する
+        """
+        self.paths = list(paths)
+        self.sizes = dict(sizes or {})
+        self._fixed_root_path = bool(root_path)
+        # URLではないパスの数。1つでも含まれる場合はディレクトリパスとして扱う
+        self._non_url_count = sum(not is_url_path(path) for path in self.paths)
+        self._domains = set(urlparse(path).netloc for path in self.paths) if self.is_url() else set()
+        self._layout: str | None = None
         if root_path:
             self.root_path = root_path
         else:
             self.root_path = self.find_common_root()
         self.create_tree()
 
+    def add(self, path: str, size: int | None = None) -> None:
+        """パスまたはURLを1つ追加する
+
+        URLとパスの判定や共通のルートが変わる場合だけ木構造を作り直す。
+        """
+        if size is not None:
+            self.sizes[path] = size
+        was_url = self.is_url()
+        self.paths.append(path)
+        if not is_url_path(path):
+            self._non_url_count += 1
+        elif was_url:
+            self._domains.add(urlparse(path).netloc)
+        self._layout = None
+
+        if was_url != self.is_url():
+            # URLのみのリストにパスが追加された場合は、ディレクトリパスとして作り直す
+            self._domains = set()
+            self._update_root_path()
+            self.create_tree()
+        elif self.is_url():
+            self._update_root_path()
+            self.insert_into_tree(self.tree, self.parse_url(path))
+        elif self._update_root_path():
+            # 共通のルートが変わった場合は、相対パスが変わるため作り直す
+            self.create_tree()
+        else:
+            self.insert_into_tree(self.tree, self.parse_directory_path(path))
+
+    def _update_root_path(self) -> bool:
+        """root_pathが指定されていない場合は共通のルートを更新し、変わったかどうかを返す"""
+        if self._fixed_root_path:
+            return False
+        old_root_path = self.root_path
+        if self.is_url():
+            self.root_path = next(iter(self._domains)) if len(self._domains) == 1 else None
+        elif old_root_path and len(self.paths) > 1:
+            self.root_path = os.path.commonpath([old_root_path, self.paths[-1]])
+        else:
+            self.root_path = os.path.commonpath(self.paths)
+        return self.root_path != old_root_path
+
     def parse_url(self, url: str) -> list[str]:
         # URLのパース処理を変更して、ドメイン名を含める
         parsed_url = urlparse(url)
@@ -39,7 +117,7 @@ class PathTree:
 
     def is_url(self) -> bool:
         # すべてのパスがURLかどうかを判定する
-        return all(path.startswith("http://") or path.startswith("https://") for path in self.paths)
+        return self._non_url_count == 0
 
     # pathsの中の起点となるパスを取得する
     def get_root_path(self) -> str:
@@ -62,11 +140,11 @@ class PathTree:
 
         if self.is_url():
             # 複数のドメインからなる URL のリストを渡した場合、Noneを返す
-            if len(set(urlparse(path).netloc for path in self.paths)) > 1:
+            if len(self._domains) > 1:
                 return None
 
             # 単一のドメインからなる URL の場合は、ドメイン名を返す
-            return urlparse(self.paths[0]).netloc
+            return next(iter(self._domains))
         else:
             # ディレクトリパスの場合
             return os.path.commonpath(self.paths)
@@ -74,35 +152,170 @@ class PathTree:
     def create_tree(self) -> None:
         # まずself.treeを空のdefaultdictにする
         self.tree = defaultdict(dict)
+        self._layout = None
+        parse = self.parse_url if self.is_url() else self.parse_directory_path
         for path in self.paths:
-            if self.is_url():
-                parsed_paths = self.parse_url(path)
-            else:
-                parsed_paths = self.parse_directory_path(path)
-            self.insert_into_tree(self.tree, parsed_paths)
+            self.insert_into_tree(self.tree, parse(path))
 
     def get_tree_layout(self, tree: dict[str, dict] | None = None, prefix: str = "", is_root: bool = True) -> str:
-        if tree is None:
-            tree = self.tree
-        result = ""
-        items = list(tree.items())
-        for i, (key, value) in enumerate(items):
-            connector = "" if is_root else ("└── " if i == len(items) - 1 else "├── ")
-            new_prefix = "" if is_root else (prefix + ("    " if i == len(items) - 1 else "│   "))
-            result += prefix + connector + key + "\n"
+        # 木構造全体の表示は、パスが追加されるまで使い回す
+        is_whole_tree = tree is None and not prefix and is_root
+        if is_whole_tree and self._layout is not None:
+            return self._layout
+
+        parts: list[str] = []
+        self.write_tree_layout(parts, self.tree if tree is None else tree, prefix, is_root)
+        layout = "".join(parts)
+        if is_whole_tree:
+            self._layout = layout
+        return layout
+
+    def write_tree_layout(
+        self, parts: list[str], tree: dict[str, dict], prefix: str = "", is_root: bool = True
+    ) -> None:
+        """木構造の各行をpartsに追加する。文字列の連結を繰り返さないため、行数に比例する時間で表示できる"""
+        last_index = len(tree) - 1
+        for i, (key, value) in enumerate(tree.items()):
+            connector = "" if is_root else ("└── " if i == last_index else "├── ")
+            new_prefix = "" if is_root else (prefix + ("    " if i == last_index else "│   "))
+            parts.append(prefix + connector + key + "\n")
             if isinstance(value, dict):
-                result += self.get_tree_layout(value, new_prefix, is_root=False)
-        return result
+                self.write_tree_layout(parts, value, new_prefix, is_root=False)
+
+    def collect_stats(self) -> dict[tuple[str, ...], TreeNodeStat]:
+        """ノードごとのファイル数とトークン数の合計を、ルートからのセグメントのタプルをキーにして集計する"""
+        parse = self.parse_url if self.is_url() else self.parse_directory_path
+        leaf_sizes = {tuple(parse(path)): size for path, size in self.sizes.items()}
+        stats: dict[tuple[str, ...], TreeNodeStat] = {}
+
+        def collect(tree: dict[str, dict], key: tuple[str, ...]) -> TreeNodeStat:
+            stat = TreeNodeStat(tokens=leaf_sizes.get(key, 0))
+            if not tree:
+                stat.files = 1
+            for name, child in tree.items():
+                child_stat = collect(child, key + (name,))
+                stat.files += child_stat.files
+                stat.tokens += child_stat.tokens
+                stat.height = max(stat.height, child_stat.height + 1)
+            stats[key] = stat
+            return stat
+
+        collect(self.tree, ())
+        return stats
+
+    def get_compact_tree_layout(
+        self,
+        max_tokens: int | None = None,
+        max_entries: int = default_max_entries,
+        token_counter: Callable[[str], int] = count_tokens,
+    ) -> str:
+        """木構造を簡略化して表示する
+
+        子が1つだけのディレクトリの連なりを1行にまとめ、ディレクトリごとにファイル数とトークン数の合計を付け、
+        子がmax_entriesを超えるディレクトリは残りを1行に省略する。max_tokensを指定した場合は、
+        収まるまで表示する階層を浅くし、それでも収まらない場合は1つのディレクトリに表示する子の数を減らす。
+        """
+        stats = self.collect_stats()
+        max_depth = stats[()].height
+        layout = self._render_compact_layout(stats, max_entries, max_depth)
+        if max_tokens is None:
+            return layout
+
+        while token_counter(layout) > max_tokens:
+            if max_depth > 1:
+                max_depth -= 1
+            elif max_entries > 1:
+                max_entries //= 2
+            else:
+                break
+            layout = self._render_compact_layout(stats, max_entries, max_depth)
+        return layout
 
-    def get_tree_map(self) -> str:
+    def _render_compact_layout(
+        self, stats: dict[tuple[str, ...], TreeNodeStat], max_entries: int, max_depth: int
+    ) -> str:
+        parts: list[str] = []
+        self.write_compact_tree_layout(parts, self.tree, stats, (), max_entries, max_depth)
+        return "".join(parts)
+
+    def write_compact_tree_layout(
+        self,
+        parts: list[str],
+        tree: dict[str, dict],
+        stats: dict[tuple[str, ...], TreeNodeStat],
+        key: tuple[str, ...],
+        max_entries: int,
+        max_depth: int,
+        prefix: str = "",
+        is_root: bool = True,
+        depth: int = 0,
+    ) -> None:
+        """簡略化した木構造の各行をpartsに追加する"""
+        items = list(tree.items())
+        hidden_items = items[max_entries:] if len(items) > max_entries else []
+        shown_items = items[: len(items) - len(hidden_items)]
+        last_index = len(shown_items) - 1 if not hidden_items else len(shown_items)
+        for i, (name, child) in enumerate(shown_items):
+            child_key = key + (name,)
+            label = name
+            # 子が1つだけのディレクトリの連なりを1行にまとめる
+            while len(child) == 1:
+                sub_name, sub_child = next(iter(child.items()))
+                if not sub_child:
+                    break
+                label = f"{label}/{sub_name}"
+                child_key = child_key + (sub_name,)
+                child = sub_child
+
+            connector = "" if is_root else ("└── " if i == last_index else "├── ")
+            new_prefix = "" if is_root else (prefix + ("    " if i == last_index else "│   "))
+            parts.append(prefix + connector + self.format_node_label(label, child, stats[child_key]) + "\n")
+            if child and depth + 1 < max_depth:
+                self.write_compact_tree_layout(
+                    parts, child, stats, child_key, max_entries, max_depth, new_prefix, False, depth + 1
+                )
+
+        if hidden_items:
+            files = sum(stats[key + (name,)].files for name, _ in hidden_items)
+            tokens = sum(stats[key + (name,)].tokens for name, _ in hidden_items)
+            connector = "" if is_root else "└── "
+            parts.append(
+                prefix + connector + f"... {len(hidden_items)} more" + self.format_stat(files, tokens) + "\n"
+            )
+
+    def format_node_label(self, label: str, tree: dict[str, dict], stat: TreeNodeStat) -> str:
+        if not tree:
+            return label + (f" ({format_number(stat.tokens)} tokens)" if stat.tokens else "")
+        return f"{label}/" + self.format_stat(stat.files, stat.tokens)
+
+    def format_stat(self, files: int, tokens: int) -> str:
+        file_unit = "file" if files == 1 else "files"
+        if not tokens:
+            return f" ({format_number(files)} {file_unit})"
+        return f" ({format_number(files)} {file_unit}, {format_number(tokens)} tokens)"
+
+    def get_tree_map(
+        self,
+        max_tokens: int | None = None,
+        max_entries: int = default_max_entries,
+        token_counter: Callable[[str], int] = count_tokens,
+    ) -> str:
+        """タイトルを付けた木構造を返す
+
+        max_tokensを指定し、木構造全体がそのトークン数を超える場合は簡略化して表示する。
+        """
         title: str
         if self.is_url():
             title = f"Web Site Map: {self.get_root_path()}"
         else:
             title = f"Directory Structure Chart: {self.get_root_path()}"
 
+        layout = self.get_tree_layout()
+        if max_tokens is not None and token_counter(layout) > max_tokens:
+            layout = self.get_compact_tree_layout(max_tokens, max_entries, token_counter)
+
         # titleにpathsを追加
-        return format_content(title, self.get_tree_layout(), style="doc")
+        return format_content(title, layout, style="doc")
 
     def print_tree_map(self) -> None:
         print_colored(("\n== Tree Map ==", "green"))
@@ -0,0 +1,150 @@
+from dataclasses import dataclass
+from typing import Callable
+
+from apps.lib.llms import LlmModelEnum
+from apps.lib.utils import count_tokens, format_number, print_colored
+
+# 削ったセクションの末尾に付ける文字列
+TRUNCATED_MARKER = "\n...(以降省略)\n"
+
+# ファイルごとのコードの区切り(format_contentの見出し)
+FILE_BLOCK_SEPARATOR = "\n### "
+
+
+def trim_text_to_tokens(text: str, max_tokens: int, token_counter: Callable[[str], int] = count_tokens) -> str:
+    """テキストをmax_tokens以下に削る
+
+    format_contentで連結したコードの場合は、末尾のファイルから丸ごと削る。
+    先頭のファイルも収まらない場合は、文字数の比率で末尾を切り詰める。
+    """
+    if max_tokens <= 0:
+        return ""
+    if token_counter(text) <= max_tokens:
+        return text
+
+    # 末尾のファイルから削る。ブロックごとのトークン数を1回ずつ数え、収まるブロックの数を求める
+    blocks = text.split(FILE_BLOCK_SEPARATOR)
+    budget = max_tokens - token_counter(TRUNCATED_MARKER)
+    count = 0
+    used_tokens = 0
+    for block in blocks:
+        used_tokens += token_counter(FILE_BLOCK_SEPARATOR + block)
+        if used_tokens > budget:
+            break
+        count += 1
+    # ブロックの境界でトークンの区切りが変わる場合があるため、連結した結果で確認する
+    while count > 0:
+        trimmed = FILE_BLOCK_SEPARATOR.join(blocks[:count]) + TRUNCATED_MARKER
+        if token_counter(trimmed) <= max_tokens:
+            return trimmed
+        count -= 1
+
+    # 1つのブロックでも収まらない場合は、トークン数と文字数の比率から切り詰める位置を求める
+    trimmed = blocks[0]
+    while trimmed:
+        tokens = token_counter(trimmed + TRUNCATED_MARKER)
+        if tokens <= max_tokens:
+            return trimmed + TRUNCATED_MARKER
+        trimmed = trimmed[: min(len(trimmed) - 1, int(len(trimmed) * max_tokens / tokens * 0.95))]
+    return ""
+
+
+@dataclass
+class PromptSection:
+    """プロンプトに埋め込む1つの入力"""
+
+    name: str
+    content: str
+    tokens: int
+    # 大きいほど後まで残す
+    priority: int = 0
+    # Falseの場合は削らない
+    trimmable: bool = True
+
+
+class PromptBuilder:
+    """プロンプトに埋め込む入力のトークン数をセクションごとに数え、モデルのコンテキストウィンドウに収める
+
+    収まらない場合は、優先度の低いセクション(参照用のコードなど)から削る。
+    削れないセクションだけで収まらない場合はValueErrorを送出し、APIに拒否されるリクエストを送らない。
+    """
+
+    llm_model: LlmModelEnum
+    reserved_tokens: int
+    sections: list[PromptSection]
+
+    def __init__(
+        self,
+        llm_model: LlmModelEnum,
+        reserved_tokens: int = 0,
+        token_counter: Callable[[str], int] = count_tokens,
+    ):
+        """
+        Args:
+            llm_model (LlmModelEnum): 使用するモデル。コンテキストウィンドウと出力の最大トークン数を使う
+            reserved_tokens (int): 指示文や前のステップの出力など、セクション以外のために空けておくトークン数
+            token_counter (Callable[[str], int]): トークン数を数える関数
+        """
+        self.llm_model = llm_model
+        self.reserved_tokens = reserved_tokens
+        self.token_counter = token_counter
+        self.sections = []
+
+    @property
+    def max_tokens(self) -> int:
+        """セクションの合計に使えるトークン数"""
+        model = self.llm_model.value
+        return model.context_window - model.max_tokens - self.reserved_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(section.tokens for section in self.sections)
+
+    def add_section(self, name: str, content: str, priority: int = 0, trimmable: bool = True) -> "PromptBuilder":
+        """セクションを追加する"""
+        if any(section.name == name for section in self.sections):
+            raise ValueError(f"Duplicate section name: {name}")
+        self.sections.append(
+            PromptSection(
+                name=name,
+                content=content,
+                tokens=self.token_counter(content),
+                priority=priority,
+                trimmable=trimmable,
+            )
+        )
+        return self
+
+    def fit(self) -> dict[str, str]:
+        """優先度の低いセクションから削ってmax_tokensに収め、セクション名をキーにした内容を返す"""
+        overflow = self.total_tokens - self.max_tokens
+        # 優先度が同じ場合は、後に追加したセクションから削る
+        candidates = sorted(
+            (section for section in self.sections if section.trimmable),
+            key=lambda section: (section.priority, -self.sections.index(section)),
+        )
+        for section in candidates:
+            if overflow <= 0:
+                break
+            content = trim_text_to_tokens(section.content, section.tokens - overflow, self.token_counter)
+            tokens = self.token_counter(content)
+            overflow -= section.tokens - tokens
+            section.content = content
+            section.tokens = tokens
+
+        if overflow > 0:
+            raise ValueError(
+                f"Prompt exceeds the context window of {self.llm_model.value.name}: "
+                f"{format_number(self.total_tokens)} > {format_number(self.max_tokens)} tokens"
+            )
+        return {section.name: section.content for section in self.sections}
+
+    def print_summary(self) -> None:
+        """セクションごとのトークン数を表示する"""
+        print_colored(
+            ("Prompt tokens: ", "green"),
+            f"{format_number(self.total_tokens)} / {format_number(self.max_tokens)}",
+            (f" ({self.llm_model.value.name})", "grey"),
+        )
+        for section in self.sections:
+            print_colored((f"  {section.name}: ", "grey"), format_number(section.tokens))
@@ -0,0 +1,136 @@
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# レート制限や一時的な過負荷を表すステータスコード
+THROTTLE_STATUS_CODES = frozenset([429, 503])
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-Afterヘッダーの値(秒数またはHTTP日付)を待機秒数に変換する"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+@dataclass
+class TokenBucket:
+    """トークンバケット。rate(個/秒)でトークンが補充され、capacityまで貯まる"""
+
+    rate: float
+    capacity: float
+    tokens: float
+    updated_at: float
+
+    def reserve(self, now: float) -> float:
+        """トークンを1つ予約し、利用可能になるまでの待機秒数を返す"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+@dataclass
+class HostState:
+    bucket: TokenBucket
+    max_rate: float
+    blocked_until: float = 0.0
+
+
+class HostRateLimiter:
+    """ホストごとのトークンバケットでリクエストの間隔を制御する
+
+    429/503が返された場合はレートを下げ(乗算的減少)、Retry-Afterの間はそのホストへのリクエストを止める。
+    成功した場合は上限のレートまで少しずつレートを戻す(加算的増加)。スレッドセーフに動作する。
+    """
+
+    rate: float
+    burst: float
+    min_rate: float
+    increase_step: float
+    decrease_factor: float
+    max_wait: float
+    hosts: dict[str, HostState]
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: float = 2.0,
+        min_rate: float = 0.1,
+        increase_step: float = 0.1,
+        decrease_factor: float = 0.5,
+        max_wait: float = 300.0,
+    ):
+        """
+        Args:
+            rate (float): ホストごとの最大リクエスト数(回/秒)
+            burst (float): 連続して送れるリクエスト数
+            min_rate (float): バックオフで下げるレートの下限(回/秒)
+            increase_step (float): 成功時に戻すレート(回/秒)
+            decrease_factor (float): 429/503の時にレートに掛ける係数
+            max_wait (float): Retry-Afterで待機する最大秒数
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.max_wait = max_wait
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def get_host_state(self, url: str) -> HostState:
+        """URLのホストの状態を取得する。呼び出し元でロックを取得しておくこと"""
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostState(
+                bucket=TokenBucket(rate=self.rate, capacity=self.burst, tokens=self.burst, updated_at=time.monotonic()),
+                max_rate=self.rate,
+            )
+        return self.hosts[host]
+
+    def set_max_rate(self, url: str, max_rate: float) -> None:
+        """ホストの最大レートを設定する(robots.txtのCrawl-delayなど)"""
+        with self._lock:
+            state = self.get_host_state(url)
+            state.max_rate = min(self.rate, max_rate)
+            state.bucket.rate = min(state.bucket.rate, state.max_rate)
+            state.bucket.capacity = min(state.bucket.capacity, max(state.max_rate, 1.0))
+
+    def acquire(self, url: str) -> float:
+        """ホストへのリクエストが許可されるまで待機し、待機した秒数を返す"""
+        with self._lock:
+            state = self.get_host_state(url)
+            now = time.monotonic()
+            # Retry-Afterでブロックされている間は、その時刻からトークンを数える
+            start = max(now, state.blocked_until)
+            wait_seconds = start - now + state.bucket.reserve(start)
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+        return wait_seconds
+
+    def on_response(self, url: str, status_code: int, retry_after: str | None = None) -> None:
+        """レスポンスのステータスコードに応じてホストのレートを調整する"""
+        with self._lock:
+            state = self.get_host_state(url)
+            bucket = state.bucket
+            if status_code in THROTTLE_STATUS_CODES:
+                bucket.rate = max(self.min_rate, bucket.rate * self.decrease_factor)
+                wait_seconds = parse_retry_after(retry_after)
+                if wait_seconds is None:
+                    # Retry-Afterが無い場合は、下げたレートの1リクエスト分だけ待つ
+                    wait_seconds = 1 / bucket.rate
+                state.blocked_until = max(state.blocked_until, time.monotonic() + min(wait_seconds, self.max_wait))
+            else:
+                bucket.rate = min(state.max_rate, bucket.rate + self.increase_step)
@@ -0,0 +1,182 @@
+import gzip
+import io
+import threading
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+from lxml import etree
+
+from apps.lib.rate_limiter import HostRateLimiter
+from apps.lib.utils import print_colored
+
+# 外部エンティティやネットワークアクセスを無効にしたXMLパーサー
+SITEMAP_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, recover=True)
+
+# サイトマップの展開後の最大サイズ(サイトマップのプロトコルの上限)
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+
+
+def get_origin(url: str) -> str:
+    """URLからスキームとホストからなるオリジンを取得する"""
+    parsed_url = urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+
+def parse_robots(text: str) -> RobotFileParser:
+    """robots.txtの内容を解析する"""
+    robots = RobotFileParser()
+    robots.parse(text.splitlines())
+    return robots
+
+
+def parse_sitemap(content: bytes, max_bytes: int = MAX_SITEMAP_BYTES) -> tuple[list[str], list[str]]:
+    """sitemap.xmlの内容を解析し、ページのURLと子サイトマップのURLを返す
+
+    gzipで圧縮されたサイトマップにも対応する。展開後のサイズがmax_bytesを超える場合は、展開を中断する。
+
+    Returns:
+        tuple[list[str], list[str]]: ページのURLのリストと、サイトマップインデックスに含まれるサイトマップのURLのリスト
+
+    Raises:
+        ValueError: 展開後のサイズがmax_bytesを超える場合
+    """
+    # gzipのマジックナンバーで判定して展開する
+    if content[:2] == b"\x1f\x8b":
+        with gzip.GzipFile(fileobj=io.BytesIO(content)) as f:
+            content = f.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise ValueError(f"Sitemap is over {max_bytes} bytes")
+
+    root = etree.fromstring(content, parser=SITEMAP_PARSER)
+    if root is None:
+        return [], []
+
+    page_urls: list[str] = []
+    sitemap_urls: list[str] = []
+    is_index = etree.QName(root).localname == "sitemapindex"
+    for element in root.iter("{*}loc"):
+        if not element.text:
+            continue
+        if is_index:
+            sitemap_urls.append(element.text.strip())
+        else:
+            page_urls.append(element.text.strip())
+    return page_urls, sitemap_urls
+
+
+class SiteDiscoverer:
+    """robots.txtとsitemap.xmlからURLを発見し、robots.txtのルールを提供する"""
+
+    user_agent: str
+    max_sitemaps: int
+    rate_limiter: HostRateLimiter
+    max_content_bytes: int
+    robots: dict[str, RobotFileParser]
+
+    def __init__(
+        self,
+        user_agent: str | None = None,
+        max_sitemaps: int = 100,
+        rate_limiter: HostRateLimiter | None = None,
+        max_content_bytes: int = MAX_SITEMAP_BYTES,
+    ):
+        """
+        Args:
+            user_agent (str | None): robots.txtのルールを判定するユーザーエージェント
+            max_sitemaps (int): 取得するサイトマップの最大数
+            rate_limiter (HostRateLimiter | None): リクエストのレートを制限するリミッター。ページの取得と共有する
+            max_content_bytes (int): robots.txtとサイトマップの最大サイズ。gzipの場合は展開後のサイズにも適用する
+        """
+        self.user_agent = user_agent or requests.utils.default_user_agent()
+        self.max_sitemaps = max_sitemaps
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        self.max_content_bytes = max_content_bytes
+        self.robots = {}
+        # 取得スレッドから同時に呼ばれても、オリジンごとにrobots.txtを1回だけ取得する
+        self._robots_lock = threading.Lock()
+
+    def fetch_content(self, url: str, timeout: float) -> bytes | None:
+        """ホストごとのレート制限に従ってURLを取得する。ステータスコードが200以外の場合はNoneを返す
+
+        本文はストリーミングで読み込み、max_content_bytesを超えた時点で中断する。
+
+        Raises:
+            ValueError: 本文がmax_content_bytesを超える場合
+        """
+        self.rate_limiter.acquire(url)
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            self.rate_limiter.on_response(url, response.status_code, response.headers.get("Retry-After"))
+            if response.status_code != 200:
+                return None
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > self.max_content_bytes:
+                raise ValueError(f"{url} is over {self.max_content_bytes} bytes")
+
+            chunks: list[bytes] = []
+            total_bytes = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                chunks.append(chunk)
+                total_bytes += len(chunk)
+                if total_bytes > self.max_content_bytes:
+                    raise ValueError(f"{url} is over {self.max_content_bytes} bytes")
+        return b"".join(chunks)
+
+    def get_robots(self, url: str) -> RobotFileParser:
+        """URLのオリジンのrobots.txtを取得する。オリジンごとに1回だけリクエストする"""
+        origin = get_origin(url)
+        robots = self.robots.get(origin)
+        if robots is not None:
+            return robots
+
+        with self._robots_lock:
+            if origin not in self.robots:
+                robots_url = urljoin(origin, "/robots.txt")
+                text = ""
+                try:
+                    content = self.fetch_content(robots_url, timeout=10)
+                    # robots.txtが存在しない場合は全てのURLを許可する
+                    if content is not None:
+                        text = content.decode("utf-8", errors="replace")
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    print_colored((f"Error fetching {robots_url}: {e}", "red"))
+                self.robots[origin] = parse_robots(text)
+            return self.robots[origin]
+
+    def can_fetch(self, url: str) -> bool:
+        """robots.txtのルールでURLの取得が許可されているかを判定する"""
+        return self.get_robots(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url: str) -> float | None:
+        """robots.txtで指定されたクロール間隔(秒)を取得する"""
+        delay = self.get_robots(url).crawl_delay(self.user_agent)
+        return float(delay) if delay is not None else None
+
+    def discover_urls(self, root_url: str) -> list[str]:
+        """robots.txtに記載されたサイトマップ(無ければ/sitemap.xml)から、ページのURLを収集する"""
+        sitemap_urls = list(self.get_robots(root_url).site_maps() or [])
+        if not sitemap_urls:
+            sitemap_urls = [urljoin(get_origin(root_url), "/sitemap.xml")]
+
+        page_urls: list[str] = []
+        visited_sitemaps: set[str] = set()
+        while sitemap_urls and len(visited_sitemaps) < self.max_sitemaps:
+            sitemap_url = sitemap_urls.pop(0)
+            if sitemap_url in visited_sitemaps:
+                continue
+            visited_sitemaps.add(sitemap_url)
+
+            try:
+                content = self.fetch_content(sitemap_url, timeout=30)
+                if content is None:
+                    continue
+                found_page_urls, found_sitemap_urls = parse_sitemap(content, self.max_content_bytes)
+            except (requests.exceptions.RequestException, etree.XMLSyntaxError, OSError, ValueError) as e:
+                print_colored((f"Error reading sitemap {sitemap_url}: {e}", "red"))
+                continue
+
+            print_colored(("Sitemap: ", "green"), f"{len(found_page_urls)} urls ", (sitemap_url, "grey"))
+            page_urls.extend(found_page_urls)
+            sitemap_urls.extend(found_sitemap_urls)
+        return page_urls
@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Container, Iterable
+
+from apps.lib.llm_ledger import llm_stage
+from apps.lib.utils import print_markdown
+
+
+@dataclass
+class Stage:
+    """パイプラインの1つの処理
+
+    inputsは「関数の引数名: 値の名前」の対応で、値の名前は最初に渡す値か、他のステージの名前を指定する。
+    引数名と値の名前が同じ場合は、名前のリストで指定できる。
+    """
+
+    name: str
+    func: Callable[..., Any]
+    inputs: dict[str, str] | list[str] = field(default_factory=dict)
+    # 完了したときに結果とともに表示する見出し
+    title: str | None = None
+    # 実行中に出力をストリーミングで表示するかどうか。見出しを実行前に表示する
+    stream: bool = False
+
+    def get_inputs(self) -> dict[str, str]:
+        """「関数の引数名: 値の名前」の対応を返す"""
+        if isinstance(self.inputs, list):
+            return {name: name for name in self.inputs}
+        return self.inputs
+
+    def is_ready(self, value_names: Container[str]) -> bool:
+        """すべての入力の値が揃っているかを返す"""
+        return all(source in value_names for source in self.get_inputs().values())
+
+
+class StageRunner:
+    """依存関係を宣言したステージを、入力が揃ったものから並行して実行する
+
+    LLMの呼び出しのように待ち時間の長い処理を想定し、スレッドで実行する。
+    互いに依存しないステージは同時に実行されるため、直列に実行するよりも全体の時間が短くなる。
+    """
+
+    stages: dict[str, Stage]
+    max_workers: int
+
+    def __init__(self, stages: list[Stage], max_workers: int = 4):
+        """
+        Args:
+            stages (list[Stage]): 実行するステージ
+            max_workers (int): 同時に実行するステージの数の上限
+        """
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage name: {stage.name}")
+            self.stages[stage.name] = stage
+        self.max_workers = max_workers
+        self._print_lock = threading.Lock()
+
+    def validate(self, value_names: Iterable[str]) -> None:
+        """すべての入力が解決でき、依存関係が循環していないことを確認する"""
+        resolved = set(value_names)
+        for stage in self.stages.values():
+            for source in stage.get_inputs().values():
+                if source not in resolved and source not in self.stages:
+                    raise ValueError(f"Unknown input '{source}' of stage '{stage.name}'")
+
+        pending = dict(self.stages)
+        while pending:
+            ready = [name for name, stage in pending.items() if stage.is_ready(resolved)]
+            if not ready:
+                raise ValueError(f"Circular dependency between stages: {', '.join(pending)}")
+            for name in ready:
+                resolved.add(name)
+                del pending[name]
+
+    def run(self, values: dict[str, Any]) -> dict[str, Any]:
+        """ステージを実行し、最初に渡した値とすべてのステージの結果を名前をキーにして返す"""
+        self.validate(values.keys())
+        results = dict(values)
+        pending = dict(self.stages)
+        running: dict[Future, Stage] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [stage for stage in pending.values() if stage.is_ready(results)]
+                for stage in ready:
+                    del pending[stage.name]
+                    kwargs = {param: results[source] for param, source in stage.get_inputs().items()}
+                    running[executor.submit(self.run_stage, stage, kwargs)] = stage
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    results[stage.name] = future.result()
+
+        return results
+
+    def run_stage(self, stage: Stage, kwargs: dict[str, Any]) -> Any:
+        """ステージの関数を実行する。中で呼び出したLLMは、ステージの名前で記録する
+
+        ストリーミングするステージは、見出し・ストリーミングの出力・結果の順に表示されるように、
+        実行が終わるまで他のステージの表示を待たせる。
+        """
+        with llm_stage(stage.name):
+            if stage.title is None or not stage.stream:
+                result = stage.func(**kwargs)
+                self.on_complete(stage, result)
+                return result
+
+            with self._print_lock:
+                print_markdown(stage.title)
+                result = stage.func(**kwargs)
+                print_markdown(str(result))
+            return result
+
+    def on_complete(self, stage: Stage, result: Any) -> None:
+        """見出しがあるステージの結果を表示する。同時に完了したステージの表示が混ざらないようにする"""
+        if stage.title is None:
+            return
+        with self._print_lock:
+            print_markdown(stage.title)
+            print_markdown(str(result))
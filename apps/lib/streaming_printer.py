@@ -0,0 +1,109 @@
+import time
+from types import TracebackType
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+# コードブロックの開始と終了の記号
+CODE_FENCES = ("```", "~~~")
+
+
+class StreamingPrinter:
+    """ストリーミングで受け取ったテキストを、受け取るたびにターミナルに表示する
+
+    テキストは断片のリストに溜め、最後にまとめて連結する。
+    マークダウンの場合は、空行で区切られて確定したブロックを一度だけ表示し、書きかけの末尾のブロックだけを再描画する。
+    再描画はrefresh_interval秒に1回に間引くため、長い出力でも全体を何度も解析し直さない。
+    """
+
+    markdown: bool
+    refresh_interval: float
+
+    def __init__(self, markdown: bool = False, refresh_interval: float = 0.25, console: Console | None = None):
+        """
+        Args:
+            markdown (bool): マークダウンとして表示するかどうか
+            refresh_interval (float): 末尾のブロックを再描画する最短の間隔(秒)
+            console (Console | None): 表示に使うコンソール
+        """
+        self.markdown = markdown
+        self.refresh_interval = refresh_interval
+        self.console = console or Console()
+        self._chunks: list[str] = []
+        # 確定していない末尾のブロックの、改行まで受け取った行
+        self._block_lines: list[str] = []
+        # 改行をまだ受け取っていない最後の行
+        self._partial_line = ""
+        self._in_code_block = False
+        self._live: Live | None = None
+        self._last_refreshed_at = 0.0
+
+    def __enter__(self) -> "StreamingPrinter":
+        if self.markdown:
+            self._live = Live(console=self.console, auto_refresh=False)
+            self._live.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def write(self, text: str) -> None:
+        """テキストの断片を追加して表示する"""
+        if not text:
+            return
+        self._chunks.append(text)
+        if self._live is None:
+            print(text, end="", flush=True)
+            return
+
+        printed = self._print_completed_blocks(text)
+        now = time.monotonic()
+        # 確定したブロックを表示した場合は、末尾のブロックに残った古い表示をすぐに消す
+        if printed or now - self._last_refreshed_at >= self.refresh_interval:
+            self._refresh()
+            self._last_refreshed_at = now
+
+    def get_text(self) -> str:
+        """これまでに受け取ったテキストを返す"""
+        text = "".join(self._chunks)
+        self._chunks = [text]
+        return text
+
+    def close(self) -> None:
+        """書きかけのブロックを表示して終了する"""
+        if self._live is None:
+            return
+        self._refresh()
+        self._live.stop()
+        self._live = None
+
+    def _print_completed_blocks(self, text: str) -> bool:
+        """受け取ったテキストの行を末尾のブロックに追加し、コードブロックの外の空行までを確定したブロックとして表示する
+
+        Returns:
+            bool: ブロックを表示したかどうか
+        """
+        printed = False
+        *lines, self._partial_line = (self._partial_line + text).split("\n")
+        for line in lines:
+            self._block_lines.append(line)
+            if line.lstrip().startswith(CODE_FENCES):
+                self._in_code_block = not self._in_code_block
+            elif not line.strip() and not self._in_code_block:
+                block = "\n".join(self._block_lines)
+                self._block_lines = []
+                if block.strip() and self._live is not None:
+                    # Liveの表示より上に出力し、以降は再描画しない
+                    self._live.console.print(Markdown(block))
+                    printed = True
+        return printed
+
+    def _refresh(self) -> None:
+        if self._live is not None:
+            self._live.update(Markdown("\n".join([*self._block_lines, self._partial_line])), refresh=True)
@@ -1,6 +1,7 @@
 import re
 import textwrap
 from enum import Enum
+from functools import partial
 
 from pydantic import BaseModel, Field
 
@@ -10,10 +11,21 @@ from apps.lib.llms import (
     LlmMessages,
     LlmModelEnum,
 )
+from apps.lib.llm_ledger import llm_stage
+from apps.lib.llm_response_cache import get_llm_response_cache
+from apps.lib.prompt_builder import PromptBuilder
+from apps.lib.stage_runner import Stage, StageRunner
 from apps.lib.utils import (
     print_markdown,
 )
 
+# 温度が0の同じプロンプトを繰り返し実行する場合にAPIを呼ばないように、レスポンスをキャッシュするクライアントを共有する
+# 指定したモデルで生成できない場合は、もう一方のモデルに切り替えて続ける
+gemini_client = GeminiClient(
+    cache=get_llm_response_cache(),
+    fallback_models=[LlmModelEnum.GEMINI15FLASH, LlmModelEnum.GEMINI15PRO],
+)
+
 
 class TestCodeAndScore(BaseModel):
     """
@@ -248,6 +260,32 @@ TEST_CODE_CONVENTION_AND_KNOWLEDGE = textwrap.dedent(
 )
 
 
+# 指示文と前のステップの出力のために、プロンプトの入力とは別に空けておくトークン数
+PROMPT_RESERVED_TOKENS = 50_000
+
+
+def fit_prompt_inputs(
+    code: str, target_code: str, test_code: str = "", test_results: str = "", target_git_diff: str = ""
+) -> dict[str, str]:
+    """プロンプトに埋め込む入力を、パイプラインで使うモデルのうち最も小さいコンテキストウィンドウに収める
+
+    収まらない場合は、参照用のファイルを含む実装コードから削る。
+    """
+    prompt_builder = (
+        PromptBuilder(LlmModelEnum.GEMINI15FLASH, reserved_tokens=PROMPT_RESERVED_TOKENS)
+        .add_section("conventions", TEST_CODE_CONVENTION_AND_KNOWLEDGE, priority=3, trimmable=False)
+        .add_section("target_code", target_code, priority=2)
+        .add_section("test_code", test_code, priority=2)
+        .add_section("test_results", test_results, priority=1)
+        .add_section("target_git_diff", target_git_diff, priority=1)
+        .add_section("code", code, priority=0)
+    )
+    inputs = prompt_builder.fit()
+    prompt_builder.print_summary()
+    return inputs
+
+
+@llm_stage("analyze_implementation_code")
 def analyze_implementation_code(code: str, target_specification: str) -> str:
     """
     実装コードを分析する関数
@@ -334,7 +372,7 @@ def analyze_implementation_code(code: str, target_specification: str) -> str:
             ),
         ]
     )
-    return GeminiClient().generate_text(
+    return gemini_client.generate_text(
         llm_model=LlmModelEnum.GEMINI15FLASH,
         messages=messages,
         stream=True,
@@ -355,6 +393,7 @@ def generate_test_code(
     """
 
     # テストケースを列挙する関数
+    @llm_stage("extract_test_cases")
     def extract_test_cases(
         target_code: str, target_specification: str, impl_code_analysis: str, supplement: str, scope: TestScopeEnum
     ) -> str:
@@ -436,7 +475,7 @@ def generate_test_code(
             ]
         )
 
-        output_message = GeminiClient().generate_text(
+        output_message = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -445,6 +484,7 @@ def generate_test_code(
 
         return output_message
 
+    @llm_stage("generate_test_code")
     def generate_test_code(
         code: str, flamework: TestingFlameworkEnum, scope: TestScopeEnum, target_specification: str, supplement: str
     ) -> str:
@@ -517,7 +557,7 @@ def generate_test_code(
             ]
         )
 
-        output_message = GeminiClient().generate_text(
+        output_message = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15PRO,
             messages=messages,
             temp=0.0,
@@ -526,6 +566,9 @@ def generate_test_code(
 
         return output_message
 
+    inputs = fit_prompt_inputs(code=code, target_code=target_code)
+    code, target_code = inputs["code"], inputs["target_code"]
+
     # step1:実装コードを分析する
     print_markdown("## 実装コードの分析")
     analyze_implementation_code_result = analyze_implementation_code(
@@ -604,7 +647,7 @@ def update_test_code(
                 ),
             ]
         )
-        return GeminiClient().generate_text(
+        return gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -660,7 +703,7 @@ def update_test_code(
                 ),
             ]
         )
-        return GeminiClient().generate_text(
+        return gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -726,7 +769,7 @@ def update_test_code(
                 ),
             ]
         )
-        return GeminiClient().generate_text(
+        return gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -784,7 +827,7 @@ def update_test_code(
                 ),
             ]
         )
-        return GeminiClient().generate_text(
+        return gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15PRO,
             messages=messages,
             stream=True,
@@ -841,7 +884,7 @@ def update_test_code(
                 ),
             ]
         )
-        return GeminiClient().generate_text(
+        return gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -893,45 +936,86 @@ def update_test_code(
                 ),
             ]
         )
-        return GeminiClient().generate_text(
+        return gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
             temp=0.0,
         )
 
-    # ステップ1: コード解析
-    print_markdown("## コード解析")
-    code_analysis_result = analyze_implementation_code(code, target_specification)
-    print_markdown(code_analysis_result)
-
-    # ステップ2: テストカバレッジ分析
-    print_markdown("## テストカバレッジ分析")
-    coverage_analysis_result = analyze_test_coverage(target_code, test_code, code_analysis_result)
-    print_markdown(coverage_analysis_result)
-
-    # ステップ3: テストケース設計
-    print_markdown("## 新しいテストケース設計")
-    test_case_design = design_new_test_cases(coverage_analysis_result, scope, flamework)
-    print_markdown(test_case_design)
-
-    # ステップ4: テストコード生成
-    print_markdown("## テストコードの生成")
-    generated_test_code = generate_test_code(test_case_design, target_code, test_code, scope, flamework)
-    print_markdown(generated_test_code)
-
-    # ステップ5: テストコード統合
-    print_markdown("## テストコードの統合")
-    integrated_test_code = integrate_test_code(generated_test_code, test_code, flamework)
-    print_markdown(integrated_test_code)
-
-    # ステップ6: テストコード品質評価
-    print_markdown("## テストコード品質評価")
-    quality_assessment = assess_test_quality(integrated_test_code, target_code, scope, flamework)
-    print_markdown(quality_assessment)
+    inputs = fit_prompt_inputs(code=code, target_code=target_code, test_code=test_code)
+    code, target_code, test_code = inputs["code"], inputs["target_code"], inputs["test_code"]
+
+    # 各ステップの入力を宣言し、入力が揃ったステップから実行する
+    # ステップ6の品質評価は表示のためだけに行う
+    results = StageRunner(
+        [
+            Stage(
+                "code_analysis_result",
+                analyze_implementation_code,
+                ["code", "target_specification"],
+                title="## コード解析",
+                stream=True,
+            ),
+            Stage(
+                "coverage_analysis_result",
+                analyze_test_coverage,
+                ["target_code", "test_code", "code_analysis_result"],
+                title="## テストカバレッジ分析",
+                stream=True,
+            ),
+            Stage(
+                "test_case_design",
+                design_new_test_cases,
+                ["coverage_analysis_result", "scope", "flamework"],
+                title="## 新しいテストケース設計",
+                stream=True,
+            ),
+            Stage(
+                "generated_test_code",
+                generate_test_code,
+                {
+                    "test_case_design": "test_case_design",
+                    "code": "target_code",
+                    "test_code": "test_code",
+                    "scope": "scope",
+                    "flamework": "flamework",
+                },
+                title="## テストコードの生成",
+                stream=True,
+            ),
+            Stage(
+                "integrated_test_code",
+                integrate_test_code,
+                {
+                    "generated_test_code": "generated_test_code",
+                    "existing_test_code": "test_code",
+                    "flamework": "flamework",
+                },
+                title="## テストコードの統合",
+                stream=True,
+            ),
+            Stage(
+                "quality_assessment",
+                assess_test_quality,
+                ["integrated_test_code", "target_code", "scope", "flamework"],
+                title="## テストコード品質評価",
+                stream=True,
+            ),
+        ]
+    ).run(
+        {
+            "code": code,
+            "target_code": target_code,
+            "test_code": test_code,
+            "target_specification": target_specification,
+            "scope": scope,
+            "flamework": flamework,
+        }
+    )
 
     # 最終的に更新されたテストコードを返す
-    updated_test_code = extract_code_from_output(integrated_test_code)
+    updated_test_code = extract_code_from_output(results["integrated_test_code"])
     return updated_test_code
 
 
@@ -962,11 +1046,12 @@ def update_test_code_from_git_diff(
         str: 更新されたテストコード
     """
 
-    def code_analysis(code: str, target_specification: str) -> str:
+    def code_analysis(code: str, target_specification: str, stream: bool = True) -> str:
         """実装コードを解析する関数
 
         Args:
             code (str): 実装コード
+            stream (bool): 生成中のテキストを表示するかどうか
 
         Returns:
             str: 解析結果
@@ -1005,20 +1090,21 @@ def update_test_code_from_git_diff(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
-            stream=True,
+            stream=stream,
             temp=0.0,
         )
         return response
 
-    def git_diff_analysis(target_git_diff: str, code: str, code_analysis_result: str) -> str:
+    def git_diff_analysis(target_git_diff: str, code: str, stream: bool = True) -> str:
         """Git差分を分析する関数
 
         Args:
             target_git_diff (str): 対象のGit差分
             code (str): 実装コード
+            stream (bool): 生成中のテキストを表示するかどうか
 
         Returns:
             str: 分析結果
@@ -1057,10 +1143,10 @@ def update_test_code_from_git_diff(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
-            stream=True,
+            stream=stream,
             temp=0.0,
         )
         return response
@@ -1117,7 +1203,7 @@ def update_test_code_from_git_diff(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -1174,7 +1260,7 @@ def update_test_code_from_git_diff(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -1245,7 +1331,7 @@ def update_test_code_from_git_diff(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15PRO,
             messages=messages,
             stream=True,
@@ -1310,7 +1396,7 @@ def update_test_code_from_git_diff(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -1362,7 +1448,7 @@ def update_test_code_from_git_diff(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -1370,61 +1456,88 @@ def update_test_code_from_git_diff(
         )
         return response
 
-    # 実装コードの解析
-    print_markdown("## 実装コードの解析")
-    code_analysis_result = code_analysis(code=code, target_specification=target_specification)
-    print_markdown(code_analysis_result)
-
-    # Git差分の分析
-    print_markdown("## Git差分の分析")
-    git_diff_analysis_result = git_diff_analysis(
-        target_git_diff=target_git_diff, code=code, code_analysis_result=code_analysis_result
-    )
-    print_markdown(git_diff_analysis_result)
-
-    # テストケースへの影響分析
-    print_markdown("## テストケースへの影響分析")
-    test_impact_analysis_result = test_impact_analysis(
-        git_diff_analysis_result=git_diff_analysis_result,
-        test_code=test_code,
-        single_code=target_code,
-        test_scope=scope,
-    )
-    print_markdown(test_impact_analysis_result)
-
-    # テストケース更新計画
-    print_markdown("## テストケース更新計画")
-    test_case_update_plan_result = test_case_update_plan(
-        test_impact_analysis_result=test_impact_analysis_result, code=code, scope=scope, flamework=flamework
-    )
-    print_markdown(test_case_update_plan_result)
-
-    # テストコードの生成
-    print_markdown("## テストコードの生成")
-    test_code_generation_result = test_code_generation(
-        test_case_update_plan_result=test_case_update_plan_result,
-        code=code,
-        test_code=test_code,
-        scope=scope,
-        flamework=flamework,
-    )
-    print_markdown(test_code_generation_result)
-
-    # テストコードの統合
-    print_markdown("## テストコードの統合")
-    test_code_integration_result = test_code_integration(
-        test_code_generation_result=test_code_generation_result, test_code=test_code, flamework=flamework
+    inputs = fit_prompt_inputs(
+        code=code, target_code=target_code, test_code=test_code, target_git_diff=target_git_diff
     )
-    print_markdown(test_code_integration_result)
-
-    # テストコードの品質評価
-    print_markdown("## テストコードの品質評価")
-    test_quality_assessment_result = test_quality_assessment(
-        test_code_integration_result=test_code_integration_result, code=code, test_scope=scope, test_flamework=flamework
+    code, target_code, test_code = inputs["code"], inputs["target_code"], inputs["test_code"]
+    target_git_diff = inputs["target_git_diff"]
+
+    # 実装コードの解析とGit差分の分析は互いに依存しないため同時に実行する
+    # 同時に実行するステップは、ストリーミングの表示が混ざらないように完了後にまとめて表示する
+    # 以降のステップはストリーミングで表示し、見出しを生成の前に表示する
+    results = StageRunner(
+        [
+            Stage(
+                "code_analysis_result",
+                partial(code_analysis, stream=False),
+                ["code", "target_specification"],
+                title="## 実装コードの解析",
+            ),
+            Stage(
+                "git_diff_analysis_result",
+                partial(git_diff_analysis, stream=False),
+                {"target_git_diff": "target_git_diff", "code": "code"},
+                title="## Git差分の分析",
+            ),
+            Stage(
+                "test_impact_analysis_result",
+                test_impact_analysis,
+                {
+                    "git_diff_analysis_result": "git_diff_analysis_result",
+                    "test_code": "test_code",
+                    "single_code": "target_code",
+                    "test_scope": "scope",
+                },
+                title="## テストケースへの影響分析",
+                stream=True,
+            ),
+            Stage(
+                "test_case_update_plan_result",
+                test_case_update_plan,
+                ["test_impact_analysis_result", "code", "scope", "flamework"],
+                title="## テストケース更新計画",
+                stream=True,
+            ),
+            Stage(
+                "test_code_generation_result",
+                test_code_generation,
+                ["test_case_update_plan_result", "code", "test_code", "scope", "flamework"],
+                title="## テストコードの生成",
+                stream=True,
+            ),
+            Stage(
+                "test_code_integration_result",
+                test_code_integration,
+                ["test_code_generation_result", "test_code", "flamework"],
+                title="## テストコードの統合",
+                stream=True,
+            ),
+            Stage(
+                "test_quality_assessment_result",
+                test_quality_assessment,
+                {
+                    "test_code_integration_result": "test_code_integration_result",
+                    "code": "code",
+                    "test_scope": "scope",
+                    "test_flamework": "flamework",
+                },
+                title="## テストコードの品質評価",
+                stream=True,
+            ),
+        ]
+    ).run(
+        {
+            "code": code,
+            "target_code": target_code,
+            "test_code": test_code,
+            "target_git_diff": target_git_diff,
+            "target_specification": target_specification,
+            "scope": scope,
+            "flamework": flamework,
+        }
     )
-    print_markdown(test_quality_assessment_result)
 
-    updated_test_code = extract_code_from_output(test_code_integration_result)
+    updated_test_code = extract_code_from_output(results["test_code_integration_result"])
     return updated_test_code
 
 
@@ -1455,6 +1568,7 @@ def analyze_test_failure_and_update(
         str: 更新されたテストコード
     """
 
+    @llm_stage("analyze_failure")
     def analyze_failure(test_results: str, code: str, test_code: str) -> str:
         """テスト失敗の原因を解析する関数
 
@@ -1503,7 +1617,7 @@ def analyze_test_failure_and_update(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -1511,6 +1625,7 @@ def analyze_test_failure_and_update(
         )
         return response
 
+    @llm_stage("is_test_code_fault")
     def is_test_code_fault(analyze_failure_result: str) -> bool:
         """テストコードの修正が必要かどうかを判断する関数
 
@@ -1552,7 +1667,7 @@ def analyze_test_failure_and_update(
                 ),
             ]
         )
-        response = GeminiClient().generate_pydantic(
+        response = gemini_client.generate_pydantic(
             output_type=TestCodeFault,
             messages=messages,
             llm_model=LlmModelEnum.GEMINI15FLASH_LATEST,
@@ -1560,6 +1675,7 @@ def analyze_test_failure_and_update(
         )
         return response.is_test_code_fault
 
+    @llm_stage("test_case_update_plan")
     def test_case_update_plan(
         analyze_failure_result: str, code: str, scope: TestScopeEnum, flamework: TestingFlameworkEnum
     ) -> str:
@@ -1623,7 +1739,7 @@ def analyze_test_failure_and_update(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -1631,6 +1747,7 @@ def analyze_test_failure_and_update(
         )
         return response
 
+    @llm_stage("test_code_generation")
     def test_code_generation(
         test_case_update_plan_result: str,
         code: str,
@@ -1698,7 +1815,7 @@ def analyze_test_failure_and_update(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15PRO,
             messages=messages,
             stream=True,
@@ -1706,6 +1823,7 @@ def analyze_test_failure_and_update(
         )
         return response
 
+    @llm_stage("test_code_integration")
     def test_code_integration(test_code_generation_result: str, test_code: str, flamework: TestingFlameworkEnum) -> str:
         """テストコードを統合する関数
 
@@ -1763,7 +1881,7 @@ def analyze_test_failure_and_update(
                 ),
             ]
         )
-        response = GeminiClient().generate_text(
+        response = gemini_client.generate_text(
             llm_model=LlmModelEnum.GEMINI15FLASH,
             messages=messages,
             stream=True,
@@ -1771,6 +1889,10 @@ def analyze_test_failure_and_update(
         )
         return response
 
+    inputs = fit_prompt_inputs(code=code, target_code=target_code, test_code=test_code, test_results=test_results)
+    code, target_code, test_code = inputs["code"], inputs["target_code"], inputs["test_code"]
+    test_results = inputs["test_results"]
+
     # テスト失敗の原因を解析
     print_markdown("## テスト失敗の原因を解析")
     analyze_failure_result = analyze_failure(test_results=test_results, code=code, test_code=test_code)
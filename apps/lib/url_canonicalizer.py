@@ -0,0 +1,45 @@
+import re
+from urllib.parse import urlparse, urlunparse
+
+# スキームごとのデフォルトのポート番号
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# ディレクトリのURLと同じページを返すファイル名
+INDEX_FILES = frozenset(["index.html", "index.htm", "index.php"])
+
+
+def strip_query_and_fragment(url: str) -> str:
+    """URLからクエリとフラグメントを除く"""
+    return urlunparse(urlparse(url)._replace(query="", fragment=""))
+
+
+def canonicalize_url(url: str) -> str:
+    """同じページを指すURLが同じ文字列になるように正規化する
+
+    クエリとフラグメントを除き、スキームとホストを小文字にして、デフォルトのポート番号、
+    末尾のindex.html、連続するスラッシュと末尾のスラッシュを除く。
+    """
+    parsed_url = urlparse(url)
+    scheme = parsed_url.scheme.lower()
+
+    netloc = parsed_url.netloc
+    try:
+        host = parsed_url.hostname or ""
+        port = parsed_url.port
+    except ValueError:
+        # 不正なポート番号の場合はそのままにする
+        host, port = netloc, None
+    else:
+        if ":" in host:
+            host = f"[{host}]"  # IPv6アドレス
+        netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+        userinfo = parsed_url.netloc.rpartition("@")[0]
+        if userinfo:
+            netloc = f"{userinfo}@{netloc}"
+
+    path = re.sub(r"/{2,}", "/", parsed_url.path)
+    directory, _, file_name = path.rpartition("/")
+    if file_name.lower() in INDEX_FILES:
+        path = directory
+    path = path.rstrip("/")
+    return urlunparse((scheme, netloc, path, parsed_url.params, "", ""))
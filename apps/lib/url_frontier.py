@@ -0,0 +1,49 @@
+import heapq
+from urllib.parse import unquote, urlparse
+
+
+def get_path_segments(url: str) -> list[str]:
+    """URLのパスを空でないセグメントに分割する"""
+    return [segment for segment in urlparse(url).path.split("/") if segment]
+
+
+class UrlFrontier:
+    """探索するURLを優先度順に取り出すキュー
+
+    優先度は「リンクの深さ - キーワードの一致数」が小さいほど高く、同じ場合はパスが短いURL、
+    それでも同じ場合は先に追加したURLを優先する。トークン数の上限で探索を打ち切った場合でも、
+    ルートに近く、キーワードに関連するページから収集される。
+    """
+
+    keywords: list[str]
+    heap: list[tuple[int, int, int, str, int]]
+
+    def __init__(self, keywords: list[str] | None = None):
+        """
+        Args:
+            keywords (list[str] | None): URLのパスに含まれると優先度を上げるキーワード
+        """
+        self.keywords = [keyword.lower() for keyword in keywords or [] if keyword]
+        self.heap = []
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def relevance(self, url: str) -> int:
+        """URLのパスに含まれるキーワードの数を数える"""
+        if not self.keywords:
+            return 0
+        path = unquote(urlparse(url).path).lower()
+        return sum(keyword in path for keyword in self.keywords)
+
+    def push(self, url: str, depth: int) -> None:
+        """URLをリンクの深さとともに追加する"""
+        priority = depth - self.relevance(url)
+        heapq.heappush(self.heap, (priority, len(get_path_segments(url)), self._counter, url, depth))
+        self._counter += 1
+
+    def pop(self) -> tuple[str, int]:
+        """最も優先度の高いURLとリンクの深さを取り出す"""
+        _, _, _, url, depth = heapq.heappop(self.heap)
+        return url, depth
@@ -1,9 +1,33 @@
-from dataclasses import dataclass
-from urllib.parse import urljoin, urlparse, urlunparse
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any
+from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup
 
+from apps.lib.content_hash_index import ContentHashIndex
+from apps.lib.content_scorer import ContentScorer
+from apps.lib.crawl_metrics import CrawlMetrics
+from apps.lib.content_type_sniffer import (
+    DEFAULT_ALLOWED_CONTENT_TYPES,
+    guess_content_type_from_url,
+    has_unknown_extension,
+    is_allowed_content_type,
+    parse_content_type,
+    sniff_content_type,
+)
+from apps.lib.document_extractor import DOCUMENT_CONTENT_TYPES, DocumentExtractor
+from apps.lib.embedded_json_extractor import EmbeddedJsonExtractor
+from apps.lib.file_writer_util import RecordWriterIF
+from apps.lib.html_extractor import ExtractedPage, ExtractorType, HtmlExtractorIF, get_html_extractor
+from apps.lib.path_matcher import PathMatcher, is_pattern_rule
+from apps.lib.rate_limiter import THROTTLE_STATUS_CODES, HostRateLimiter
+from apps.lib.site_discoverer import SiteDiscoverer
+from apps.lib.url_canonicalizer import canonicalize_url, strip_query_and_fragment
+from apps.lib.url_frontier import UrlFrontier
 from apps.lib.utils import count_tokens, format_content, format_number, print_colored
 
 
@@ -18,13 +42,93 @@ class ScrapedData:
     content: str
     token_size: int
     char_size: int
+    # 本文を構成する段落(ブロック)のテキスト
+    blocks: list[str] = field(default_factory=list)
+
+
+@dataclass
+class FetchedPage:
+    url: str
+    status_code: int
+    content_type: str | None
+    content: bytes
+    # ドキュメント(PDF)の場合は、本文を書き込んだ一時ファイルのパス
+    file_path: str | None = None
+    # ダウンロードしたバイト数
+    content_bytes: int = 0
+    fetched_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class ParsedPage:
+    page: ExtractedPage
+    # 全てのブロックを結合した本文のトークン数
+    token_size: int
+    # 抽出とトークン数の計算にかかった秒数
+    parse_seconds: float = 0.0
+    tokenize_seconds: float = 0.0
+
+
+def extract_page(
+    extractor: HtmlExtractorIF, content: bytes, embedded_json_extractor: EmbeddedJsonExtractor | None = None
+) -> ExtractedPage:
+    """HTMLから本文テキストとリンクを1回の走査で抽出する
+
+    embedded_json_extractorを指定した場合、本文がほとんど無いページは埋め込まれたJSONから本文を復元する。
+    """
+    page = extractor.extract(content)
+    if embedded_json_extractor is not None:
+        page = embedded_json_extractor.recover(page, content)
+    return page
+
+
+def parse_page(
+    extractor: HtmlExtractorIF, content: bytes, embedded_json_extractor: EmbeddedJsonExtractor | None = None
+) -> ParsedPage:
+    """HTMLから本文とリンクを抽出し、本文のトークン数を計算する
+
+    CPUを使う処理のため、プロセスプールで実行できるようにトップレベルの関数として定義する。
+    """
+    started_at = time.perf_counter()
+    page = extract_page(extractor, content, embedded_json_extractor)
+    parsed_at = time.perf_counter()
+    text = " ".join(block.text for block in page.blocks).replace("\0", "")
+    token_size = count_tokens(text)
+    return ParsedPage(
+        page=page,
+        token_size=token_size,
+        parse_seconds=parsed_at - started_at,
+        tokenize_seconds=time.perf_counter() - parsed_at,
+    )
 
 
 class WebCrawlerScraper:
     root_urls: list[str]
     ignore_urls: set[str]
+    scope_matcher: PathMatcher
+    ignore_matcher: PathMatcher
     limit_token: int
     limit_char: int
+    extractor: HtmlExtractorIF
+    content_scorer: ContentScorer | None
+    embedded_json_extractor: EmbeddedJsonExtractor | None
+    use_sitemap: bool
+    respect_robots: bool
+    site_discoverer: SiteDiscoverer
+    rate_limiter: HostRateLimiter
+    max_retries: int
+    allowed_content_types: list[str]
+    max_content_bytes: int
+    use_head: bool
+    document_extractor: DocumentExtractor | None
+    document_pages: dict[str, FetchedPage]
+    record_writer: RecordWriterIF | None
+    frontier: UrlFrontier
+    request_urls: dict[str, str]
+    content_hash_index: ContentHashIndex
+    fetch_workers: int
+    parse_workers: int
+    metrics: CrawlMetrics
     scraped_data: list[ScrapedData] = []
     found_urls: set[str] = set()
     visited_urls: set[str] = set()
@@ -38,9 +142,27 @@ class WebCrawlerScraper:
         scraped_data: list[ScrapedData] | None = None,
         found_urls: set[str] | None = None,
         visited_urls: set[str] | None = None,
+        extractor: ExtractorType | HtmlExtractorIF = "lxml",
+        readability: bool = False,
+        embedded_json: bool = False,
+        use_sitemap: bool = False,
+        respect_robots: bool = False,
+        rate_limit: float = 10.0,
+        max_retries: int = 3,
+        allowed_content_types: list[str] | None = None,
+        max_content_bytes: int = 10 * 1024 * 1024,
+        use_head: bool = True,
+        extract_documents: bool = False,
+        document_workers: int | None = None,
+        record_writer: RecordWriterIF | None = None,
+        keywords: list[str] | None = None,
+        fetch_workers: int = 1,
+        parse_workers: int = 0,
     ):
         if isinstance(root_urls, str):
             root_urls = [root_urls]
+        # 正規化したURLと、そのURLを取得する時にリクエストするURL(最初に見つけた形式)
+        self.request_urls = {self.normalize_url(url): strip_query_and_fragment(url) for url in reversed(root_urls)}
         # root_urlsを正規化する
         root_urls = [self.normalize_url(url) for url in root_urls]
         self.root_urls = root_urls
@@ -48,9 +170,14 @@ class WebCrawlerScraper:
         if ignore_urls is None:
             self.ignore_urls = set()
         else:
-            normalized_ignore_urls = [self.normalize_url(url) for url in ignore_urls]
+            # globや正規表現のルールは正規化しない
+            normalized_ignore_urls = [url if is_pattern_rule(url) else self.normalize_url(url) for url in ignore_urls]
             self.ignore_urls = set(normalized_ignore_urls)
 
+        # ルートURLと無視するURLの判定を、ルールの数によらないマッチャーにまとめる
+        self.scope_matcher = PathMatcher(prefixes=[f"{root_url}/" for root_url in self.root_urls])
+        self.ignore_matcher = PathMatcher.from_rules(list(self.ignore_urls), literal="substring")
+
         if limit_token is None:
             limit_token = 999_999_999_999
         self.limit_token = limit_token
@@ -66,28 +193,103 @@ class WebCrawlerScraper:
         if visited_urls is not None:
             self.visited_urls = visited_urls
 
+        # HTMLの抽出バックエンドを設定する
+        if isinstance(extractor, HtmlExtractorIF):
+            self.extractor = extractor
+        else:
+            self.extractor = get_html_extractor(extractor)
+
+        # 本文抽出のスコアリングを設定する
+        self.content_scorer = ContentScorer() if readability else None
+
+        # クライアントサイドで描画されるページの本文を、埋め込まれたJSONから復元する
+        self.embedded_json_extractor = EmbeddedJsonExtractor() if embedded_json else None
+
+        # sitemap.xmlからのURL発見と、robots.txtのルールを設定する
+        self.use_sitemap = use_sitemap
+        self.respect_robots = respect_robots
+
+        # ホストごとのリクエストのレートを制限する
+        self.rate_limiter = HostRateLimiter(rate=rate_limit)
+        self.max_retries = max_retries
+
+        # 取得するコンテンツのMIMEタイプと最大サイズを設定する
+        if allowed_content_types is None:
+            allowed_content_types = DEFAULT_ALLOWED_CONTENT_TYPES
+        self.allowed_content_types = list(allowed_content_types)
+        self.max_content_bytes = max_content_bytes
+        self.use_head = use_head
+
+        # robots.txtとサイトマップも、ページと同じレート制限と最大サイズで取得する
+        self.site_discoverer = SiteDiscoverer(rate_limiter=self.rate_limiter, max_content_bytes=max_content_bytes)
+
+        # PDFなどのドキュメントのテキストを、クロールとは別のワーカープロセスで抽出する
+        self.document_extractor = None
+        self.document_pages = {}
+        if extract_documents:
+            self.document_extractor = DocumentExtractor(max_workers=document_workers)
+            for content_type in DOCUMENT_CONTENT_TYPES:
+                if not is_allowed_content_type(content_type, self.allowed_content_types):
+                    self.allowed_content_types.append(content_type)
+
+        # スクレイプしたページを1件ずつファイルに書き出す
+        self.record_writer = record_writer
+
+        # 探索するURLを、リンクの深さ・パスの長さ・キーワードとの関連度の優先度順に取り出す
+        self.frontier = UrlFrontier(keywords=keywords)
+
+        # 同じ内容のページを、取得した直後に本文のハッシュ値で検出する
+        self.content_hash_index = ContentHashIndex()
+
+        # 取得するスレッド数と、HTMLの解析とトークン数の計算を行うプロセス数(0の場合はメインプロセスで行う)
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+
+        # スループットや処理時間などのメトリクスを集計する
+        self.metrics = CrawlMetrics()
+
     def normalize_url(self, url: str) -> str:
         """URLを正規化する"""
-        parsed_url = urlparse(url)
-        return urlunparse(parsed_url._replace(query="", fragment=""))
+        return canonicalize_url(url)
 
     def is_subpath(self, url: str) -> bool:
-        """URLがルートURLのサブパスかどうかを判定する"""
-        return any(url.startswith(root_url) for root_url in self.root_urls)
+        """URLがルートURLのサブパスかどうかを判定する"""
+        # 末尾に/を付けて判定し、ルートURL自身とパスの区切りで続くURLだけを一致させる
+        return self.scope_matcher.matches(f"{url}/")
 
     def should_ignore(self, url: str) -> bool:
         """URLを無視するかどうかを判定する"""
-        return any(ignore_url in url for ignore_url in self.ignore_urls)
+        return self.ignore_matcher.matches(url)
 
-    def explore_and_scrape(self, url: str) -> None:
-        """URLを探索し、スクレイプする"""
+    def explore_and_scrape(self, url: str, depth: int = 0) -> None:
+        """URLを探索し、スクレイプする
+
+        Args:
+            url (str): 探索するURL
+            depth (int): ルートURLからのリンクの深さ
+        """
+        normalized_url = self.start_exploring(url)
+        if normalized_url is None:
+            return
+
+        fetched_page = self.try_fetch_page(normalized_url)
+        if fetched_page is None or self.submit_document(normalized_url, fetched_page):
+            return
+
+        started_at = time.perf_counter()
+        page = extract_page(self.extractor, fetched_page.content, self.embedded_json_extractor)
+        self.metrics.record_parse(time.perf_counter() - started_at)
+        self.process_page(normalized_url, depth, fetched_page, page)
+
+    def start_exploring(self, url: str) -> str | None:
+        """URLを探索済みにして、正規化したURLを返す。探索しないURLの場合はNoneを返す"""
         normalized_url = self.normalize_url(url)
         if (
             normalized_url in self.visited_urls
             or not self.is_subpath(normalized_url)
             or self.should_ignore(normalized_url)
         ):
-            return
+            return None
 
         self.visited_urls.add(normalized_url)
         print_colored(
@@ -97,43 +299,268 @@ class WebCrawlerScraper:
             (normalized_url, "grey"),
         )
 
-        if normalized_url.endswith(".pdf") or normalized_url.endswith(".jpg") or normalized_url.endswith(".jpeg"):
+        if not self.is_allowed_url(normalized_url):
             print_colored(("Skipping :", "red"), " ", (normalized_url, "grey"))
-            return  # PDFや画像ファイルのURLはスキップ
+            return None  # PDFや画像ファイルなど、許可されていないMIMEタイプのURLはスキップ
 
+        if self.respect_robots and not self.site_discoverer.can_fetch(normalized_url):
+            print_colored(("Skipping :", "red"), " ", (normalized_url, "grey"), (" (disallowed by robots.txt)", "grey"))
+            return None
+        return normalized_url
+
+    def try_fetch_page(self, url: str) -> FetchedPage | None:
+        """URLのコンテンツを取得する。リクエストのエラーの場合はNoneを返す"""
         try:
-            response = requests.get(normalized_url, stream=True)
-            if response.status_code == 200:
-                soup: BeautifulSoup = BeautifulSoup(response.content, "html.parser")
-                self.scrape_content(soup, normalized_url)
-            else:
-                print_colored((f"Error: {normalized_url} returned status code {response.status_code}", "red"))
-                return
+            return self.fetch_page(self.request_urls.get(url, url))
         except requests.exceptions.RequestException as e:
-            print_colored((f"Error exploring {normalized_url}: {e}", "red"))
+            print_colored((f"Error exploring {url}: {e}", "red"))
+            self.metrics.record_error()
+            return None
+
+    def submit_document(self, url: str, fetched_page: FetchedPage) -> bool:
+        """ドキュメントの場合はテキストの抽出をワーカープロセスに投入し、Trueを返す
+
+        完了したものからcollect_documentsでスクレイプデータに追加する。
+        """
+        if fetched_page.file_path is None or self.document_extractor is None:
+            return False
+        self.document_extractor.submit(url, fetched_page.file_path)
+        self.document_pages[url] = fetched_page
+        return True
+
+    def process_page(
+        self, url: str, depth: int, fetched_page: FetchedPage, page: ExtractedPage, token_size: int | None = None
+    ) -> None:
+        """抽出した本文をスクレイプデータに追加し、リンクを探索候補に追加する
+
+        Args:
+            token_size (int | None): 全てのブロックを結合した本文のトークン数。計算済みの場合に指定する
+        """
+        duplicate_url = self.find_duplicate(url, fetched_page, page)
+        if duplicate_url is not None:
+            print_colored(("  - Duplicate of: ", "grey"), (duplicate_url, "grey"))
             return
 
-        # HTMLリンク探索
-        for link in soup.find_all("a", href=True):
-            href = link["href"]
-            full_url = self.normalize_url(urljoin(normalized_url, href))
-            if not (full_url.endswith(".pdf") or full_url.endswith(".jpg") or full_url.endswith(".jpeg")):
-                if full_url not in self.found_urls and self.is_subpath(full_url) and not self.should_ignore(full_url):
-                    self.found_urls.add(full_url)
-                    print_colored(("  + Found: ", "cyan"), (full_url, "grey"))
-
-    def scrape_content(self, soup: BeautifulSoup, url: str) -> None:
-        """スクレイプしてテキストを取得する"""
-        # 本文以外の要素を削除する
-        for selector in ["header", "footer", "nav", "aside"]:
-            for element in soup.select(selector):
-                element.decompose()
-
-        # 本文を取得する
-        text = soup.get_text(separator=" ", strip=True)
+        blocks = page.blocks
+        if self.content_scorer is not None:
+            blocks = self.content_scorer.select_blocks(url, blocks)
+            # ブロックが除かれた場合は、トークン数を計算し直す
+            if len(blocks) != len(page.blocks):
+                token_size = None
+        block_texts = [block.text for block in blocks]
+        self.scrape_content(
+            " ".join(block_texts), url, blocks=block_texts, fetched_page=fetched_page, token_size=token_size
+        )
+
+        # HTMLリンク探索。相対リンクはリダイレクト後の実際のURLを基準に解決する
+        for href in page.links:
+            full_url = self.add_found_url(urljoin(fetched_page.url, href), depth + 1)
+            if full_url is not None:
+                print_colored(("  + Found: ", "cyan"), (full_url, "grey"))
+
+    def add_found_url(self, url: str, depth: int) -> str | None:
+        """URLを正規化して探索候補に追加し、正規化したURLを返す。追加しない場合はNoneを返す"""
+        normalized_url = self.normalize_url(url)
+        if (
+            normalized_url in self.found_urls
+            or not self.is_allowed_url(normalized_url)
+            or not self.is_subpath(normalized_url)
+            or self.should_ignore(normalized_url)
+        ):
+            return None
+        self.found_urls.add(normalized_url)
+        self.request_urls.setdefault(normalized_url, strip_query_and_fragment(url))
+        self.frontier.push(normalized_url, depth)
+        return normalized_url
+
+    def find_duplicate(self, url: str, fetched_page: FetchedPage, page: ExtractedPage) -> str | None:
+        """取得したページが取得済みのページと重複している場合は、そのURLを返す
+
+        リダイレクト先と<link rel="canonical">のURLを探索済みにして、同じページを後から取得しないようにする。
+        それらのURLが既に探索済みの場合や、本文のハッシュ値が取得済みのページと同じ場合は重複とする。
+        """
+        for alias in (fetched_page.url, page.canonical_url):
+            if not alias:
+                continue
+            alias_url = self.normalize_url(urljoin(fetched_page.url, alias))
+            if alias_url == url or not self.is_subpath(alias_url):
+                continue
+            if alias_url in self.visited_urls:
+                return alias_url
+            self.visited_urls.add(alias_url)
+            self.found_urls.add(alias_url)
+        return self.content_hash_index.find_duplicate(url, page.text)
+
+    def is_allowed_url(self, url: str) -> bool:
+        """URLの拡張子から推定したMIMEタイプが許可されているかを判定する。推定できない場合は許可する"""
+        guessed_content_type = guess_content_type_from_url(url)
+        return guessed_content_type is None or is_allowed_content_type(
+            guessed_content_type, self.allowed_content_types
+        )
+
+    def fetch_page(self, url: str) -> FetchedPage | None:
+        """URLのコンテンツを取得する
+
+        拡張子から判定できないURLはHEADリクエストでContent-Typeを確認し、GETではヘッダーと本文の先頭で
+        MIMEタイプを判定する。本文はストリーミングで読み込み、max_content_bytesを超えた時点で中断する。
+        取得しない場合はNoneを返す。
+        """
+        if self.use_head and has_unknown_extension(url):
+            with self.fetch(url, method="HEAD") as head_response:
+                # エラーのレスポンスのContent-Typeは本文のものとは限らないため、成功した場合だけ判定する
+                head_content_type = (
+                    parse_content_type(head_response.headers.get("Content-Type")) if head_response.ok else None
+                )
+            if head_content_type is not None and not is_allowed_content_type(
+                head_content_type, self.allowed_content_types
+            ):
+                print_colored(("Skipping :", "red"), " ", (url, "grey"), (f" ({head_content_type})", "grey"))
+                return None
+
+        response = self.fetch(url)
+        with response:
+            if response.status_code != 200:
+                print_colored((f"Error: {url} returned status code {response.status_code}", "red"))
+                return None
+
+            content_type = parse_content_type(response.headers.get("Content-Type"))
+            if content_type is not None and not is_allowed_content_type(content_type, self.allowed_content_types):
+                print_colored(("Skipping :", "red"), " ", (url, "grey"), (f" ({content_type})", "grey"))
+                return None
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > self.max_content_bytes:
+                print_colored(("Skipping :", "red"), " ", (url, "grey"), (f" ({content_length} bytes)", "grey"))
+                return None
+
+            chunks: list[bytes] = []
+            total_bytes = 0
+            # ドキュメントはメモリに載せず、一時ファイルに書き込む
+            document_file = None
+            try:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if total_bytes == 0:
+                        if content_type is None:
+                            # Content-Typeが無い場合は本文の先頭から推定する
+                            content_type = sniff_content_type(chunk)
+                            if content_type is not None and not is_allowed_content_type(
+                                content_type, self.allowed_content_types
+                            ):
+                                print_colored(
+                                    ("Skipping :", "red"), " ", (url, "grey"), (f" ({content_type})", "grey")
+                                )
+                                return None
+                        if self.document_extractor is not None and self.document_extractor.is_document(content_type):
+                            document_file = tempfile.NamedTemporaryFile(
+                                suffix=DOCUMENT_CONTENT_TYPES[content_type or ""], delete=False
+                            )
+                    if document_file is not None:
+                        document_file.write(chunk)
+                    else:
+                        chunks.append(chunk)
+                    total_bytes += len(chunk)
+                    if total_bytes > self.max_content_bytes:
+                        print_colored(
+                            ("Skipping :", "red"),
+                            " ",
+                            (url, "grey"),
+                            (f" (over {self.max_content_bytes} bytes)", "grey"),
+                        )
+                        if document_file is not None:
+                            document_file.close()
+                            DocumentExtractor.remove_file(document_file.name)
+                        return None
+            except BaseException:
+                if document_file is not None:
+                    document_file.close()
+                    DocumentExtractor.remove_file(document_file.name)
+                raise
+
+        if document_file is not None:
+            document_file.close()
+        self.metrics.record_page(total_bytes)
+        return FetchedPage(
+            url=response.url,
+            status_code=response.status_code,
+            content_type=content_type,
+            content=b"".join(chunks),
+            file_path=document_file.name if document_file is not None else None,
+            content_bytes=total_bytes,
+        )
+
+    def fetch(self, url: str, method: str = "GET") -> requests.Response:
+        """ホストごとのレート制限に従ってURLを取得する。429/503の場合はバックオフしてリトライする
+
+        Args:
+            method (str): "GET"の場合は本文をストリーミングで取得し、"HEAD"の場合はヘッダーだけを取得する
+        """
+        # robots.txtのCrawl-delayをホストの最大レートに反映する
+        if self.respect_robots:
+            crawl_delay = self.site_discoverer.crawl_delay(url)
+            if crawl_delay:
+                self.rate_limiter.set_max_rate(url, 1 / crawl_delay)
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(url)
+            started_at = time.perf_counter()
+            if method == "HEAD":
+                response = requests.head(url, allow_redirects=True, timeout=30)
+            else:
+                response = requests.get(url, stream=True)
+            self.metrics.record_response(url, response.status_code, time.perf_counter() - started_at)
+            self.rate_limiter.on_response(url, response.status_code, response.headers.get("Retry-After"))
+            if response.status_code not in THROTTLE_STATUS_CODES or attempt == self.max_retries:
+                break
+            print_colored(
+                (f"Retry: {url} returned status code {response.status_code}", "yellow"),
+                f" ({attempt + 1}/{self.max_retries})",
+            )
+            response.close()
+        return response
+
+    def discover_from_sitemaps(self) -> None:
+        """sitemap.xmlから発見したURLを探索候補に追加する
+
+        サイトマップのURLはルートURLから直接リンクされているものとして、深さ1で追加する。
+        """
+        for root_url in self.root_urls:
+            for url in self.site_discoverer.discover_urls(root_url):
+                self.add_found_url(url, 1)
+        print_colored(("Discovered from sitemaps: ", "green"), f"{len(self.found_urls)} urls")
+
+    def collect_documents(self, wait: bool = False) -> None:
+        """テキストの抽出が完了したドキュメントをスクレイプデータとして追加する"""
+        if self.document_extractor is None:
+            return
+        for document in self.document_extractor.collect(wait=wait):
+            if not document.pages:
+                continue
+            self.scrape_content(
+                " ".join(document.pages),
+                document.url,
+                blocks=document.pages,
+                fetched_page=self.document_pages.pop(document.url, None),
+            )
+
+    def scrape_content(
+        self,
+        text: str,
+        url: str,
+        blocks: list[str] | None = None,
+        fetched_page: FetchedPage | None = None,
+        token_size: int | None = None,
+    ) -> None:
+        """抽出したテキストをスクレイプデータとして追加する
+
+        record_writerが設定されている場合は、ページをレコードとしてすぐに書き出し、
+        スクレイプデータには本文を保持せずにURLとサイズだけを残す。
+        """
         text = text.replace("\0", "")  # null文字を削除する
 
-        token_size = count_tokens(text)
+        if token_size is None:
+            started_at = time.perf_counter()
+            token_size = count_tokens(text)
+            self.metrics.record_tokenize(time.perf_counter() - started_at)
         char_size = len(text)
 
         if token_size + self.total_token_size() > self.limit_token:
@@ -145,24 +572,128 @@ class WebCrawlerScraper:
             raise LimitException("文字数が上限を超えました。")
 
         # スクレイプデータを追加する
-        scraped_data: ScrapedData = ScrapedData(url=url, content=text, token_size=token_size, char_size=char_size)
+        scraped_data: ScrapedData = ScrapedData(
+            url=url,
+            content=text,
+            token_size=token_size,
+            char_size=char_size,
+            blocks=[block.replace("\0", "") for block in blocks or []],
+        )
+        if self.record_writer is not None:
+            self.record_writer.write_record(self.make_record(scraped_data, fetched_page))
+            scraped_data = ScrapedData(url=url, content="", token_size=token_size, char_size=char_size)
         self.scraped_data.append(scraped_data)
 
+    @staticmethod
+    def make_record(scraped_data: ScrapedData, fetched_page: FetchedPage | None) -> dict[str, str | int]:
+        """スクレイプデータと取得時の情報から、書き出すレコードを作成する"""
+        if fetched_page is None:
+            fetched_page = FetchedPage(url=scraped_data.url, status_code=0, content_type=None, content=b"")
+        return {
+            "url": scraped_data.url,
+            "content": scraped_data.content,
+            "token_size": scraped_data.token_size,
+            "char_size": scraped_data.char_size,
+            "final_url": fetched_page.url,
+            "status_code": fetched_page.status_code,
+            "content_type": fetched_page.content_type or "",
+            "content_bytes": fetched_page.content_bytes,
+            "fetched_at": datetime.fromtimestamp(fetched_page.fetched_at, tz=timezone.utc).isoformat(),
+        }
+
     def run(self) -> None:
         """URLを探索し、スクレイプする"""
         self.found_urls = set(self.root_urls)
+        self.frontier = UrlFrontier(keywords=self.frontier.keywords)
+        for root_url in self.root_urls:
+            self.frontier.push(root_url, 0)
+        if self.use_sitemap:
+            self.discover_from_sitemaps()
 
-        while self.found_urls - self.visited_urls:
-            url = (self.found_urls - self.visited_urls).pop()
-            try:
-                self.explore_and_scrape(url)
-            except LimitException:
-                print_colored(("クローリングを終了します。", "red"))
-                break
+        self.metrics.reset()
+        try:
+            if self.fetch_workers > 1 or self.parse_workers > 0:
+                self.run_pipeline()
+            else:
+                while self.frontier:
+                    url, depth = self.frontier.pop()
+                    self.explore_and_scrape(url, depth)
+                    self.collect_documents()
+                    self.metrics.record_queue(len(self.frontier))
+                    self.metrics.print_live_summary()
+            # 抽出中のドキュメントの完了を待つ
+            self.collect_documents(wait=True)
+        except LimitException:
+            print_colored(("クローリングを終了します。", "red"))
+        finally:
+            if self.document_extractor is not None:
+                self.document_extractor.shutdown()
         print_colored(("Finished: ", "green"), f"{len(self.visited_urls)} / {len(self.found_urls)}")
+        self.metrics.print_summary()
         print_colored("  total token size: ", format_number(self.total_token_size()))
         print_colored("  total char size: ", format_number(self.total_char_size()))
 
+    def run_pipeline(self) -> None:
+        """取得と解析を分けたパイプラインでURLを探索し、スクレイプする
+
+        取得はスレッドプールで、HTMLの解析とトークン数の計算はプロセスプールで並列に行う。
+        処理中のページ数を制限して取得が解析を追い越さないようにし(バックプレッシャー)、
+        解析が完了したページからスクレイプデータとリンクをメインプロセスに戻す。
+        スコアリングや上限の判定など、ページをまたぐ状態はメインプロセスだけで扱う。
+        """
+        fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers) if self.parse_workers > 0 else None
+        max_in_flight = self.fetch_workers + max(self.parse_workers, 1) * 2
+        # 取得中と解析中のFutureをまとめて待つため、結果の型を区別しない
+        fetching: dict[Future[Any], tuple[str, int]] = {}
+        parsing: dict[Future[Any], tuple[str, int, FetchedPage]] = {}
+        try:
+            while self.frontier or fetching or parsing:
+                while self.frontier and len(fetching) + len(parsing) < max_in_flight:
+                    url, depth = self.frontier.pop()
+                    normalized_url = self.start_exploring(url)
+                    if normalized_url is not None:
+                        future = fetch_executor.submit(self.try_fetch_page, normalized_url)
+                        fetching[future] = (normalized_url, depth)
+                if not fetching and not parsing:
+                    continue
+
+                done, _ = wait([*fetching, *parsing], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        url, depth = fetching.pop(future)
+                        fetched_page = future.result()
+                        if fetched_page is None or self.submit_document(url, fetched_page):
+                            continue
+                        if parse_executor is None:
+                            parsed_page = parse_page(
+                                self.extractor, fetched_page.content, self.embedded_json_extractor
+                            )
+                            self.record_parsed_page(parsed_page)
+                            self.process_page(url, depth, fetched_page, parsed_page.page, parsed_page.token_size)
+                        else:
+                            parse_future = parse_executor.submit(
+                                parse_page, self.extractor, fetched_page.content, self.embedded_json_extractor
+                            )
+                            parsing[parse_future] = (url, depth, fetched_page)
+                    else:
+                        url, depth, fetched_page = parsing.pop(future)
+                        parsed_page = future.result()
+                        self.record_parsed_page(parsed_page)
+                        self.process_page(url, depth, fetched_page, parsed_page.page, parsed_page.token_size)
+                self.collect_documents()
+                self.metrics.record_queue(len(self.frontier), len(fetching) + len(parsing))
+                self.metrics.print_live_summary()
+        finally:
+            fetch_executor.shutdown(wait=True, cancel_futures=True)
+            if parse_executor is not None:
+                parse_executor.shutdown(wait=True, cancel_futures=True)
+
+    def record_parsed_page(self, parsed_page: ParsedPage) -> None:
+        """解析したページの抽出とトークン数の計算にかかった時間を記録する"""
+        self.metrics.record_parse(parsed_page.parse_seconds)
+        self.metrics.record_tokenize(parsed_page.tokenize_seconds)
+
     def sort_scraped_data(self):
         """スクレイプデータをURLのアルファベット順にソートする"""
         return dict(sorted({data.url: data.content for data in self.scraped_data}.items()))
@@ -4,7 +4,7 @@ import argparse
 import os
 import sys
 from dataclasses import dataclass
-from typing import Literal
+from typing import Literal, cast
 
 # 現在のファイルの絶対パスを取得
 current_file_path = os.path.abspath(__file__)
@@ -17,8 +17,10 @@ if root_directory not in sys.path:
     sys.path.append(root_directory)
 
 from lib.clipboard_util import copy_chunks_to_clipboard  # noqa: E402
+from lib.content_deduplicator import ContentDeduplicator  # noqa: E402
 from lib.content_size_optimizer import ContentSizeOptimizer  # noqa: E402
-from lib.file_writer_util import FileWriter  # noqa: E402
+from lib.file_writer_util import FileWriter, RecordFormat, RecordWriterIF, get_record_writer, record_formats  # noqa: E402
+from lib.html_extractor import ExtractorType, extractor_types  # noqa: E402
 from lib.path_tree import PathTree  # noqa: E402
 from lib.terminal_printer_util import print_result  # noqa: E402
 from lib.utils import format_number, print_colored  # noqa: E402
@@ -28,23 +30,43 @@ default_root_urls: list[str] = [""]
 default_ignore_urls: list[str] = []
 default_file_dir: str = "~/Desktop"
 default_file_name: str = "page-content"
-default_output_type: Literal["copy", "file"] = "copy"
+OutputType = Literal["copy", "file"] | RecordFormat
+default_output_type: OutputType = "copy"
 default_limit_token: int = 100_000
 default_limit_char: int = 999_999_999
 default_max_token: int = 100_000
 default_max_char: int = 999_999_999
+default_extractor: ExtractorType = "lxml"
+default_rate_limit: float = 10.0
+default_max_content_bytes: int = 10 * 1024 * 1024
+default_fetch_workers: int = 1
+default_parse_workers: int = 0
 
 
 @dataclass
 class ScrapeWebArgs:
     root_urls: list[str] | None
     ignore_urls: list[str] | None
-    output_type: Literal["copy", "file"] | None
+    output_type: OutputType | None
     limit_token: int | None
     limit_char: int | None
     max_char: int | None
     max_token: int | None
     file_name: str | None
+    extractor: ExtractorType
+    readability: bool
+    embedded_json: bool
+    dedup: bool
+    sitemap: bool
+    robots: bool
+    rate_limit: float
+    allowed_content_types: list[str] | None
+    max_content_bytes: int
+    pdf: bool
+    keywords: list[str] | None
+    fetch_workers: int
+    parse_workers: int
+    metrics_report: str | None
 
 
 def main(
@@ -52,6 +74,21 @@ def main(
     ignore_urls: list[str] | None = None,
     limit_token: int | None = None,
     limit_char: int | None = None,
+    extractor: ExtractorType = default_extractor,
+    readability: bool = False,
+    embedded_json: bool = False,
+    dedup: bool = False,
+    sitemap: bool = False,
+    robots: bool = False,
+    rate_limit: float = default_rate_limit,
+    allowed_content_types: list[str] | None = None,
+    max_content_bytes: int = default_max_content_bytes,
+    pdf: bool = False,
+    record_writer: RecordWriterIF | None = None,
+    keywords: list[str] | None = None,
+    fetch_workers: int = default_fetch_workers,
+    parse_workers: int = default_parse_workers,
+    metrics_report: str | None = None,
 ) -> list[str]:
     """指定したURLからサイトマップを作成します。"""
     if ignore_urls is None:
@@ -63,14 +100,42 @@ def main(
 
     # Webクローラーを初期化する
     web_crawler_scraper = WebCrawlerScraper(
-        root_urls=root_urls, ignore_urls=ignore_urls, limit_token=limit_token, limit_char=limit_char
+        root_urls=root_urls,
+        ignore_urls=ignore_urls,
+        limit_token=limit_token,
+        limit_char=limit_char,
+        extractor=extractor,
+        readability=readability,
+        embedded_json=embedded_json,
+        use_sitemap=sitemap,
+        respect_robots=robots,
+        rate_limit=rate_limit,
+        allowed_content_types=allowed_content_types,
+        max_content_bytes=max_content_bytes,
+        extract_documents=pdf,
+        record_writer=record_writer,
+        keywords=keywords,
+        fetch_workers=fetch_workers,
+        parse_workers=parse_workers,
     )
 
     # Webクローラーを実行して、スクレイピングする
     web_crawler_scraper.run()
 
+    # スループットやホストごとのレイテンシなどのメトリクスをJSONで書き出す
+    if metrics_report:
+        web_crawler_scraper.metrics.write_report(os.path.expanduser(metrics_report))
+
+    # 複数ページに繰り返し出現する段落と、ほぼ重複したページを除去する
+    # ストリーミング出力の場合は本文を保持しないため、重複除去は行わない
+    if dedup and record_writer is not None:
+        print_colored(("--dedup is ignored when streaming records to a file.", "yellow"))
+    elif dedup:
+        web_crawler_scraper.scraped_data = ContentDeduplicator().deduplicate(web_crawler_scraper.scraped_data)
+
     web_crawler_scraper.sort_scraped_data()
-    contents = web_crawler_scraper.get_contents()
+    # ストリーミング出力の場合、本文は書き出し済みのためURLのツリーだけを返す
+    contents = web_crawler_scraper.get_contents() if record_writer is None else []
 
     # 探索したurlをツリー形式で表示に変換する
     urls = web_crawler_scraper.get_urls()
@@ -104,7 +169,8 @@ def run_from_cli():
         "-o",
         "--output_type",
         type=str,
-        choices=["copy", "file"],
+        choices=["copy", "file", *record_formats],
+        help="'jsonl' and 'parquet' stream each page as a record (url, content, sizes and fetch metadata) while crawling",
     )
     parser.add_argument(
         "-lt", "--limit_token", type=int, default=999_999_999, help="Limit the number of tokens when scraping"
@@ -119,6 +185,99 @@ def run_from_cli():
         "-mc", "--max_char", type=int, help="Split by a specified number of characters when copying to the clipboard"
     )
     parser.add_argument("-f", "--file_name", metavar="output_file_name", type=str)
+    parser.add_argument(
+        "-e",
+        "--extractor",
+        type=str,
+        choices=extractor_types,
+        default=default_extractor,
+        help="HTML extraction backend. 'lxml' is a fast C-based parser, 'bs4' uses BeautifulSoup's html.parser",
+    )
+    parser.add_argument(
+        "-r",
+        "--readability",
+        action="store_true",
+        help="Keep only the main content by scoring text density, link density and blocks repeated across pages",
+    )
+    parser.add_argument(
+        "-j",
+        "--embedded_json",
+        action="store_true",
+        help="Recover the text of client-rendered pages from __NEXT_DATA__, JSON-LD and hydration payloads",
+    )
+    parser.add_argument(
+        "-d",
+        "--dedup",
+        action="store_true",
+        help="Remove paragraphs repeated across many pages and near-duplicate pages before output",
+    )
+    parser.add_argument(
+        "-s",
+        "--sitemap",
+        action="store_true",
+        help="Seed the crawl with urls from sitemap.xml (listed in robots.txt or at /sitemap.xml)",
+    )
+    parser.add_argument(
+        "--robots",
+        action="store_true",
+        help="Honour robots.txt Disallow and Crawl-delay rules",
+    )
+    parser.add_argument(
+        "-rl",
+        "--rate_limit",
+        type=float,
+        default=default_rate_limit,
+        help="Maximum requests per second per host. Backs off automatically on 429/503 and Retry-After",
+    )
+    parser.add_argument(
+        "-ct",
+        "--allowed_content_types",
+        metavar="mime_type",
+        type=str,
+        nargs="*",
+        help="MIME types to download, e.g. 'text/html' or 'text/*'. Defaults to text/html and application/xhtml+xml",
+    )
+    parser.add_argument(
+        "-mb",
+        "--max_content_bytes",
+        type=int,
+        default=default_max_content_bytes,
+        help="Abort downloads larger than this number of bytes",
+    )
+    parser.add_argument(
+        "--pdf",
+        action="store_true",
+        help="Also download PDFs and extract their text page by page in background worker processes",
+    )
+    parser.add_argument(
+        "-k",
+        "--keywords",
+        metavar="keyword",
+        type=str,
+        nargs="*",
+        help="Crawl urls whose path contains these keywords first. Otherwise shallower and shorter urls go first",
+    )
+    parser.add_argument(
+        "-fw",
+        "--fetch_workers",
+        type=int,
+        default=default_fetch_workers,
+        help="Number of threads downloading pages concurrently",
+    )
+    parser.add_argument(
+        "-pw",
+        "--parse_workers",
+        type=int,
+        default=default_parse_workers,
+        help="Number of processes parsing HTML and counting tokens. 0 parses in the main process",
+    )
+    parser.add_argument(
+        "-mr",
+        "--metrics_report",
+        metavar="report_path",
+        type=str,
+        help="Write crawl metrics (throughput, per-host latency histograms, parse/tokenize time) as JSON",
+    )
     args = parser.parse_args()
     scrape_web_args = ScrapeWebArgs(
         root_urls=args.root_urls,
@@ -129,6 +288,20 @@ def run_from_cli():
         max_char=args.max_char,
         max_token=args.max_token,
         file_name=args.file_name,
+        extractor=args.extractor,
+        readability=args.readability,
+        embedded_json=args.embedded_json,
+        dedup=args.dedup,
+        sitemap=args.sitemap,
+        robots=args.robots,
+        rate_limit=args.rate_limit,
+        allowed_content_types=args.allowed_content_types,
+        max_content_bytes=args.max_content_bytes,
+        pdf=args.pdf,
+        keywords=args.keywords,
+        fetch_workers=args.fetch_workers,
+        parse_workers=args.parse_workers,
+        metrics_report=args.metrics_report,
     )
 
     # 不足している引数がある場合は、input()で入力を求める
@@ -147,11 +320,12 @@ def run_from_cli():
 
     if scrape_web_args.output_type is None:
         print_colored(
-            '\n出力先方法を入力してください。("copy" or "file")', (f" default: {default_output_type}", "grey")
+            '\n出力先方法を入力してください。("copy", "file", "jsonl" or "parquet")',
+            (f" default: {default_output_type}", "grey"),
         )
         output_type: str = input("output_type: ")
-        if output_type == "file":
-            scrape_web_args.output_type = "file"
+        if output_type in ["file", *record_formats]:
+            scrape_web_args.output_type = cast(OutputType, output_type)
         else:
             scrape_web_args.output_type = default_output_type
 
@@ -203,7 +377,7 @@ def run_from_cli():
             print_colored((f"\nlimit_token を{format_number(limit_token_on_copy)}に設定しました。\n", "red"))
             scrape_web_args.limit_token = limit_token_on_copy
 
-    if scrape_web_args.output_type == "file":
+    if scrape_web_args.output_type in ["file", *record_formats]:
         if scrape_web_args.file_name is None:
             print(f"\nファイル名を入力してください。 default: {default_file_name}")
             file_name: str = input("file_name: ")
@@ -212,13 +386,41 @@ def run_from_cli():
             else:
                 scrape_web_args.file_name = default_file_name
 
+    # レコードをストリーミングで書き出す場合は、クロールの前にファイルを開く
+    record_writer: RecordWriterIF | None = None
+    if scrape_web_args.output_type in record_formats:
+        record_writer = get_record_writer(
+            cast(RecordFormat, scrape_web_args.output_type),
+            file_name=scrape_web_args.file_name or default_file_name,
+            file_dir=default_file_dir,
+        )
+
     # メイン処理
-    contents: list[str] = main(
-        root_urls=scrape_web_args.root_urls,
-        ignore_urls=scrape_web_args.ignore_urls,
-        limit_token=scrape_web_args.limit_token,
-        limit_char=scrape_web_args.limit_char,
-    )
+    try:
+        contents: list[str] = main(
+            root_urls=scrape_web_args.root_urls,
+            ignore_urls=scrape_web_args.ignore_urls,
+            limit_token=scrape_web_args.limit_token,
+            limit_char=scrape_web_args.limit_char,
+            extractor=scrape_web_args.extractor,
+            readability=scrape_web_args.readability,
+            embedded_json=scrape_web_args.embedded_json,
+            dedup=scrape_web_args.dedup,
+            sitemap=scrape_web_args.sitemap,
+            robots=scrape_web_args.robots,
+            rate_limit=scrape_web_args.rate_limit,
+            allowed_content_types=scrape_web_args.allowed_content_types,
+            max_content_bytes=scrape_web_args.max_content_bytes,
+            pdf=scrape_web_args.pdf,
+            record_writer=record_writer,
+            keywords=scrape_web_args.keywords,
+            fetch_workers=scrape_web_args.fetch_workers,
+            parse_workers=scrape_web_args.parse_workers,
+            metrics_report=scrape_web_args.metrics_report,
+        )
+    finally:
+        if record_writer is not None:
+            record_writer.close()
 
     # 出力方法がcopyの場合
     if scrape_web_args.output_type == "copy":
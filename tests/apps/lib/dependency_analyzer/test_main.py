@@ -38,6 +38,26 @@ class TestGetAllFilePaths:
         # pathの戦闘が指定したディレクトリ(mock_path/ts_mock)以下でないことを確認
         assert all([not p.startswith(os.path.join(mock_path, 'ts_mock')) for p in file_paths])
 
+    def test_ignore_path_patterns(self, tmp_path):
+        """globと正規表現のルールでパスを無視し、一致したディレクトリの中を探索しないことを確認する"""
+        for relative_path in [
+            'src/main.py',
+            'src/test_main.py',
+            'src/gen_1/generated.py',
+            'src/vendor/lib.py',
+            'build/output.py',
+        ]:
+            file_path = tmp_path / relative_path
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_text('')
+
+        file_paths = get_all_file_paths(
+            str(tmp_path),
+            # */vendor はディレクトリのパスだけに一致するため、中のファイルはディレクトリごと除外される
+            ignore_paths=['*/test_*.py', r're:/gen_\d+/', '*/vendor', 'build'],
+        )
+        assert file_paths == [os.path.join(str(tmp_path), 'src', 'main.py')]
+
 
 class TestDependencyAnalyzer:
     """DependencyAnalyzer のテスト"""
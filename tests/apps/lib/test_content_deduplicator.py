@@ -0,0 +1,52 @@
+from apps.lib.content_deduplicator import ContentDeduplicator
+from apps.lib.web_crawler_scraper import ScrapedData
+
+footer = "Copyright Example Inc. All rights reserved. Terms of service and privacy policy."
+
+
+def make_scraped_data(url: str, blocks: list[str]) -> ScrapedData:
+    content = " ".join(blocks)
+    return ScrapedData(url=url, content=content, token_size=len(blocks), char_size=len(content), blocks=blocks)
+
+
+class TestContentDeduplicator:
+    """ContentDeduplicator のテスト"""
+
+    def test_remove_repeated_paragraphs(self):
+        """複数ページに繰り返し出現する段落を最初のページにだけ残すことを確認する"""
+        scraped_data = [
+            make_scraped_data(f"https://example.com/{i}", [f"Page {i} explains topic number {i} in detail.", footer])
+            for i in range(3)
+        ]
+        deduplicated = ContentDeduplicator(min_pages=3).remove_repeated_paragraphs(scraped_data)
+
+        assert [data.url for data in deduplicated] == [data.url for data in scraped_data]
+        assert deduplicated[0].blocks == scraped_data[0].blocks
+        assert deduplicated[1].blocks == ["Page 1 explains topic number 1 in detail."]
+        assert deduplicated[2].content == "Page 2 explains topic number 2 in detail."
+        assert deduplicated[2].char_size == len(deduplicated[2].content)
+
+    def test_keep_paragraphs_below_min_pages(self):
+        """出現ページ数がmin_pages未満の段落は除去しないことを確認する"""
+        scraped_data = [
+            make_scraped_data(f"https://example.com/{i}", [f"Page {i} explains topic number {i} in detail.", footer])
+            for i in range(2)
+        ]
+        deduplicated = ContentDeduplicator(min_pages=3).remove_repeated_paragraphs(scraped_data)
+        assert deduplicated == scraped_data
+
+    def test_remove_near_duplicate_pages(self):
+        """ほぼ重複したページを除去できることを確認する"""
+        text = " ".join(f"word{i}" for i in range(300))
+        scraped_data = [
+            make_scraped_data("https://example.com/a", [text]),
+            make_scraped_data("https://example.com/b", [text + " extra"]),
+            make_scraped_data("https://example.com/c", [" ".join(f"other{i}" for i in range(300))]),
+        ]
+        deduplicated = ContentDeduplicator().remove_near_duplicate_pages(scraped_data)
+        assert [data.url for data in deduplicated] == ["https://example.com/a", "https://example.com/c"]
+
+    def test_shingles_without_spaces(self):
+        """空白で区切らない言語の場合は文字単位のシングルになることを確認する"""
+        shingles = ContentDeduplicator(shingle_size=2).shingles("あいうえお")
+        assert shingles == {"あ い", "い う", "う え", "え お"}
@@ -0,0 +1,20 @@
+from apps.lib.content_hash_index import ContentHashIndex
+
+
+class TestContentHashIndex:
+    """ContentHashIndex のテスト"""
+
+    def test_find_duplicate(self):
+        """空白の違いを無視して同じ内容のページを検出することを確認する"""
+        index = ContentHashIndex()
+        assert index.find_duplicate("https://example.com/a", "Hello  world") is None
+        assert index.find_duplicate("https://example.com/b", "Hello\nworld") == "https://example.com/a"
+        assert index.find_duplicate("https://example.com/c", "Hello other world") is None
+        # 同じURLの場合は重複としない
+        assert index.find_duplicate("https://example.com/a", "Hello world") is None
+
+    def test_find_duplicate_empty(self):
+        """本文が無いページ同士を重複としないことを確認する"""
+        index = ContentHashIndex()
+        assert index.find_duplicate("https://example.com/a", "") is None
+        assert index.find_duplicate("https://example.com/b", " ") is None
@@ -0,0 +1,48 @@
+from apps.lib.content_scorer import ContentScorer
+from apps.lib.html_extractor import TextBlock
+
+long_text = "This paragraph explains the main topic of the page in enough detail to be content."
+
+
+class TestContentScorer:
+    """ContentScorer のテスト"""
+
+    def test_remove_negative_hint_block(self):
+        """class/id属性のヒントで本文以外と判定されたブロックを除去できることを確認する"""
+        scorer = ContentScorer()
+        blocks = [TextBlock(text=long_text), TextBlock(text="We use cookies on this site, accept all cookies.", negative_hint=True)]
+        assert scorer.select_blocks("https://example.com", blocks) == [blocks[0]]
+
+    def test_remove_high_link_density_block(self):
+        """リンク密度の高いブロックを除去できることを確認する"""
+        scorer = ContentScorer()
+        menu = "Home Docs Blog About Contact Pricing Careers Community"
+        blocks = [TextBlock(text=long_text), TextBlock(text=menu, link_chars=len(menu))]
+        assert scorer.select_blocks("https://example.com", blocks) == [blocks[0]]
+
+    def test_keep_short_block_between_good_blocks(self):
+        """本文に挟まれた短いブロック(見出しなど)を残すことを確認する"""
+        scorer = ContentScorer()
+        blocks = [TextBlock(text=long_text), TextBlock(text="Usage"), TextBlock(text=long_text + " Again.")]
+        assert scorer.select_blocks("https://example.com", blocks) == blocks
+
+    def test_prefer_main_blocks(self):
+        """main要素の中のブロックだけを候補にすることを確認する"""
+        scorer = ContentScorer()
+        blocks = [TextBlock(text=long_text), TextBlock(text=long_text + " Main.", in_main=True)]
+        assert scorer.select_blocks("https://example.com", blocks) == [blocks[1]]
+
+    def test_remove_repeated_block(self):
+        """同じサイトの複数ページで繰り返し出現するブロックを除去できることを確認する"""
+        scorer = ContentScorer(min_repeat=2)
+        repeated = TextBlock(text="Copyright Example Inc. All rights reserved. Terms of service and privacy policy.")
+        for i in range(2):
+            selected = scorer.select_blocks(f"https://example.com/{i}", [TextBlock(text=f"{long_text} {i}"), repeated])
+            assert repeated in selected
+
+        selected = scorer.select_blocks("https://example.com/2", [TextBlock(text=f"{long_text} 2"), repeated])
+        assert repeated not in selected
+
+        # 別のサイトでは除去しない
+        selected = scorer.select_blocks("https://example.org/", [TextBlock(text=long_text), repeated])
+        assert repeated in selected
@@ -0,0 +1,61 @@
+import pytest
+
+from apps.lib.content_type_sniffer import (
+    guess_content_type_from_url,
+    has_unknown_extension,
+    is_allowed_content_type,
+    parse_content_type,
+    sniff_content_type,
+)
+
+
+class TestContentTypeSniffer:
+    """content_type_sniffer のテスト"""
+
+    def test_parse_content_type(self):
+        """Content-TypeヘッダーからMIMEタイプを取得できることを確認する"""
+        assert parse_content_type("Text/HTML; charset=utf-8") == "text/html"
+        assert parse_content_type(None) is None
+
+    @pytest.mark.parametrize(
+        "url, expected",
+        [
+            ("https://example.com/docs", None),
+            ("https://example.com/docs/index.html", None),
+            ("https://example.com/docs/page.php?id=1", None),
+            ("https://example.com/file.pdf", "application/pdf"),
+            ("https://example.com/image.JPG", "image/jpeg"),
+            ("https://example.com/archive.zip", "application/zip"),
+        ],
+    )
+    def test_guess_content_type_from_url(self, url, expected):
+        """URLの拡張子からMIMEタイプを推定できることを確認する"""
+        assert guess_content_type_from_url(url) == expected
+
+    def test_has_unknown_extension(self):
+        """拡張子からMIMEタイプを判定できないURLを判定できることを確認する"""
+        assert has_unknown_extension("https://example.com/download.unknownext")
+        assert not has_unknown_extension("https://example.com/docs")
+        assert not has_unknown_extension("https://example.com/file.pdf")
+
+    @pytest.mark.parametrize(
+        "head, expected",
+        [
+            (b"%PDF-1.7\n", "application/pdf"),
+            (b"\x89PNG\r\n\x1a\n....", "image/png"),
+            (b"\x00\x00\x00\x18ftypmp42", "video/mp4"),
+            (b"\xef\xbb\xbf\n  <!DOCTYPE html><html>", "text/html"),
+            (b'<?xml version="1.0"?><html xmlns="http://www.w3.org/1999/xhtml">', "application/xhtml+xml"),
+            (b"plain text", None),
+        ],
+    )
+    def test_sniff_content_type(self, head, expected):
+        """本文の先頭のバイト列からMIMEタイプを推定できることを確認する"""
+        assert sniff_content_type(head) == expected
+
+    def test_is_allowed_content_type(self):
+        """許可リストとワイルドカードでMIMEタイプを判定できることを確認する"""
+        assert is_allowed_content_type("text/html", ["text/html"])
+        assert is_allowed_content_type("text/plain", ["text/*"])
+        assert not is_allowed_content_type("application/pdf", ["text/*"])
+        assert not is_allowed_content_type(None, ["text/html"])
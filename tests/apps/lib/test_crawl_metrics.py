@@ -0,0 +1,78 @@
+import json
+
+from apps.lib.crawl_metrics import CrawlMetrics, LatencyHistogram
+
+
+class TestLatencyHistogram:
+    """LatencyHistogram のテスト"""
+
+    def test_observe(self):
+        """レイテンシをバケットごとに数え、分位点と平均を計算できることを確認する"""
+        histogram = LatencyHistogram()
+        for seconds in [0.01, 0.02, 0.2, 0.3, 60.0]:
+            histogram.observe(seconds)
+
+        assert histogram.count == 5
+        assert histogram.counts[0] == 2
+        assert histogram.counts[2] == 1
+        assert histogram.counts[3] == 1
+        assert histogram.counts[-1] == 1
+        assert histogram.percentile(0.4) == 0.05
+        assert histogram.percentile(0.8) == 0.5
+        assert histogram.percentile(1.0) == 60.0
+        assert round(histogram.mean_seconds, 3) == 12.106
+
+    def test_empty(self):
+        """記録が無い場合は0を返すことを確認する"""
+        histogram = LatencyHistogram()
+        assert histogram.percentile(0.9) == 0.0
+        assert histogram.mean_seconds == 0.0
+
+
+class TestCrawlMetrics:
+    """CrawlMetrics のテスト"""
+
+    def test_to_dict(self):
+        """記録したメトリクスを機械で読める形式で取得できることを確認する"""
+        metrics = CrawlMetrics()
+        metrics.record_response("https://example.com/a", 200, 0.1)
+        metrics.record_response("https://example.com/b", 429, 0.3)
+        metrics.record_response("https://slow.example.org/a", 200, 2.0)
+        metrics.record_page(1000)
+        metrics.record_page(3000)
+        metrics.record_error()
+        metrics.record_parse(0.01)
+        metrics.record_tokenize(0.02)
+        metrics.record_queue(10, 2)
+        metrics.record_queue(5, 1)
+
+        report = metrics.to_dict()
+        assert report["pages"] == 2
+        assert report["bytes"] == 4000
+        assert report["errors"] == 1
+        assert report["status_codes"] == {"200": 2, "429": 1}
+        assert report["parse"]["count"] == 1
+        assert report["tokenize"]["total_seconds"] == 0.02
+        assert report["max_queue_depth"] == 10
+        assert report["hosts"]["example.com"]["count"] == 2
+        assert report["hosts"]["slow.example.org"]["p90_seconds"] == 2.0
+        assert report["pages_per_second"] > 0
+
+    def test_write_report(self, tmp_path):
+        """メトリクスをJSONファイルに書き出せることを確認する"""
+        metrics = CrawlMetrics()
+        metrics.record_page(10)
+        file_path = tmp_path / "metrics.json"
+        metrics.write_report(str(file_path))
+
+        with open(file_path) as f:
+            assert json.load(f)["pages"] == 1
+
+    def test_reset(self):
+        """リセットすると集計が初期化されることを確認する"""
+        metrics = CrawlMetrics()
+        metrics.record_page(10)
+        metrics.record_response("https://example.com/a", 200, 0.1)
+        metrics.reset()
+        assert metrics.pages == 0
+        assert metrics.host_latencies == {}
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from apps.lib.document_extractor import DocumentExtractor, extract_pdf_pages
+
+
+def build_pdf(page_texts: list[str]) -> bytes:
+    """ページごとにテキストを1行だけ含むPDFを作成する"""
+    page_count = len(page_texts)
+    objects: list[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids ["
+        + b" ".join(f"{4 + i * 2} 0 R".encode() for i in range(page_count))
+        + f"] /Count {page_count} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(page_texts):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {5 + i * 2} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+    pdf = b"%PDF-1.4\n"
+    offsets: list[int] = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return pdf
+
+
+@pytest.fixture
+def pdf_file(tmp_path):
+    file_path = tmp_path / "document.pdf"
+    file_path.write_bytes(build_pdf([f"Page {i}" for i in range(5)]))
+    return str(file_path)
+
+
+class TestDocumentExtractor:
+    """DocumentExtractor のテスト"""
+
+    def test_extract_pdf_pages(self, pdf_file):
+        """PDFの指定範囲のページからテキストを抽出できることを確認する"""
+        assert extract_pdf_pages(pdf_file, 1, 3) == ["Page 1", "Page 2"]
+
+    def test_submit_and_collect(self, pdf_file):
+        """ワーカープロセスでページごとに抽出し、ページの順番を保って取得できることを確認する"""
+        document_extractor = DocumentExtractor(max_workers=2, pages_per_task=2)
+        try:
+            document_extractor.submit("https://example.com/document.pdf", pdf_file)
+            documents = document_extractor.collect(wait=True)
+        finally:
+            document_extractor.shutdown()
+
+        assert len(documents) == 1
+        assert documents[0].url == "https://example.com/document.pdf"
+        assert documents[0].pages == ["Page 0", "Page 1", "Page 2", "Page 3", "Page 4"]
+        # 抽出が完了した一時ファイルは削除される
+        assert not os.path.exists(pdf_file)
+        assert document_extractor.pending_documents == []
+
+    def test_submit_invalid_document(self, tmp_path):
+        """読み込めないドキュメントを投入しないことを確認する"""
+        file_path = tmp_path / "broken.pdf"
+        file_path.write_bytes(b"not a pdf")
+        document_extractor = DocumentExtractor(max_workers=1)
+        document_extractor.submit("https://example.com/broken.pdf", str(file_path))
+
+        assert document_extractor.pending_documents == []
+        assert document_extractor.collect(wait=True) == []
+        assert not file_path.exists()
+
+    def test_is_document(self):
+        """テキストを抽出できるMIMEタイプを判定できることを確認する"""
+        assert DocumentExtractor.is_document("application/pdf")
+        assert not DocumentExtractor.is_document("text/html")
+        assert not DocumentExtractor.is_document(None)
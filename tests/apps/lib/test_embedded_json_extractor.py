@@ -0,0 +1,86 @@
+import json
+
+from apps.lib.embedded_json_extractor import EmbeddedJsonExtractor, find_embedded_json
+from apps.lib.html_extractor import HtmlExtractorLxml
+
+next_data = {
+    "props": {
+        "pageProps": {
+            "title": "Getting started",
+            "slug": "getting-started-with-the-library",
+            "content": "<h2>Installation</h2><p>Install the package with <code>pip install example</code>.</p>",
+            "description": "This guide explains how to install and configure the library.",
+            "compiledSource": "function MDXContent(props) { return _jsx(Wrapper, { children: 'x' }); }",
+        }
+    },
+    "buildId": "abcdefghijklmnopqrstuvwxyz",
+}
+
+json_ld = {
+    "@context": "https://schema.org",
+    "@type": "Article",
+    "headline": "Getting started",
+    "articleBody": "This guide explains how to install and configure the library.",
+}
+
+html = f"""<!DOCTYPE html>
+<html>
+<head>
+<script type="application/ld+json">{json.dumps(json_ld)}</script>
+<script>window.__INITIAL_STATE__ = {{"message": "Hydrated content from the initial state payload."}};</script>
+</head>
+<body>
+<div id="__next"></div>
+<script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script>
+</body>
+</html>""".encode()
+
+
+class TestEmbeddedJsonExtractor:
+    """EmbeddedJsonExtractor のテスト"""
+
+    def test_find_embedded_json(self):
+        """JSON-LD、ハイドレーション用のデータ、__NEXT_DATA__を取得できることを確認する"""
+        assert find_embedded_json(html) == [
+            json_ld,
+            {"message": "Hydrated content from the initial state payload."},
+            next_data,
+        ]
+
+    def test_extract(self):
+        """本文らしい文字列だけを重複なく段落として取り出すことを確認する"""
+        blocks = EmbeddedJsonExtractor().extract(html)
+        assert [block.text for block in blocks] == [
+            "This guide explains how to install and configure the library.",
+            "Hydrated content from the initial state payload.",
+            "Installation",
+            "Install the package with pip install example .",
+        ]
+
+    def test_recover(self):
+        """本文がほとんど無いページだけを埋め込まれたJSONから復元することを確認する"""
+        extractor = EmbeddedJsonExtractor()
+        empty_page = HtmlExtractorLxml().extract(html)
+        recovered_page = extractor.recover(empty_page, html)
+        assert len(recovered_page.blocks) == 4
+
+        full_html = b"<p>" + b"Server rendered text. " * 20 + b"</p>" + html
+        full_page = HtmlExtractorLxml().extract(full_html)
+        assert extractor.recover(full_page, full_html) is full_page
+
+    def test_recover_keeps_canonical_url(self):
+        """復元したページでも、HTMLの<link rel="canonical">のURLとリンクを保持することを確認する"""
+        canonical_html = html.replace(
+            b"<head>", b'<head><link rel="canonical" href="https://example.com/docs/getting-started">'
+        ).replace(b'<div id="__next"></div>', b'<div id="__next"><a href="/docs/next">Next</a></div>')
+        page = HtmlExtractorLxml().extract(canonical_html)
+        recovered_page = EmbeddedJsonExtractor().recover(page, canonical_html)
+        assert len(recovered_page.blocks) == 4
+        assert recovered_page.canonical_url == "https://example.com/docs/getting-started"
+        assert recovered_page.links == ["/docs/next"]
+
+    def test_find_embedded_json_invalid(self):
+        """JSONとして読めないスクリプトを無視することを確認する"""
+        assert find_embedded_json(b'<script>window.__STATE__ = {a: 1};</script>') == []
+        assert find_embedded_json(b'<script type="application/json">{</script>') == []
+        assert find_embedded_json(b"") == []
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from apps.lib.file_writer_util import JsonlRecordWriter, ParquetRecordWriter, get_record_writer
+
+records = [
+    {"url": "https://example.com/a", "content": "こんにちは", "token_size": 3, "char_size": 5},
+    {"url": "https://example.com/b", "content": "world", "token_size": 1, "char_size": 5},
+]
+
+
+class TestRecordWriter:
+    """RecordWriter のテスト"""
+
+    def test_jsonl_record_writer(self, tmp_path):
+        """レコードを1行ずつJSON Linesとして追記できることを確認する"""
+        with JsonlRecordWriter(file_name="records", file_dir=str(tmp_path / "out")) as writer:
+            writer.write_record(records[0])
+            # 閉じる前でも書き出したレコードを読める
+            with open(writer.file_path, encoding="utf-8") as f:
+                assert [json.loads(line) for line in f] == records[:1]
+            writer.write_record(records[1])
+
+        with open(tmp_path / "out" / "records.jsonl", encoding="utf-8") as f:
+            assert [json.loads(line) for line in f] == records
+        assert writer.record_count == 2
+
+    def test_parquet_record_writer(self, tmp_path):
+        """レコードを行グループごとにParquetとして書き出せることを確認する"""
+        pq = pytest.importorskip("pyarrow.parquet")
+        with ParquetRecordWriter(file_name="records", file_dir=str(tmp_path), batch_size=1) as writer:
+            for record in records:
+                writer.write_record(record)
+
+        table = pq.read_table(tmp_path / "records.parquet")
+        assert table.to_pylist() == records
+        assert pq.ParquetFile(tmp_path / "records.parquet").num_row_groups == 2
+
+    def test_get_record_writer(self, tmp_path):
+        """出力形式からレコードの書き出しクラスを取得できることを確認する"""
+        writer = get_record_writer("jsonl", file_name="records", file_dir=str(tmp_path))
+        assert isinstance(writer, JsonlRecordWriter)
+        writer.close()
+        with pytest.raises(ValueError):
+            get_record_writer("csv", file_name="records", file_dir=str(tmp_path))  # type: ignore
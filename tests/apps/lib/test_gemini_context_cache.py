@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from apps.lib.gemini_context_cache import (
+    ContextCacheEntry,
+    GeminiContextCache,
+    estimate_gemini_tokens,
+    is_context_cache_supported,
+)
+from apps.lib.llms import GeminiClient, LlmMessage, LlmMessages, LlmModelEnum
+
+
+class RecordingContextCache(GeminiContextCache):
+    """APIを呼ばずに、キャッシュの作成と削除を記録するコンテキストキャッシュ"""
+
+    def __init__(self, **kwargs):
+        super().__init__(min_tokens=0, **kwargs)
+        self.created: list[str] = []
+        self.deleted: list[str] = []
+
+    def is_cacheable(self, system_instruction, contents) -> bool:
+        return True
+
+    def _create(self, model_name, system_instruction, contents) -> ContextCacheEntry:
+        # APIの呼び出しの間は、他のスレッドを待たせないようにロックを取得しない
+        assert not self._lock.locked()
+        self.created.append(model_name)
+        return ContextCacheEntry(cached_content=model_name, model=model_name, expires_at=time.time() + self.ttl)
+
+    def _delete(self, entry: ContextCacheEntry) -> None:
+        assert not self._lock.locked()
+        self.deleted.append(entry.cached_content)
+
+
+class TestGeminiContextCache:
+    """GeminiContextCache のテスト"""
+
+    def test_estimate_gemini_tokens(self):
+        """システム指示とメッセージの文字数からトークン数を見積もることを確認する"""
+        contents = [{'role': 'user', 'parts': [{'text': 'a' * 40}]}, {'role': 'model', 'parts': [{'text': 'b' * 20}]}]
+        assert estimate_gemini_tokens('c' * 20, contents) == 20
+        assert estimate_gemini_tokens(None, []) == 0
+
+    def test_make_key(self):
+        """モデル名・システム指示・メッセージのいずれかが異なる場合は、異なるキーになることを確認する"""
+        contents = [{'role': 'user', 'parts': [{'text': 'code'}]}]
+        key = GeminiContextCache.make_key('models/gemini-1.5-flash-002', 'system', contents)
+
+        assert GeminiContextCache.make_key('models/gemini-1.5-flash-002', 'system', contents) == key
+        assert GeminiContextCache.make_key('models/gemini-1.5-pro-002', 'system', contents) != key
+        assert GeminiContextCache.make_key('models/gemini-1.5-flash-002', None, contents) != key
+        assert GeminiContextCache.make_key('models/gemini-1.5-flash-002', 'system', []) != key
+
+    def test_not_cache_short_prefix(self):
+        """最小のトークン数に満たないプレフィックスはキャッシュせず、Noneを返すことを確認する"""
+        cache = GeminiContextCache(min_tokens=100)
+        contents = [{'role': 'user', 'parts': [{'text': 'short'}]}]
+        assert cache.is_cacheable(None, contents) is False
+        assert cache.get_model('models/gemini-1.5-flash-002', None, contents) is None
+
+    @pytest.mark.skipif(is_context_cache_supported(), reason='SDK supports context caching')
+    def test_not_cache_without_sdk_support(self):
+        """SDKがコンテキストキャッシュに対応していない場合は、キャッシュしないことを確認する"""
+        cache = GeminiContextCache(min_tokens=0)
+        contents = [{'role': 'user', 'parts': [{'text': 'code'}]}]
+        assert cache.get_model('models/gemini-1.5-flash-002', None, contents) is None
+
+    def test_get_model_reuses_and_evicts(self):
+        """同じプレフィックスでは作成したキャッシュを使い回し、上限を超えたら最も古く使ったものを削除することを確認する"""
+        cache = RecordingContextCache(max_entries=2)
+        contents = [{'role': 'user', 'parts': [{'text': 'code'}]}]
+
+        assert cache.get_model('model-a', None, contents) == 'model-a'
+        assert cache.get_model('model-b', None, contents) == 'model-b'
+        assert cache.get_model('model-a', None, contents) == 'model-a'
+        assert cache.get_model('model-c', None, contents) == 'model-c'
+
+        assert cache.created == ['model-a', 'model-b', 'model-c']
+        assert cache.deleted == ['model-b']
+        cache.clear()
+        assert sorted(cache.deleted) == ['model-a', 'model-b', 'model-c']
+
+
+class TestGeminiClientPrefix:
+    """GeminiClient のプレフィックスのキャッシュのテスト"""
+
+    def test_get_model_and_contents_without_context_cache(self):
+        """コンテキストキャッシュを使えない場合は、すべてのメッセージを通常のモデルに送ることを確認する"""
+        messages = LlmMessages(
+            messages=[
+                LlmMessage(role='system', content='system'),
+                LlmMessage(role='user', content='short code', cache=True),
+                LlmMessage(role='user', content='question'),
+            ]
+        )
+        model, contents = GeminiClient().get_model_and_contents(messages, LlmModelEnum.GEMINI15FLASH)
+
+        assert model._system_instruction is not None
+        assert contents == [
+            {'role': 'user', 'parts': [{'text': 'short code'}]},
+            {'role': 'user', 'parts': [{'text': 'question'}]},
+        ]
@@ -0,0 +1,74 @@
+import pytest
+
+from apps.lib.html_extractor import (
+    HtmlExtractorBs4,
+    HtmlExtractorLxml,
+    get_html_extractor,
+)
+
+html = b"""<!DOCTYPE html>
+<html>
+<head><title>Title</title><style>p { color: red; }</style><script>var a = 1;</script></head>
+<body>
+<header>Header <a href="/header">header link</a></header>
+<!-- comment -->
+<div>Hello <b>world</b>! <a href="/foo?bar=1#baz">Foo</a> tail
+<nav><a href="/nav">nav link</a></nav> after nav
+<p>first<br>second</p>
+<aside>side</aside>
+<footer>Footer</footer>
+</div>
+</body>
+</html>"""
+
+
+class TestHtmlExtractor:
+    """HtmlExtractor のテスト"""
+
+    @pytest.mark.parametrize("extractor", [HtmlExtractorBs4(), HtmlExtractorLxml()])
+    def test_extract_text(self, extractor):
+        """本文以外の要素を除いたテキストを抽出できることを確認する"""
+        page = extractor.extract(html)
+        assert page.text == "Title Hello world ! Foo tail after nav first second"
+
+    @pytest.mark.parametrize("extractor", [HtmlExtractorBs4(), HtmlExtractorLxml()])
+    def test_extract_links(self, extractor):
+        """本文以外の要素を除いたリンクを抽出できることを確認する"""
+        page = extractor.extract(html)
+        assert page.links == ["/foo?bar=1#baz"]
+
+    def test_extract_empty(self):
+        """空のHTMLから空の結果を返すことを確認する"""
+        page = HtmlExtractorLxml().extract(b"")
+        assert page.text == ""
+        assert page.links == []
+
+    def test_get_html_extractor(self):
+        """バックエンド名からHTML抽出クラスを取得できることを確認する"""
+        assert isinstance(get_html_extractor("bs4"), HtmlExtractorBs4)
+        assert isinstance(get_html_extractor("lxml"), HtmlExtractorLxml)
+        with pytest.raises(ValueError):
+            get_html_extractor("unknown")  # type: ignore
+
+    @pytest.mark.parametrize("extractor", [HtmlExtractorBs4(), HtmlExtractorLxml()])
+    def test_extract_blocks(self, extractor):
+        """ブロックレベル要素ごとにテキストとリンク密度、ヒントを抽出できることを確認する"""
+        page = extractor.extract(
+            b'<body><div class="sidebar"><a href="/a">Link</a></div>'
+            b'<main><p>Main <a href="/b">text</a></p></main></body>'
+        )
+        assert [block.text for block in page.blocks] == ["Link", "Main text"]
+        assert page.blocks[0].negative_hint is True
+        assert page.blocks[0].link_density == 1.0
+        assert page.blocks[1].in_main is True
+        assert page.blocks[1].link_chars == len("text")
+
+    @pytest.mark.parametrize("extractor", [HtmlExtractorBs4(), HtmlExtractorLxml()])
+    def test_extract_canonical_url(self, extractor):
+        """<link rel="canonical"> のURLを抽出できることを確認する"""
+        page = extractor.extract(
+            b'<html><head><link rel="stylesheet" href="/style.css"><link rel="Canonical" href="/docs/a">'
+            b'<link rel="canonical" href="/docs/b"></head><body>text</body></html>'
+        )
+        assert page.canonical_url == "/docs/a"
+        assert page.links == []
@@ -0,0 +1,116 @@
+import json
+import time
+
+from apps.lib.llm_ledger import (
+    DEFAULT_STAGE,
+    LlmLedger,
+    get_llm_stage,
+    llm_stage,
+    record_llm_first_token,
+    record_llm_tokens,
+)
+
+
+class TestLlmStage:
+    """llm_stage のテスト"""
+
+    def test_context_manager(self):
+        """中で呼び出したLLMのステージ名を指定し、抜けたら元に戻すことを確認する"""
+        assert get_llm_stage() == DEFAULT_STAGE
+        with llm_stage('outer'):
+            with llm_stage('inner'):
+                assert get_llm_stage() == 'inner'
+            assert get_llm_stage() == 'outer'
+        assert get_llm_stage() == DEFAULT_STAGE
+
+    def test_decorator(self):
+        """デコレータとして関数の呼び出しごとにステージ名を指定できることを確認する"""
+
+        @llm_stage('decorated')
+        def get_stage() -> str:
+            return get_llm_stage()
+
+        assert get_stage() == 'decorated'
+        assert get_stage() == 'decorated'
+        assert get_llm_stage() == DEFAULT_STAGE
+
+
+class TestLlmLedger:
+    """LlmLedger のテスト"""
+
+    def test_add(self):
+        """集めたトークン数から料金を計算し、ステージ名とともに記録することを確認する"""
+        ledger = LlmLedger()
+        with llm_stage('analysis'), ledger.track() as usage:
+            record_llm_tokens(1_000, 200)
+            record_llm_tokens(500, None)
+            record = ledger.add('model', usage, input_cost=1.0, output_cost=4.0)
+
+        assert record.stage == 'analysis'
+        assert record.prompt_tokens == 1_500
+        assert record.completion_tokens == 200
+        assert record.cost == (1_500 * 1.0 + 200 * 4.0) / 1_000_000
+        assert record.ttft_seconds is None
+        assert ledger.records == [record]
+
+    def test_ttft(self):
+        """最初のトークンを受け取るまでの時間を記録し、2回目以降は無視することを確認する"""
+        ledger = LlmLedger()
+        with ledger.track() as usage:
+            time.sleep(0.01)
+            record_llm_first_token()
+            time.sleep(0.05)
+            record_llm_first_token()
+            record = ledger.add('model', usage, input_cost=0.0, output_cost=0.0)
+
+        assert record.ttft_seconds is not None
+        assert 0.01 <= record.ttft_seconds < record.latency_seconds
+
+    def test_ignore_outside_track(self):
+        """記録中でない場合は、トークン数を加算しないことを確認する"""
+        record_llm_tokens(100, 100)
+        record_llm_first_token()
+
+    def test_summarize(self):
+        """ステージやモデルごとに集計できることを確認する"""
+        ledger = LlmLedger()
+        for stage, model, cached in [('a', 'flash', False), ('a', 'pro', True), ('b', 'flash', False)]:
+            with llm_stage(stage), ledger.track() as usage:
+                record_llm_tokens(10, 1)
+                ledger.add(model, usage, input_cost=1.0, output_cost=1.0, cached=cached)
+
+        by_stage = ledger.summarize('stage')
+        assert by_stage['a'].calls == 2
+        assert by_stage['a'].cached_calls == 1
+        assert by_stage['a'].prompt_tokens == 20
+        assert by_stage['b'].calls == 1
+        assert {model: summary.calls for model, summary in ledger.summarize('model').items()} == {'flash': 2, 'pro': 1}
+
+    def test_print_summary(self, capsys):
+        ledger = LlmLedger()
+        ledger.print_summary()
+        assert capsys.readouterr().out == ''
+
+        with llm_stage('analysis'), ledger.track() as usage:
+            record_llm_tokens(1_000, 100)
+            ledger.add('model', usage, input_cost=1.0, output_cost=1.0)
+        ledger.print_summary()
+        output = capsys.readouterr().out
+        assert '1 calls' in output
+        assert 'analysis' in output
+
+    def test_save(self, tmp_path):
+        """記録をJSON Linesのファイルに追記することを確認する"""
+        file_path = tmp_path / 'ledger' / 'llm_ledger.jsonl'
+        ledger = LlmLedger()
+        with ledger.track() as usage:
+            record_llm_tokens(10, 5)
+            ledger.add('model', usage, input_cost=1.0, output_cost=1.0)
+        ledger.save(str(file_path))
+        ledger.save(str(file_path))
+
+        rows = [json.loads(line) for line in file_path.read_text().splitlines()]
+        assert len(rows) == 2
+        assert rows[0]['model'] == 'model'
+        assert rows[0]['prompt_tokens'] == 10
+        assert rows[0]['completion_tokens'] == 5
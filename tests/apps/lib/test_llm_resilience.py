@@ -0,0 +1,182 @@
+import asyncio
+
+import httpx
+import pytest
+from google.api_core import exceptions as google_exceptions
+from openai import RateLimitError
+
+from apps.lib.llm_resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    acall_with_retry,
+    call_with_retry,
+    get_retry_after,
+    is_retryable_error,
+)
+
+# 待たずにリトライするポリシー
+NO_WAIT_POLICY = RetryPolicy(max_retries=3, initial_delay=0.0, rate_limit_delay=0.0, jitter=0.0)
+
+
+def make_rate_limit_error(headers: dict[str, str] | None = None) -> RateLimitError:
+    response = httpx.Response(429, headers=headers, request=httpx.Request('POST', 'http://localhost/v1'))
+    return RateLimitError('rate limited', response=response, body=None)
+
+
+class FlakyFunction:
+    """指定した回数だけエラーを送出してから成功する関数"""
+
+    def __init__(self, errors: list[Exception]):
+        self.errors = errors
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class TestRetryPolicy:
+    """RetryPolicy のテスト"""
+
+    def test_get_delay(self):
+        """待ち時間を指数的に増やし、上限で止めることを確認する"""
+        policy = RetryPolicy(initial_delay=1.0, multiplier=2.0, max_delay=5.0, jitter=0.0)
+        assert [policy.get_delay(attempt) for attempt in range(4)] == [1.0, 2.0, 4.0, 5.0]
+
+    def test_get_delay_with_jitter(self):
+        """ジッターの割合の範囲で待ち時間を短くすることを確認する"""
+        policy = RetryPolicy(initial_delay=4.0, jitter=0.5)
+        for _ in range(20):
+            assert 2.0 <= policy.get_delay(0) <= 4.0
+
+    def test_get_delay_for_rate_limit(self):
+        """レート制限の場合は長く待ち、サーバーが指定した時間より前にはリトライしないことを確認する"""
+        policy = RetryPolicy(initial_delay=1.0, rate_limit_delay=5.0, jitter=0.0)
+        assert policy.get_delay(0, make_rate_limit_error()) == 5.0
+        assert policy.get_delay(0, make_rate_limit_error({'retry-after': '12'})) == 12.0
+
+    def test_get_retry_after(self):
+        assert get_retry_after(make_rate_limit_error({'retry-after-ms': '1500'})) == 1.5
+        assert get_retry_after(make_rate_limit_error({'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})) is None
+        assert get_retry_after(google_exceptions.ServiceUnavailable('unavailable')) is None
+
+    def test_is_retryable_error(self):
+        """一時的なエラーとレート制限はリトライし、リクエストの誤りはリトライしないことを確認する"""
+        assert is_retryable_error(make_rate_limit_error()) is True
+        assert is_retryable_error(google_exceptions.ResourceExhausted('quota')) is True
+        assert is_retryable_error(google_exceptions.ServiceUnavailable('unavailable')) is True
+        assert is_retryable_error(google_exceptions.InvalidArgument('invalid')) is False
+        assert is_retryable_error(ValueError('invalid')) is False
+
+
+class TestCircuitBreaker:
+    """CircuitBreaker のテスト"""
+
+    def test_open_after_failures(self):
+        """連続して失敗した回数が閾値に達したら呼び出しを止めることを確認する"""
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60.0)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+
+        assert breaker.state == 'open'
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_half_open_after_timeout(self):
+        """時間が経ったら1回だけ試し、成功すれば元に戻すことを確認する"""
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+
+        breaker.before_call()
+        assert breaker.state == 'half_open'
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+        breaker.record_success()
+        assert breaker.state == 'closed'
+
+    def test_reopen_when_trial_fails(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=0.0)
+        for _ in range(3):
+            breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == 'open'
+
+
+class TestCallWithRetry:
+    """call_with_retry のテスト"""
+
+    def test_retry_transient_error(self):
+        """一時的なエラーの場合は、成功するまで呼び出し直すことを確認する"""
+        func = FlakyFunction([google_exceptions.ServiceUnavailable('a'), make_rate_limit_error()])
+        assert call_with_retry(func, NO_WAIT_POLICY) == 'ok'
+        assert func.calls == 3
+
+    def test_raise_after_max_retries(self):
+        func = FlakyFunction([google_exceptions.ServiceUnavailable(str(i)) for i in range(10)])
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            call_with_retry(func, NO_WAIT_POLICY)
+        assert func.calls == NO_WAIT_POLICY.max_retries + 1
+
+    def test_not_retry_fatal_error(self):
+        """リトライしても成功しないエラーは、すぐに送出することを確認する"""
+        func = FlakyFunction([google_exceptions.InvalidArgument('invalid')])
+        with pytest.raises(google_exceptions.InvalidArgument):
+            call_with_retry(func, NO_WAIT_POLICY)
+        assert func.calls == 1
+
+    def test_stop_calling_when_circuit_is_open(self):
+        """失敗が続いてCircuitBreakerが開いたら、呼び出さずにCircuitOpenErrorを送出することを確認する"""
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60.0)
+        func = FlakyFunction([google_exceptions.ServiceUnavailable(str(i)) for i in range(10)])
+        with pytest.raises(CircuitOpenError):
+            call_with_retry(func, NO_WAIT_POLICY, breaker)
+        assert func.calls == 2
+
+    def test_release_trial_on_fatal_error(self):
+        """試しの呼び出しがリトライしないエラーで終わった場合も、止めた状態に戻して再び試せることを確認する"""
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+
+        with pytest.raises(ValueError):
+            call_with_retry(FlakyFunction([ValueError('blocked')]), NO_WAIT_POLICY, breaker)
+        assert breaker.state == 'open'
+        assert call_with_retry(FlakyFunction([]), NO_WAIT_POLICY, breaker) == 'ok'
+        assert breaker.state == 'closed'
+
+    def test_not_count_fatal_error_as_failure(self):
+        """リトライしないエラーは、CircuitBreakerの失敗の回数に数えないことを確認する"""
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60.0)
+        with pytest.raises(google_exceptions.InvalidArgument):
+            call_with_retry(FlakyFunction([google_exceptions.InvalidArgument('invalid')]), NO_WAIT_POLICY, breaker)
+        assert breaker.state == 'closed'
+
+    def test_acall_release_trial_on_fatal_error(self):
+        """非同期の試しの呼び出しがリトライしないエラーで終わった場合も、再び試せることを確認する"""
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+
+        async def fail() -> str:
+            raise ValueError('blocked')
+
+        async def succeed() -> str:
+            return 'ok'
+
+        with pytest.raises(ValueError):
+            asyncio.run(acall_with_retry(fail, NO_WAIT_POLICY, breaker))
+        assert asyncio.run(acall_with_retry(succeed, NO_WAIT_POLICY, breaker)) == 'ok'
+
+    def test_acall_with_retry(self):
+        errors = [google_exceptions.ServiceUnavailable('a')]
+
+        async def func() -> str:
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+
+        assert asyncio.run(acall_with_retry(func, NO_WAIT_POLICY)) == 'ok'
@@ -0,0 +1,83 @@
+import time
+
+from apps.lib.llm_response_cache import (
+    MemoryLlmResponseCache,
+    SqliteLlmResponseCache,
+    TieredLlmResponseCache,
+    make_cache_key,
+)
+
+
+class TestMakeCacheKey:
+    """make_cache_key のテスト"""
+
+    messages = [{'role': 'user', 'content': 'hello'}]
+
+    def test_same_request(self):
+        """同じリクエストから同じキーを作ることを確認する"""
+        assert make_cache_key('gpt-4o', 0.0, None, self.messages) == make_cache_key('gpt-4o', 0.0, None, self.messages)
+
+    def test_different_request(self):
+        """モデル・メッセージ・出力のスキーマが異なる場合は異なるキーを作ることを確認する"""
+        key = make_cache_key('gpt-4o', 0.0, None, self.messages)
+        assert key != make_cache_key('gpt-4o-mini', 0.0, None, self.messages)
+        assert key != make_cache_key('gpt-4o', 0.0, None, [{'role': 'user', 'content': 'world'}])
+        assert key != make_cache_key('gpt-4o', 0.0, None, self.messages, {'type': 'object'})
+
+    def test_different_server(self):
+        """プロバイダや接続先が異なる場合は異なるキーを作ることを確認する"""
+        key = make_cache_key('gpt-4o', 0.0, None, self.messages, provider='openai')
+        assert key != make_cache_key('gpt-4o', 0.0, None, self.messages, provider='gemini')
+        assert key != make_cache_key('gpt-4o', 0.0, None, self.messages, provider='openai', base_url='http://127.0.0.1:8000/v1')
+
+
+class TestMemoryLlmResponseCache:
+    """MemoryLlmResponseCache のテスト"""
+
+    def test_evict_least_recently_used(self):
+        """上限を超えた場合に、最も古く使ったレスポンスから破棄することを確認する"""
+        cache = MemoryLlmResponseCache(max_size=2)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        assert cache.get('a') == 'A'
+        cache.set('c', 'C')
+
+        assert cache.get('b') is None
+        assert cache.get('a') == 'A'
+        assert cache.get('c') == 'C'
+        assert len(cache) == 2
+
+
+class TestSqliteLlmResponseCache:
+    """SqliteLlmResponseCache のテスト"""
+
+    def test_persist(self, tmp_path):
+        """保存したレスポンスを、別のインスタンスからも取得できることを確認する"""
+        file_path = str(tmp_path / 'cache' / 'responses.sqlite3')
+        cache = SqliteLlmResponseCache(file_path)
+        cache.set('key', 'value')
+        cache.close()
+
+        assert SqliteLlmResponseCache(file_path).get('key') == 'value'
+        assert SqliteLlmResponseCache(file_path).get('missing') is None
+
+    def test_expired(self, tmp_path):
+        """期限が切れたレスポンスを返さないことを確認する"""
+        cache = SqliteLlmResponseCache(str(tmp_path / 'responses.sqlite3'), ttl=0.01)
+        cache.set('key', 'value')
+        time.sleep(0.05)
+        assert cache.get('key') is None
+
+
+class TestTieredLlmResponseCache:
+    """TieredLlmResponseCache のテスト"""
+
+    def test_backfill(self, tmp_path):
+        """後ろのキャッシュで見つかったレスポンスを、前のキャッシュにも保存することを確認する"""
+        memory_cache = MemoryLlmResponseCache()
+        sqlite_cache = SqliteLlmResponseCache(str(tmp_path / 'responses.sqlite3'))
+        sqlite_cache.set('key', 'value')
+        cache = TieredLlmResponseCache([memory_cache, sqlite_cache])
+
+        assert cache.get('key') == 'value'
+        assert memory_cache.get('key') == 'value'
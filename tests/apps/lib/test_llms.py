@@ -0,0 +1,290 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pydantic import BaseModel
+
+from apps.lib.llm_ledger import LlmLedger, llm_stage
+from apps.lib.llm_resilience import RetryPolicy, circuit_breakers
+from apps.lib.llm_response_cache import MemoryLlmResponseCache
+from apps.lib.llms import (
+    LlmClientPool,
+    LlmMessage,
+    LlmMessages,
+    LlmModelEnum,
+    OpenAiClient,
+    llm_client_pool,
+    merge_continuation,
+)
+
+
+class MockOpenAiHandler(BaseHTTPRequestHandler):
+    """テスト用のOpenAIのChat Completions APIのリクエストハンドラ"""
+
+    protocol_version = 'HTTP/1.1'
+    # リクエストを受け付けた接続元のアドレス
+    client_addresses: list[tuple[str, int]] = []
+    # レスポンスを返すまでの時間(秒)
+    delay = 0.0
+    # 受け付けたリクエスト
+    requests: list[dict] = []
+    # 指定した場合は、先頭から順に(出力, finish_reason)を返す
+    responses: list[tuple[str, str]] = []
+    # 503を返すモデル
+    failing_models: set[str] = set()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.client_addresses.append(self.client_address)
+        self.requests.append(request)
+        time.sleep(self.delay)
+        if request['model'] in self.failing_models:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        finish_reason = 'stop'
+        if self.responses:
+            content, finish_reason = self.responses.pop(0)
+        elif 'response_format' in request:
+            content = json.dumps({'name': 'parsed', 'score': 3})
+        else:
+            content = f"echo: {request['messages'][-1]['content']}"
+        body = json.dumps(
+            {
+                'id': 'chatcmpl-test',
+                'object': 'chat.completion',
+                'created': 0,
+                'model': request['model'],
+                'choices': [
+                    {
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': content},
+                        'finish_reason': finish_reason,
+                    }
+                ],
+                'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Answer(BaseModel):
+    name: str
+    score: int
+
+
+class TestOpenAiClient:
+    """OpenAiClient のテスト"""
+
+    def setup_class(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockOpenAiHandler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def teardown_class(self):
+        llm_client_pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def setup_method(self):
+        MockOpenAiHandler.client_addresses = []
+        MockOpenAiHandler.delay = 0.0
+        MockOpenAiHandler.requests = []
+        MockOpenAiHandler.responses = []
+        MockOpenAiHandler.failing_models = set()
+        circuit_breakers.clear()
+
+    def test_generate_text_reuses_connection(self):
+        """同じクライアントを使い回し、接続を維持したまま続けてリクエストできることを確認する"""
+        client = OpenAiClient(api_key='test', base_url=self.base_url)
+        assert client.generate_text('hello') == 'echo: hello'
+        assert client.generate_text('world') == 'echo: world'
+
+        assert llm_client_pool.get_openai('test', self.base_url) is llm_client_pool.get_openai('test', self.base_url)
+        assert len(set(MockOpenAiHandler.client_addresses)) == 1
+
+    def test_agenerate_text_concurrently(self):
+        """非同期のAPIで複数のリクエストを同時に送れることを確認する"""
+        MockOpenAiHandler.delay = 0.3
+        client = OpenAiClient(api_key='test', base_url=self.base_url)
+
+        async def generate_all() -> list[str]:
+            return await asyncio.gather(*(client.agenerate_text(f'prompt {i}') for i in range(5)))
+
+        started_at = time.monotonic()
+        outputs = asyncio.run(generate_all())
+
+        assert outputs == [f'echo: prompt {i}' for i in range(5)]
+        assert time.monotonic() - started_at < 5 * MockOpenAiHandler.delay
+
+    def test_agenerate_pydantic(self):
+        """非同期のAPIでPydanticのモデルに構造化できることを確認する"""
+        client = OpenAiClient(api_key='test', base_url=self.base_url)
+        answer = asyncio.run(client.agenerate_pydantic(Answer, 'answer'))
+        assert answer == Answer(name='parsed', score=3)
+
+    def test_cache_deterministic_response(self):
+        """温度が0の同じリクエストはキャッシュから返し、APIを呼ばないことを確認する"""
+        client = OpenAiClient(api_key='test', base_url=self.base_url, cache=MemoryLlmResponseCache())
+        assert client.generate_text('cached', temp=0.0) == 'echo: cached'
+        assert client.generate_text('cached', temp=0.0) == 'echo: cached'
+        assert client.generate_pydantic(Answer, 'cached', temp=0.0) == Answer(name='parsed', score=3)
+        assert client.generate_pydantic(Answer, 'cached', temp=0.0) == Answer(name='parsed', score=3)
+        assert len(MockOpenAiHandler.client_addresses) == 2
+
+    def test_not_cache_sampled_response(self):
+        """温度が0以外のリクエストはキャッシュしないことを確認する"""
+        client = OpenAiClient(api_key='test', base_url=self.base_url, cache=MemoryLlmResponseCache())
+        client.generate_text('sampled', temp=0.7)
+        client.generate_text('sampled', temp=0.7)
+        assert len(MockOpenAiHandler.client_addresses) == 2
+
+    def test_generate_text_continuation(self):
+        """長さの上限で途切れた場合に、出力の末尾だけを送って続きを生成し、重複を取り除いて連結することを確認する"""
+        MockOpenAiHandler.responses = [('def f():\n    return 1\n', 'length'), ('    return 1\ndef g():\n', 'stop')]
+        client = OpenAiClient(api_key='test', base_url=self.base_url, continuation_tail_chars=10)
+
+        assert client.generate_text('code') == 'def f():\n    return 1\ndef g():\n'
+        assert len(MockOpenAiHandler.requests) == 2
+        messages = MockOpenAiHandler.requests[1]['messages']
+        assert messages[0] == {'role': 'user', 'content': 'code'}
+        assert messages[1] == {'role': 'assistant', 'content': ' return 1\n'}
+        assert len(messages) == 3
+
+    def test_generate_text_continuation_limit(self):
+        """続きの生成の回数が上限に達した場合は、そこまでの出力を返し、キャッシュしないことを確認する"""
+        MockOpenAiHandler.responses = [(f'part {i}\n', 'length') for i in range(5)]
+        cache = MemoryLlmResponseCache()
+        client = OpenAiClient(api_key='test', base_url=self.base_url, max_continuations=2, cache=cache, ledger=None)
+
+        assert client.generate_text('code', temp=0.0) == 'part 0\npart 1\npart 2\n'
+        assert len(MockOpenAiHandler.requests) == 3
+        assert len(cache) == 0
+
+    def test_failover_to_fallback_model(self):
+        """指定したモデルがリトライしても失敗する場合は、次のモデルで生成し、キャッシュしないことを確認する"""
+        MockOpenAiHandler.failing_models = {'gpt-4o-mini'}
+        cache = MemoryLlmResponseCache()
+        client = OpenAiClient(
+            api_key='test',
+            base_url=self.base_url,
+            cache=cache,
+            retry_policy=RetryPolicy(max_retries=1, initial_delay=0.0, jitter=0.0),
+            fallback_models=[LlmModelEnum.GPT4O],
+        )
+
+        assert client.generate_text('hello', llm_model=LlmModelEnum.GPT4O_MINI, temp=0.0) == 'echo: hello'
+        assert [request['model'] for request in MockOpenAiHandler.requests] == ['gpt-4o-mini', 'gpt-4o-mini', 'gpt-4o']
+        assert len(cache) == 0
+
+    def test_record_usage_in_ledger(self):
+        """呼び出しごとにモデル・トークン数・料金を記録し、キャッシュから返した呼び出しも区別して記録することを確認する"""
+        ledger = LlmLedger()
+        client = OpenAiClient(api_key='test', base_url=self.base_url, cache=MemoryLlmResponseCache(), ledger=ledger)
+        with llm_stage('analysis'):
+            client.generate_text('hello', llm_model=LlmModelEnum.GPT4O, temp=0.0)
+            client.generate_text('hello', llm_model=LlmModelEnum.GPT4O, temp=0.0)
+
+        first, second = ledger.records
+        assert (first.stage, first.model, first.prompt_tokens, first.completion_tokens) == ('analysis', 'gpt-4o', 1, 1)
+        assert first.cost == (2.5 + 10.0) / 1_000_000
+        assert first.cached is False
+        assert (second.prompt_tokens, second.cached) == (0, True)
+
+
+class TestMergeContinuation:
+    """merge_continuation のテスト"""
+
+    def test_remove_overlap(self):
+        """続きの先頭が、これまでの出力の末尾を繰り返している場合は重複を取り除くことを確認する"""
+        assert merge_continuation('first line\nsecond line of', 'second line of text\nthird') == (
+            'first line\nsecond line of text\nthird'
+        )
+
+    def test_keep_short_match(self):
+        """最短の文字数に満たない一致は、重複とみなさないことを確認する"""
+        assert merge_continuation('a = (1, 2)', ')\nb = 3') == 'a = (1, 2))\nb = 3'
+
+    def test_remove_reopened_code_block(self):
+        """コードブロックの途中で途切れた場合に、続きがコードブロックを開き直した行を取り除くことを確認する"""
+        output = merge_continuation('```python\nx = 1\n', '```python\ny = 2\n```')
+        assert output == '```python\nx = 1\ny = 2\n```'
+
+    def test_empty_output(self):
+        assert merge_continuation('', 'text') == 'text'
+
+
+class TestLlmClientPool:
+    """LlmClientPool のテスト"""
+
+    def test_get_async_openai_per_event_loop(self):
+        """非同期のクライアントをイベントループごとに作り、同じループでは使い回すことを確認する"""
+        pool = LlmClientPool()
+
+        async def get_clients():
+            return pool.get_async_openai('test'), pool.get_async_openai('test')
+
+        first, second = asyncio.run(get_clients())
+        assert first is second
+        other, _ = asyncio.run(get_clients())
+        assert other is not first
+
+    def test_get_gemini_model(self):
+        """同じモデル名とシステム指示のGenerativeModelを使い回し、上限を超えると古いものから破棄することを確認する"""
+        pool = LlmClientPool(max_gemini_models=2)
+        model = pool.get_gemini_model('models/gemini-1.5-flash-002', system_instruction='system')
+
+        assert pool.get_gemini_model('models/gemini-1.5-flash-002', system_instruction='system') is model
+        assert pool.get_gemini_model('models/gemini-1.5-flash-002') is not model
+
+        pool.get_gemini_model('models/gemini-1.5-pro-002')
+        assert pool.get_gemini_model('models/gemini-1.5-flash-002', system_instruction='system') is not model
+
+
+class TestLlmMessages:
+    """LlmMessages のテスト"""
+
+    def test_format_openai_puts_cached_prefix_first(self):
+        """キャッシュさせるメッセージを、システム指示よりも前の共通のプレフィックスにすることを確認する"""
+        messages = LlmMessages(
+            messages=[
+                LlmMessage(role='system', content='system'),
+                LlmMessage(role='user', content='code', cache=True),
+                LlmMessage(role='user', content='question'),
+            ]
+        )
+        assert messages.format_openai() == [
+            {'role': 'user', 'content': 'code'},
+            {'role': 'system', 'content': 'system'},
+            {'role': 'user', 'content': 'question'},
+        ]
+
+    def test_cache_key_ignores_cache_flag(self):
+        """プレフィックスのキャッシュの指定は出力に影響しないため、レスポンスのキャッシュのキーに含めないことを確認する"""
+        client = OpenAiClient(cache=MemoryLlmResponseCache())
+        cached = LlmMessages(messages=[LlmMessage(role='user', content='code', cache=True)])
+        not_cached = LlmMessages(messages=[LlmMessage(role='user', content='code')])
+        assert client.get_cache_key(cached, LlmModelEnum.GPT4O_MINI, 0.0, None) == client.get_cache_key(
+            not_cached, LlmModelEnum.GPT4O_MINI, 0.0, None
+        )
+
+    def test_cache_key_includes_base_url(self):
+        """同じモデル名でも、接続先のサーバーが違う場合はレスポンスのキャッシュを共有しないことを確認する"""
+        messages = LlmMessages(messages=[LlmMessage(role='user', content='code')])
+        cache = MemoryLlmResponseCache()
+        key = OpenAiClient(cache=cache).get_cache_key(messages, LlmModelEnum.GPT4O_MINI, 0.0, None)
+        local_key = OpenAiClient(cache=cache, base_url='http://127.0.0.1:8000/v1').get_cache_key(
+            messages, LlmModelEnum.GPT4O_MINI, 0.0, None
+        )
+        assert key != local_key
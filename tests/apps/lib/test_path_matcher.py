@@ -0,0 +1,66 @@
+from apps.lib.path_matcher import PathMatcher, PrefixTrie
+
+
+class TestPrefixTrie:
+    """PrefixTrie のテスト"""
+
+    def test_has_prefix_of(self):
+        """いずれかの接頭辞で始まるかを判定できることを確認する"""
+        trie = PrefixTrie(["/src/lib/", "/src/app"])
+        assert trie.has_prefix_of("/src/lib/utils.py")
+        assert trie.has_prefix_of("/src/app")
+        assert trie.has_prefix_of("/src/apps/main.py")
+        assert not trie.has_prefix_of("/src/li")
+        assert not trie.has_prefix_of("/tests/lib/utils.py")
+
+    def test_empty_prefix(self):
+        """空の接頭辞は全ての文字列に一致することを確認する"""
+        assert PrefixTrie([""]).has_prefix_of("anything")
+        assert not PrefixTrie().has_prefix_of("anything")
+
+
+class TestPathMatcher:
+    """PathMatcher のテスト"""
+
+    def test_matches(self):
+        """接頭辞・部分一致・glob・正規表現のいずれかに一致するかを判定できることを確認する"""
+        matcher = PathMatcher(
+            prefixes=["https://example.com/docs/"],
+            substrings=["/private/"],
+            globs=["*.pdf"],
+            regexes=[r"/v\d+/"],
+        )
+        assert matcher.matches("https://example.com/docs/a")
+        assert matcher.matches("https://example.com/blog/private/a")
+        assert matcher.matches("https://example.com/file.pdf")
+        assert matcher.matches("https://example.com/api/v2/users")
+        assert not matcher.matches("https://example.com/blog/a")
+        assert not matcher.matches("https://example.com/file.pdf.html")
+
+    def test_from_rules(self):
+        """文字列のルールを種類ごとに振り分けて作成できることを確認する"""
+        matcher = PathMatcher.from_rules(["/src/lib", "*/test_*.py", r"re:\.tmp$"])
+        assert matcher.matches("/src/lib/utils.py")
+        assert matcher.matches("/src/apps/test_main.py")
+        assert matcher.matches("/src/apps/cache.tmp")
+        assert not matcher.matches("/root/src/lib/utils.py")
+
+        substring_matcher = PathMatcher.from_rules(["/lib/"], literal="substring")
+        assert substring_matcher.matches("/root/src/lib/utils.py")
+
+    def test_from_rules_question_mark(self):
+        """?だけを含むルールはglobとして扱わず、"glob:" を付けたルールはglobとして扱うことを確認する"""
+        matcher = PathMatcher.from_rules(["https://example.com/search?q=1"], literal="substring")
+        assert matcher.matches("https://example.com/search?q=1&page=2")
+        assert not matcher.matches("https://example.com/searchXq=1")
+
+        glob_matcher = PathMatcher.from_rules(["glob:/src/v?/*"])
+        assert glob_matcher.matches("/src/v1/main.py")
+        assert not glob_matcher.matches("/src/v10/main.py")
+
+    def test_empty(self):
+        """ルールが無い場合は何にも一致しないことを確認する"""
+        matcher = PathMatcher()
+        assert not matcher
+        assert not matcher.matches("/src/lib/utils.py")
+        assert PathMatcher(prefixes=["/src"])
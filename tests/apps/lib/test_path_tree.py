@@ -92,3 +92,72 @@ class TestPathTree:
         url_tree = PathTree(urls)
 
         assert url_tree.root_path is None
+
+    def test_add_paths(self):
+        """パスを1つずつ追加しても、まとめて渡した場合と同じ木構造になることを確認する"""
+        path_tree = PathTree([])
+        for path in self.paths:
+            path_tree.add(path)
+
+        expected = PathTree(self.paths)
+        assert path_tree.root_path == expected.root_path
+        assert path_tree.get_tree_layout() == expected.get_tree_layout()
+
+    def test_add_urls(self):
+        """URLを1つずつ追加しても、まとめて渡した場合と同じ木構造になることを確認する"""
+        url_tree = PathTree(self.urls[:2])
+        for url in self.urls[2:]:
+            url_tree.add(url)
+
+        assert url_tree.root_path == 'example.com'
+        assert url_tree.get_tree_layout() == PathTree(self.urls).get_tree_layout()
+
+        url_tree.add('http://example.net/foo')
+        assert url_tree.root_path is None
+        assert url_tree.get_tree_layout().endswith('example.net\n└── foo\n')
+
+    def test_get_tree_layout_with_prefix(self):
+        """木構造を指定せずに、接頭辞を付けたりルート以外として表示したりできることを確認する"""
+        url_tree = PathTree(self.urls)
+        layout = url_tree.get_tree_layout()
+        assert url_tree.get_tree_layout(prefix='> ') == f'> {layout}'
+        assert url_tree.get_tree_layout(is_root=False) == '└── example.com\n' + ''.join(
+            f'    {line}\n' for line in layout.splitlines()[1:]
+        )
+        assert url_tree.get_tree_layout() == layout
+
+    def test_compact_tree_layout(self):
+        """子が1つだけのディレクトリをまとめ、ファイル数とトークン数を付けて簡略表示できることを確認する"""
+        paths = [
+            '/project/src/app/core/main.py',
+            '/project/src/app/core/util.py',
+            '/project/docs/a.md',
+            '/project/docs/b.md',
+            '/project/docs/c.md',
+        ]
+        path_tree = PathTree(paths, sizes={path: 100 for path in paths})
+
+        assert path_tree.get_compact_tree_layout(max_entries=2) == (
+            'project/ (5 files, 500 tokens)\n'
+            '├── src/app/core/ (2 files, 200 tokens)\n'
+            '│   ├── main.py (100 tokens)\n'
+            '│   └── util.py (100 tokens)\n'
+            '└── docs/ (3 files, 300 tokens)\n'
+            '    ├── a.md (100 tokens)\n'
+            '    ├── b.md (100 tokens)\n'
+            '    └── ... 1 more (1 file, 100 tokens)\n'
+        )
+
+    def test_compact_tree_layout_with_max_tokens(self):
+        """トークン数の上限に収まるまで表示する階層を浅くすることを確認する"""
+        path_tree = PathTree(self.paths)
+
+        def count_words(text: str) -> int:
+            return len(text.split())
+
+        layout = path_tree.get_compact_tree_layout(max_tokens=11, token_counter=count_words)
+        assert layout == 'user/ (7 files)\n├── documents/ (1 file)\n└── pictures/ (6 files)\n'
+
+        # 上限に収まる場合は省略せずに表示する
+        tree_map = path_tree.get_tree_map(max_tokens=1000, token_counter=count_words)
+        assert path_tree.get_tree_layout() in tree_map
@@ -0,0 +1,67 @@
+import pytest
+
+from apps.lib.llms import LlmModelEnum
+from apps.lib.prompt_builder import TRUNCATED_MARKER, PromptBuilder, trim_text_to_tokens
+
+
+def count_chars(text: str) -> int:
+    """テスト用に1文字を1トークンとして数える"""
+    return len(text)
+
+
+class TestTrimTextToTokens:
+    """trim_text_to_tokens のテスト"""
+
+    def test_not_trimmed(self):
+        """上限に収まる場合はそのまま返すことを確認する"""
+        assert trim_text_to_tokens('abc', 3, count_chars) == 'abc'
+
+    def test_trim_file_blocks(self):
+        """連結したコードは、末尾のファイルから丸ごと削ることを確認する"""
+        text = '\n### a.py\nA\n\n### b.py\nB\n\n### c.py\nC\n'
+        trimmed = trim_text_to_tokens(text, 30, count_chars)
+        assert trimmed == '\n### a.py\nA\n' + TRUNCATED_MARKER
+        assert len(trimmed) <= 30
+
+    def test_truncate_single_block(self):
+        """1つのブロックも収まらない場合は末尾を切り詰めることを確認する"""
+        trimmed = trim_text_to_tokens('x' * 1000, 100, count_chars)
+        assert trimmed.endswith(TRUNCATED_MARKER)
+        assert 0 < len(trimmed) <= 100
+
+
+class TestPromptBuilder:
+    """PromptBuilder のテスト"""
+
+    def make_prompt_builder(self) -> PromptBuilder:
+        model = LlmModelEnum.GPT4O_MINI.value
+        # セクションに使えるトークン数が100になるように空けておく
+        reserved_tokens = model.context_window - model.max_tokens - 100
+        return PromptBuilder(LlmModelEnum.GPT4O_MINI, reserved_tokens=reserved_tokens, token_counter=count_chars)
+
+    def test_fit_without_trimming(self):
+        """上限に収まる場合はセクションを削らないことを確認する"""
+        prompt_builder = self.make_prompt_builder().add_section('a', 'x' * 40).add_section('b', 'y' * 40)
+        assert prompt_builder.max_tokens == 100
+        assert prompt_builder.fit() == {'a': 'x' * 40, 'b': 'y' * 40}
+
+    def test_trim_low_priority_section_first(self):
+        """優先度の低いセクションから削り、上限に収めることを確認する"""
+        prompt_builder = (
+            self.make_prompt_builder()
+            .add_section('conventions', 'c' * 30, priority=3, trimmable=False)
+            .add_section('target_code', 't' * 40, priority=2)
+            .add_section('code', 'r' * 100, priority=0)
+        )
+        sections = prompt_builder.fit()
+
+        assert sections['conventions'] == 'c' * 30
+        assert sections['target_code'] == 't' * 40
+        assert len(sections['code']) <= 30
+        assert prompt_builder.total_tokens <= prompt_builder.max_tokens
+
+    def test_exceed_untrimmable_sections(self):
+        """削れないセクションだけで上限を超える場合はエラーになることを確認する"""
+        prompt_builder = self.make_prompt_builder().add_section('conventions', 'c' * 200, trimmable=False)
+        with pytest.raises(ValueError, match='context window'):
+            prompt_builder.fit()
@@ -0,0 +1,64 @@
+import time
+from email.utils import formatdate
+
+from apps.lib.rate_limiter import HostRateLimiter, parse_retry_after
+
+
+class TestParseRetryAfter:
+    """parse_retry_after のテスト"""
+
+    def test_seconds(self):
+        """秒数のRetry-Afterを変換できることを確認する"""
+        assert parse_retry_after("120") == 120.0
+
+    def test_http_date(self):
+        """HTTP日付のRetry-Afterを変換できることを確認する"""
+        wait_seconds = parse_retry_after(formatdate(time.time() + 60, usegmt=True))
+        assert wait_seconds is not None and 55 < wait_seconds <= 60
+
+    def test_invalid(self):
+        """不正な値や空の値はNoneになることを確認する"""
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+
+
+class TestHostRateLimiter:
+    """HostRateLimiter のテスト"""
+
+    def test_acquire_within_burst(self):
+        """バースト内のリクエストは待機しないことを確認する"""
+        rate_limiter = HostRateLimiter(rate=1.0, burst=2.0)
+        assert rate_limiter.acquire("https://example.com/a") == 0.0
+        assert rate_limiter.acquire("https://example.com/b") == 0.0
+
+    def test_acquire_waits_over_rate(self):
+        """レートを超えたリクエストは待機することを確認する"""
+        rate_limiter = HostRateLimiter(rate=50.0, burst=1.0)
+        rate_limiter.acquire("https://example.com/a")
+        assert rate_limiter.acquire("https://example.com/b") > 0.0
+        # 別のホストは待機しない
+        assert rate_limiter.acquire("https://example.org/a") == 0.0
+
+    def test_backoff_on_throttle(self):
+        """429の場合にレートを下げ、Retry-Afterの間ブロックすることを確認する"""
+        rate_limiter = HostRateLimiter(rate=10.0, decrease_factor=0.5)
+        rate_limiter.on_response("https://example.com/a", 429, retry_after="30")
+        state = rate_limiter.hosts["example.com"]
+        assert state.bucket.rate == 5.0
+        assert state.blocked_until - time.monotonic() > 25
+
+    def test_recover_on_success(self):
+        """成功した場合に最大レートまでレートを戻すことを確認する"""
+        rate_limiter = HostRateLimiter(rate=1.0, decrease_factor=0.5, increase_step=0.3)
+        rate_limiter.on_response("https://example.com/a", 503, retry_after="0")
+        rate_limiter.on_response("https://example.com/a", 200)
+        assert rate_limiter.hosts["example.com"].bucket.rate == 0.8
+        rate_limiter.on_response("https://example.com/a", 200)
+        assert rate_limiter.hosts["example.com"].bucket.rate == 1.0
+
+    def test_set_max_rate(self):
+        """Crawl-delayなどでホストの最大レートを下げられることを確認する"""
+        rate_limiter = HostRateLimiter(rate=10.0)
+        rate_limiter.set_max_rate("https://example.com/a", 0.5)
+        rate_limiter.on_response("https://example.com/a", 200)
+        assert rate_limiter.hosts["example.com"].bucket.rate == 0.5
@@ -0,0 +1,151 @@
+import gzip
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from apps.lib.rate_limiter import HostRateLimiter
+from apps.lib.site_discoverer import SiteDiscoverer, parse_robots, parse_sitemap
+
+urlset = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://example.com/</loc></url>
+  <url><loc> https://example.com/docs </loc><lastmod>2024-01-01</lastmod></url>
+</urlset>"""
+
+sitemap_index = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://example.com/sitemap-1.xml.gz</loc></sitemap>
+</sitemapindex>"""
+
+robots_txt = """
+User-agent: *
+Disallow: /private
+Crawl-delay: 2
+Sitemap: https://example.com/sitemap_index.xml
+"""
+
+
+class MockSitemapHandler(BaseHTTPRequestHandler):
+    """テスト用のrobots.txtとサイトマップを返すリクエストハンドラ"""
+
+    pages: dict[str, bytes] = {}
+    requested_paths: list[str] = []
+
+    def do_GET(self):
+        self.requested_paths.append(self.path)
+        # 同時に取得するスレッドが重なるように、レスポンスを少し遅らせる
+        time.sleep(0.05)
+        body = self.pages.get(self.path)
+        self.send_response(200 if body is not None else 404)
+        self.end_headers()
+        self.wfile.write(body or b"")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RecordingRateLimiter(HostRateLimiter):
+    """リクエストしたURLを記録するリミッター"""
+
+    def __init__(self):
+        super().__init__()
+        self.acquired_urls: list[str] = []
+
+    def acquire(self, url: str) -> float:
+        self.acquired_urls.append(url)
+        return super().acquire(url)
+
+
+class TestParseSitemap:
+    """parse_sitemap のテスト"""
+
+    def test_parse_urlset(self):
+        """サイトマップからページのURLを取得できることを確認する"""
+        assert parse_sitemap(urlset) == (["https://example.com/", "https://example.com/docs"], [])
+
+    def test_parse_sitemap_index(self):
+        """サイトマップインデックスから子サイトマップのURLを取得できることを確認する"""
+        assert parse_sitemap(sitemap_index) == ([], ["https://example.com/sitemap-1.xml.gz"])
+
+    def test_parse_gzip_sitemap(self):
+        """gzipで圧縮されたサイトマップを解析できることを確認する"""
+        assert parse_sitemap(gzip.compress(urlset))[0] == ["https://example.com/", "https://example.com/docs"]
+
+    def test_gzip_sitemap_over_max_bytes(self):
+        """展開後のサイズが上限を超えるgzipのサイトマップは、展開を中断することを確認する"""
+        with pytest.raises(ValueError, match="over 100 bytes"):
+            parse_sitemap(gzip.compress(b" " * 1_000_000 + urlset), max_bytes=100)
+
+
+class TestSiteDiscoverer:
+    """SiteDiscoverer のテスト"""
+
+    def setup_method(self):
+        self.discoverer = SiteDiscoverer()
+        # ネットワークにアクセスしないように、解析済みのrobots.txtを設定する
+        self.discoverer.robots["https://example.com"] = parse_robots(robots_txt)
+
+    def test_can_fetch(self):
+        """robots.txtのDisallowに従って取得可否を判定できることを確認する"""
+        assert self.discoverer.can_fetch("https://example.com/docs")
+        assert not self.discoverer.can_fetch("https://example.com/private/page")
+
+    def test_crawl_delay(self):
+        """robots.txtのCrawl-delayを取得できることを確認する"""
+        assert self.discoverer.crawl_delay("https://example.com/docs") == 2.0
+
+    def test_empty_robots_allows_all(self):
+        """robots.txtが無い場合は全てのURLを許可することを確認する"""
+        self.discoverer.robots["https://example.org"] = parse_robots("")
+        assert self.discoverer.can_fetch("https://example.org/any")
+        assert self.discoverer.crawl_delay("https://example.org/any") is None
+
+
+class TestSiteDiscovererFetch:
+    """SiteDiscoverer がrobots.txtとサイトマップを取得するテスト"""
+
+    def setup_class(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockSitemapHandler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        large_sitemap = gzip.compress(b" " * 1_000_000 + urlset)
+        MockSitemapHandler.pages = {
+            "/robots.txt": (
+                f"User-agent: *\nSitemap: {self.base_url}/sitemap.xml\nSitemap: {self.base_url}/large.xml.gz\n"
+            ).encode(),
+            "/sitemap.xml": urlset,
+            "/large.xml.gz": large_sitemap,
+        }
+
+    def teardown_class(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_discover_urls(self):
+        """robots.txtとサイトマップをレート制限に従って取得し、上限を超えるサイトマップを読み飛ばすことを確認する"""
+        rate_limiter = RecordingRateLimiter()
+        discoverer = SiteDiscoverer(rate_limiter=rate_limiter, max_content_bytes=100_000)
+        assert discoverer.discover_urls(f"{self.base_url}/docs") == ["https://example.com/", "https://example.com/docs"]
+        assert rate_limiter.acquired_urls == [
+            f"{self.base_url}/robots.txt",
+            f"{self.base_url}/sitemap.xml",
+            f"{self.base_url}/large.xml.gz",
+        ]
+
+    def test_skip_robots_over_max_bytes(self):
+        """上限を超えるrobots.txtは読み込まず、全てのURLを許可することを確認する"""
+        discoverer = SiteDiscoverer(max_content_bytes=10)
+        assert discoverer.can_fetch(f"{self.base_url}/docs")
+        assert discoverer.get_robots(f"{self.base_url}/docs").site_maps() is None
+
+    def test_fetch_robots_once_from_threads(self):
+        """複数のスレッドから同時に判定しても、robots.txtを1回だけ取得することを確認する"""
+        MockSitemapHandler.requested_paths = []
+        discoverer = SiteDiscoverer()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(discoverer.can_fetch, [f"{self.base_url}/docs/{i}" for i in range(8)]))
+        assert all(results)
+        assert MockSitemapHandler.requested_paths == ["/robots.txt"]
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from apps.lib.llm_ledger import get_llm_stage
+from apps.lib.stage_runner import Stage, StageRunner
+
+
+class TestStageRunner:
+    """StageRunner のテスト"""
+
+    def test_run(self):
+        """入力の値とステージの結果を、宣言した引数名で渡して実行できることを確認する"""
+        runner = StageRunner(
+            [
+                Stage('doubled', lambda value: value * 2, ['value']),
+                Stage('total', lambda left, right: left + right, {'left': 'value', 'right': 'doubled'}),
+            ]
+        )
+        results = runner.run({'value': 3})
+        assert results == {'value': 3, 'doubled': 6, 'total': 9}
+
+    def test_run_in_llm_stage(self):
+        """ステージの中で呼び出したLLMを、ステージの名前で記録できることを確認する"""
+        runner = StageRunner([Stage('first', get_llm_stage), Stage('second', lambda first: get_llm_stage(), ['first'])])
+        results = runner.run({})
+        assert results == {'first': 'first', 'second': 'second'}
+
+    def test_run_independent_stages_concurrently(self):
+        """互いに依存しないステージを同時に実行することを確認する"""
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_for_other(value: str) -> str:
+            # もう一方のステージが同時に実行されていない場合はタイムアウトする
+            barrier.wait()
+            return value
+
+        runner = StageRunner(
+            [
+                Stage('first', wait_for_other, {'value': 'a'}),
+                Stage('second', wait_for_other, {'value': 'b'}),
+                Stage('joined', lambda first, second: first + second, ['first', 'second']),
+            ]
+        )
+        started_at = time.monotonic()
+        assert runner.run({'a': 'A', 'b': 'B'})['joined'] == 'AB'
+        assert time.monotonic() - started_at < 5
+
+    def test_print_streamed_stage_in_order(self, monkeypatch):
+        """ストリーミングするステージの見出しを実行前に表示し、他のステージの表示が間に入らないことを確認する"""
+        printed: list[str] = []
+        monkeypatch.setattr('apps.lib.stage_runner.print_markdown', printed.append)
+        streaming = threading.Event()
+
+        def stream(value: str) -> str:
+            streaming.set()
+            printed.append('streamed')
+            # 同時に完了したステージの表示が、ストリーミングの出力の間に入らないことを確かめる
+            time.sleep(0.2)
+            printed.append('streamed')
+            return value
+
+        def analyze(value: str) -> str:
+            streaming.wait(timeout=5)
+            return value
+
+        runner = StageRunner(
+            [
+                Stage('streamed', stream, {'value': 'a'}, title='## streamed', stream=True),
+                Stage('analyzed', analyze, {'value': 'b'}, title='## analyzed'),
+            ]
+        )
+        runner.run({'a': 'A', 'b': 'B'})
+        assert printed == ['## streamed', 'streamed', 'streamed', 'A', '## analyzed', 'B']
+
+    def test_unknown_input(self):
+        """解決できない入力がある場合はエラーになることを確認する"""
+        runner = StageRunner([Stage('result', lambda missing: missing, ['missing'])])
+        with pytest.raises(ValueError, match='Unknown input'):
+            runner.run({})
+
+    def test_circular_dependency(self):
+        """依存関係が循環している場合はエラーになることを確認する"""
+        runner = StageRunner([Stage('a', lambda b: b, ['b']), Stage('b', lambda a: a, ['a'])])
+        with pytest.raises(ValueError, match='Circular dependency'):
+            runner.run({})
+
+    def test_stage_error(self):
+        """ステージで発生した例外がそのまま送出されることを確認する"""
+
+        def fail() -> None:
+            raise RuntimeError('failed')
+
+        with pytest.raises(RuntimeError, match='failed'):
+            StageRunner([Stage('result', fail)]).run({})
@@ -0,0 +1,46 @@
+import io
+
+from rich.console import Console
+
+from apps.lib.streaming_printer import StreamingPrinter
+
+MARKDOWN_TEXT = '# Title\n\nfirst paragraph\n\n```python\ndef f():\n\n    return 1\n```\n\n- a\n- b'
+
+
+def split_chunks(text: str, size: int) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+class TestStreamingPrinter:
+    """StreamingPrinter のテスト"""
+
+    def test_write_plain_text(self, capsys):
+        """マークダウンでない場合は、受け取った断片をそのまま表示し、連結したテキストを返すことを確認する"""
+        with StreamingPrinter() as printer:
+            for chunk in ['Hello', ', ', 'world']:
+                printer.write(chunk)
+
+        assert printer.get_text() == 'Hello, world'
+        assert capsys.readouterr().out == 'Hello, world'
+
+    def test_write_markdown(self):
+        """マークダウンの場合は、すべてのブロックを表示し、連結したテキストを返すことを確認する"""
+        output = io.StringIO()
+        with StreamingPrinter(markdown=True, console=Console(file=output, width=60)) as printer:
+            for chunk in split_chunks(MARKDOWN_TEXT, 3):
+                printer.write(chunk)
+
+        assert printer.get_text() == MARKDOWN_TEXT
+        rendered = output.getvalue()
+        for text in ['Title', 'first paragraph', 'def f():', 'return 1', '• a', '• b']:
+            assert rendered.count(text) == 1
+
+    def test_keep_code_block_until_closed(self):
+        """コードブロックの中の空行ではブロックを確定せず、末尾のブロックとして再描画することを確認する"""
+        printer = StreamingPrinter(markdown=True, console=Console(file=io.StringIO()))
+        with printer:
+            printer.write('intro\n\n```python\ndef f():\n\n')
+            assert printer._block_lines == ['```python', 'def f():', '']
+            printer.write('    return 1\n```\n\nrest')
+            assert printer._block_lines == []
+            assert printer._partial_line == 'rest'
@@ -0,0 +1,31 @@
+import pytest
+
+from apps.lib.url_canonicalizer import canonicalize_url, strip_query_and_fragment
+
+
+class TestUrlCanonicalizer:
+    """canonicalize_url のテスト"""
+
+    @pytest.mark.parametrize(
+        "url, expected",
+        [
+            ("https://example.com", "https://example.com"),
+            ("https://example.com/", "https://example.com"),
+            ("HTTPS://Example.COM/Docs/", "https://example.com/Docs"),
+            ("https://example.com:443/docs", "https://example.com/docs"),
+            ("http://example.com:80/docs", "http://example.com/docs"),
+            ("http://example.com:8080/docs", "http://example.com:8080/docs"),
+            ("https://example.com/docs/index.html", "https://example.com/docs"),
+            ("https://example.com/docs/INDEX.HTM?a=1#top", "https://example.com/docs"),
+            ("https://example.com//docs//guide/", "https://example.com/docs/guide"),
+            ("https://user@example.com/docs", "https://user@example.com/docs"),
+            ("http://[::1]:80/docs", "http://[::1]/docs"),
+        ],
+    )
+    def test_canonicalize_url(self, url, expected):
+        """同じページを指すURLが同じ文字列になることを確認する"""
+        assert canonicalize_url(url) == expected
+
+    def test_strip_query_and_fragment(self):
+        """クエリとフラグメントだけを除くことを確認する"""
+        assert strip_query_and_fragment("https://example.com/docs/?a=1#top") == "https://example.com/docs/"
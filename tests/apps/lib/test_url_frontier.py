@@ -0,0 +1,45 @@
+from apps.lib.url_frontier import UrlFrontier
+
+
+class TestUrlFrontier:
+    """UrlFrontier のテスト"""
+
+    def test_pop_by_depth(self):
+        """リンクの深さが浅いURLから取り出すことを確認する"""
+        frontier = UrlFrontier()
+        frontier.push("https://example.com/docs/a/b", 2)
+        frontier.push("https://example.com/docs/c", 1)
+        frontier.push("https://example.com/docs", 0)
+
+        assert frontier.pop() == ("https://example.com/docs", 0)
+        assert frontier.pop() == ("https://example.com/docs/c", 1)
+        assert frontier.pop() == ("https://example.com/docs/a/b", 2)
+        assert len(frontier) == 0
+
+    def test_pop_by_path_length(self):
+        """同じ深さの場合はパスが短いURLから、同じ長さの場合は追加した順に取り出すことを確認する"""
+        frontier = UrlFrontier()
+        frontier.push("https://example.com/docs/a/b/c", 1)
+        frontier.push("https://example.com/docs/z", 1)
+        frontier.push("https://example.com/docs/y", 1)
+
+        assert [frontier.pop()[0] for _ in range(3)] == [
+            "https://example.com/docs/z",
+            "https://example.com/docs/y",
+            "https://example.com/docs/a/b/c",
+        ]
+
+    def test_pop_by_relevance(self):
+        """キーワードを含むURLの優先度を上げることを確認する"""
+        frontier = UrlFrontier(keywords=["API", "guide"])
+        frontier.push("https://example.com/docs/blog", 1)
+        frontier.push("https://example.com/docs/reference/api-guide", 2)
+        frontier.push("https://example.com/docs/reference/api", 2)
+
+        assert frontier.relevance("https://example.com/docs/reference/api-guide") == 2
+        # キーワードの一致数だけ浅いリンクと同じ優先度になる
+        assert [frontier.pop()[0] for _ in range(3)] == [
+            "https://example.com/docs/reference/api-guide",
+            "https://example.com/docs/blog",
+            "https://example.com/docs/reference/api",
+        ]
@@ -1,4 +1,80 @@
-from apps.lib.web_crawler_scraper import WebCrawlerScraper, ScrapedData
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from apps.lib.html_extractor import HtmlExtractorLxml
+from apps.lib.web_crawler_scraper import FetchedPage, WebCrawlerScraper, ScrapedData
+
+
+class MockSiteHandler(BaseHTTPRequestHandler):
+    """テスト用のWebサイトのリクエストハンドラ"""
+
+    # パスごとの (Content-Type, 本文)
+    pages: dict[str, tuple[str | None, bytes]] = {
+        '/page': ('text/html; charset=utf-8', b'<html><body><p>Hello</p></body></html>'),
+        '/large': ('text/html', b'<html><body>' + b'x' * 5000 + b'</body></html>'),
+        '/image': ('image/png', b'\x89PNG\r\n\x1a\n'),
+        '/no-content-type': (None, b'%PDF-1.7\n'),
+        '/document.pdf': ('application/pdf', b'%PDF-1.7\n'),
+        '/head-error.foo': ('text/html', b'<html><body><p>Hello</p></body></html>'),
+        '/head-throttled.foo': ('text/html', b'<html><body><p>Hello</p></body></html>'),
+    }
+    # HEADリクエストに返すパスごとの (ステータスコード, Content-Type)
+    head_responses: dict[str, tuple[int, str]] = {
+        '/image.foo': (200, 'image/png'),
+        '/head-error.foo': (405, 'image/png'),
+        '/head-throttled.foo': (429, 'text/html'),
+    }
+
+    def do_HEAD(self):
+        status_code, content_type = self.head_responses.get(self.path, (404, 'text/html'))
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+
+    def do_GET(self):
+        content_type, body = self.pages.get(self.path, ('text/html', b''))
+        self.send_response(200 if self.path in self.pages else 404)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockLinkedSiteHandler(BaseHTTPRequestHandler):
+    """テスト用の、ページ同士がリンクしたWebサイトのリクエストハンドラ"""
+
+    # パスごとの (本文, リンク先のパス)
+    pages: dict[str, tuple[str, list[str]]] = {
+        '/docs': ('Index', ['/docs/a', '/docs/b', '/docs/c', *[f'/docs/p{i}' for i in range(10)]]),
+        '/docs/a': ('Alpha', ['/docs/b', '/docs/d', '/blog']),
+        '/docs/b': ('Beta', ['/docs/a']),
+        # /docs/b と同じ本文の重複ページ
+        '/docs/c': ('Beta', ['/docs/a']),
+        '/docs/d': ('Delta', ['/docs', '/docs/a?q=1']),
+        **{f'/docs/p{i}': (f'Page {i}', ['/docs/a']) for i in range(10)},
+    }
+
+    def do_GET(self):
+        if self.path not in self.pages:
+            self.send_response(404)
+            self.end_headers()
+            return
+        # 取得を並行して行うように、レスポンスを少し遅らせる
+        time.sleep(0.01)
+        text, links = self.pages[self.path]
+        anchors = ''.join(f'<a href="{link}">{link}</a>' for link in links)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.end_headers()
+        self.wfile.write(f'<html><body><p>{text}</p><p>{anchors}</p></body></html>'.encode())
+
+    def log_message(self, format, *args):
+        pass
 
 
 class TestWebCrawlerScraper:
@@ -57,6 +133,25 @@ class TestWebCrawlerScraper:
         assert not web_crawler_scraper.should_ignore('https://example.com')
         assert not web_crawler_scraper.should_ignore('https://no-example.org')
 
+    def test_should_ignore_patterns(self):
+        """globと正規表現のルールでURLを無視できることを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(
+            'https://example.com', ignore_urls=['https://example.com/*/archive/*', r're:/v\d+/']
+        )
+        assert web_crawler_scraper.should_ignore('https://example.com/blog/archive/2020')
+        assert web_crawler_scraper.should_ignore('https://example.com/api/v2/users')
+        assert not web_crawler_scraper.should_ignore('https://example.com/blog/2020')
+
+    def test_should_ignore_url_with_query(self):
+        """クエリ付きの無視するURLは、globとして扱わずに正規化して判定することを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(
+            'https://example.com', ignore_urls=['https://example.com/docs/search?q=1']
+        )
+        assert web_crawler_scraper.ignore_urls == {'https://example.com/docs/search'}
+        assert web_crawler_scraper.should_ignore('https://example.com/docs/search')
+        assert web_crawler_scraper.should_ignore('https://example.com/docs/search/advanced')
+        assert not web_crawler_scraper.should_ignore('https://example.com/docs')
+
     def test_get_contents(self):
         """URLからコンテンツを取得できることを確認する"""
         web_crawler_scraper = WebCrawlerScraper(
@@ -151,3 +246,256 @@ class TestWebCrawlerScraper:
         web_crawler_scraper.run()
 
         assert web_crawler_scraper.total_char_size() < 10000
+
+
+class TestWebCrawlerScraperRecord:
+    """WebCrawlerScraper.make_record のテスト"""
+
+    def test_make_record(self):
+        """スクレイプデータと取得時の情報からレコードを作成できることを確認する"""
+        scraped_data = ScrapedData(url='https://example.com/a', content='Hello', token_size=1, char_size=5)
+        fetched_page = FetchedPage(
+            url='https://example.com/a/',
+            status_code=200,
+            content_type='text/html',
+            content=b'<p>Hello</p>',
+            content_bytes=12,
+            fetched_at=0.0,
+        )
+        assert WebCrawlerScraper.make_record(scraped_data, fetched_page) == {
+            'url': 'https://example.com/a',
+            'content': 'Hello',
+            'token_size': 1,
+            'char_size': 5,
+            'final_url': 'https://example.com/a/',
+            'status_code': 200,
+            'content_type': 'text/html',
+            'content_bytes': 12,
+            'fetched_at': '1970-01-01T00:00:00+00:00',
+        }
+
+    def test_make_record_without_fetched_page(self):
+        """取得時の情報が無い場合もNoneを含まないレコードを作成できることを確認する"""
+        scraped_data = ScrapedData(url='https://example.com/a', content='Hello', token_size=1, char_size=5)
+        record = WebCrawlerScraper.make_record(scraped_data, None)
+        assert record['final_url'] == 'https://example.com/a'
+        assert record['content_type'] == ''
+        assert None not in record.values()
+
+
+class TestWebCrawlerScraperStages:
+    """WebCrawlerScraper の探索の各段階のテスト"""
+
+    def test_start_exploring(self):
+        """探索するURLだけを探索済みにして返すことを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(
+            'https://example.com/docs', ignore_urls=['https://example.com/docs/private'], visited_urls=set()
+        )
+        assert web_crawler_scraper.start_exploring('https://example.com/docs/a?q=1') == 'https://example.com/docs/a'
+        assert web_crawler_scraper.start_exploring('https://example.com/docs/a') is None
+        assert web_crawler_scraper.start_exploring('https://example.com/blog') is None
+        assert web_crawler_scraper.start_exploring('https://example.com/docs/private/a') is None
+        assert web_crawler_scraper.visited_urls == {'https://example.com/docs/a'}
+
+    def test_process_page(self):
+        """解析済みのページをスクレイプデータに追加し、リンクを探索候補に追加することを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(
+            'https://example.com/docs', scraped_data=[], found_urls=set(), visited_urls=set()
+        )
+        page = HtmlExtractorLxml().extract(b'<p>Hello</p><a href="b">B</a><a href="/blog">Blog</a>')
+        fetched_page = FetchedPage(url='https://example.com/docs/a', status_code=200, content_type='text/html', content=b'')
+        web_crawler_scraper.process_page('https://example.com/docs/a', 1, fetched_page, page, token_size=2)
+
+        assert web_crawler_scraper.scraped_data == [
+            ScrapedData(url='https://example.com/docs/a', content='Hello B Blog', token_size=2, char_size=12, blocks=['Hello', 'B Blog'])
+        ]
+        assert web_crawler_scraper.found_urls == {'https://example.com/docs/b'}
+        assert web_crawler_scraper.frontier.pop() == ('https://example.com/docs/b', 2)
+
+
+class TestWebCrawlerScraperDuplicate:
+    """WebCrawlerScraper の重複ページの検出のテスト"""
+
+    def make_scraper(self) -> WebCrawlerScraper:
+        return WebCrawlerScraper('https://example.com/docs/', scraped_data=[], found_urls=set(), visited_urls=set())
+
+    def make_fetched_page(self, url: str) -> FetchedPage:
+        return FetchedPage(url=url, status_code=200, content_type='text/html', content=b'')
+
+    def test_is_subpath_boundary(self):
+        """ルートURLのパスの区切りでサブパスを判定することを確認する"""
+        web_crawler_scraper = self.make_scraper()
+        assert web_crawler_scraper.is_subpath('https://example.com/docs')
+        assert web_crawler_scraper.is_subpath('https://example.com/docs/a')
+        assert not web_crawler_scraper.is_subpath('https://example.com/docs-old')
+
+    def test_add_found_url(self):
+        """正規化したURLで探索候補に追加し、最初に見つけた形式のURLをリクエストすることを確認する"""
+        web_crawler_scraper = self.make_scraper()
+        assert web_crawler_scraper.add_found_url('https://EXAMPLE.com:443/docs/a/?q=1', 1) == 'https://example.com/docs/a'
+        assert web_crawler_scraper.add_found_url('https://example.com/docs/a/index.html', 1) is None
+        assert web_crawler_scraper.request_urls['https://example.com/docs/a'] == 'https://EXAMPLE.com:443/docs/a/'
+        assert web_crawler_scraper.request_urls['https://example.com/docs'] == 'https://example.com/docs/'
+
+    def test_relative_links_from_response_url(self):
+        """相対リンクをリダイレクト後のURLを基準に解決することを確認する"""
+        web_crawler_scraper = self.make_scraper()
+        page = HtmlExtractorLxml().extract(b'<p>Guide</p><a href="b">B</a>')
+        fetched_page = self.make_fetched_page('https://example.com/docs/guide/')
+        web_crawler_scraper.process_page('https://example.com/docs/guide', 1, fetched_page, page, token_size=1)
+        assert web_crawler_scraper.found_urls == {'https://example.com/docs/guide/b'}
+
+    def test_duplicate_canonical_url(self):
+        """<link rel="canonical"> のURLを探索済みにし、同じURLのページを重複として除くことを確認する"""
+        web_crawler_scraper = self.make_scraper()
+        page = HtmlExtractorLxml().extract(b'<link rel="canonical" href="/docs/a"><p>A</p>')
+        web_crawler_scraper.visited_urls.add('https://example.com/docs/a-print')
+        web_crawler_scraper.process_page(
+            'https://example.com/docs/a-print', 1, self.make_fetched_page('https://example.com/docs/a-print'), page, token_size=1
+        )
+        assert 'https://example.com/docs/a' in web_crawler_scraper.visited_urls
+        assert len(web_crawler_scraper.scraped_data) == 1
+
+        page = HtmlExtractorLxml().extract(b'<link rel="canonical" href="/docs/a"><p>A copy</p>')
+        web_crawler_scraper.process_page(
+            'https://example.com/docs/b', 1, self.make_fetched_page('https://example.com/docs/b'), page, token_size=1
+        )
+        assert len(web_crawler_scraper.scraped_data) == 1
+
+    def test_duplicate_content(self):
+        """本文が同じページを重複として除くことを確認する"""
+        web_crawler_scraper = self.make_scraper()
+        for url in ['https://example.com/docs/a', 'https://example.com/docs/b']:
+            page = HtmlExtractorLxml().extract(b'<p>Same content</p>')
+            web_crawler_scraper.process_page(url, 1, self.make_fetched_page(url), page, token_size=1)
+        assert [data.url for data in web_crawler_scraper.scraped_data] == ['https://example.com/docs/a']
+
+
+class TestWebCrawlerScraperFetchPage:
+    """WebCrawlerScraper.fetch_page のテスト"""
+
+    def setup_class(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockSiteHandler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def teardown_class(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_html(self):
+        """HTMLのコンテンツを取得できることを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url)
+        fetched_page = web_crawler_scraper.fetch_page(f'{self.base_url}/page')
+        assert fetched_page is not None
+        assert fetched_page.content_type == 'text/html'
+        assert fetched_page.content == b'<html><body><p>Hello</p></body></html>'
+
+    def test_skip_not_allowed_content_type(self):
+        """許可されていないContent-Typeのコンテンツを取得しないことを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url)
+        assert web_crawler_scraper.fetch_page(f'{self.base_url}/image') is None
+
+    def test_skip_sniffed_content_type(self):
+        """Content-Typeが無い場合に本文の先頭から判定して取得しないことを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url)
+        assert web_crawler_scraper.fetch_page(f'{self.base_url}/no-content-type') is None
+
+    def test_skip_over_max_content_bytes(self):
+        """最大サイズを超えるコンテンツの取得を中断することを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url, max_content_bytes=1000)
+        assert web_crawler_scraper.fetch_page(f'{self.base_url}/large') is None
+
+    def test_skip_error_status(self):
+        """200以外のステータスコードの場合に取得しないことを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url)
+        assert web_crawler_scraper.fetch_page(f'{self.base_url}/not-found') is None
+
+    def test_skip_not_allowed_content_type_by_head(self):
+        """HEADリクエストで許可されていないContent-Typeと分かった場合は、本文を取得しないことを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url)
+        assert web_crawler_scraper.fetch_page(f'{self.base_url}/image.foo') is None
+        assert web_crawler_scraper.metrics.status_codes == {200: 1}
+
+    def test_ignore_head_error_status(self):
+        """HEADリクエストが失敗した場合は、そのContent-Typeで判定せずに本文を取得することを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url)
+        fetched_page = web_crawler_scraper.fetch_page(f'{self.base_url}/head-error.foo')
+        assert fetched_page is not None
+        assert fetched_page.content_type == 'text/html'
+        assert web_crawler_scraper.metrics.status_codes == {405: 1, 200: 1}
+
+    def test_back_off_on_throttled_head(self):
+        """HEADリクエストが429を返した場合も、ホストのレートを下げることを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url, max_retries=0)
+        assert web_crawler_scraper.fetch_page(f'{self.base_url}/head-throttled.foo') is not None
+        assert web_crawler_scraper.metrics.status_codes == {429: 1, 200: 1}
+        host_state = web_crawler_scraper.rate_limiter.get_host_state(self.base_url)
+        assert host_state.bucket.rate < web_crawler_scraper.rate_limiter.rate
+
+    def test_fetch_document_to_file(self):
+        """ドキュメントの抽出が有効な場合に、PDFを一時ファイルに書き込むことを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url, extract_documents=True)
+        assert web_crawler_scraper.is_allowed_url(f'{self.base_url}/document.pdf')
+        fetched_page = web_crawler_scraper.fetch_page(f'{self.base_url}/document.pdf')
+        assert fetched_page is not None
+        assert fetched_page.content == b''
+        assert fetched_page.file_path is not None
+        with open(fetched_page.file_path, 'rb') as f:
+            assert f.read() == b'%PDF-1.7\n'
+        os.remove(fetched_page.file_path)
+
+    def test_is_allowed_url(self):
+        """拡張子から許可されていないURLを判定できることを確認する"""
+        web_crawler_scraper = WebCrawlerScraper(self.base_url)
+        assert web_crawler_scraper.is_allowed_url(f'{self.base_url}/docs')
+        assert not web_crawler_scraper.is_allowed_url(f'{self.base_url}/file.pdf')
+        assert not web_crawler_scraper.is_allowed_url(f'{self.base_url}/photo.jpeg')
+
+
+class TestWebCrawlerScraperPipeline:
+    """WebCrawlerScraper.run_pipeline のテスト"""
+
+    def setup_class(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockLinkedSiteHandler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def teardown_class(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_scraper(self, **kwargs) -> WebCrawlerScraper:
+        return WebCrawlerScraper(
+            f'{self.base_url}/docs', scraped_data=[], found_urls=set(), visited_urls=set(), rate_limit=1000, **kwargs
+        )
+
+    def test_same_pages_as_sequential_run(self):
+        """取得スレッドと解析プロセスのパイプラインで、逐次実行と同じページと本文をスクレイプすることを確認する"""
+        sequential_scraper = self.make_scraper()
+        sequential_scraper.run()
+
+        pipeline_scraper = self.make_scraper(fetch_workers=3, parse_workers=2)
+        in_flight_counts: list[int] = []
+        record_queue = pipeline_scraper.metrics.record_queue
+
+        def record_in_flight(queue_depth: int, in_flight: int = 0) -> None:
+            in_flight_counts.append(in_flight)
+            record_queue(queue_depth, in_flight)
+
+        pipeline_scraper.metrics.record_queue = record_in_flight
+        pipeline_scraper.run()
+
+        # 重複ページは取得の順序によってどちらか一方だけが残る
+        for scraper in (sequential_scraper, pipeline_scraper):
+            urls = scraper.get_urls()
+            assert len(urls) == len(set(urls)) == len(MockLinkedSiteHandler.pages) - 1
+            assert (f'{self.base_url}/docs/b' in urls) != (f'{self.base_url}/docs/c' in urls)
+            assert all(data.token_size > 0 for data in scraper.scraped_data)
+        assert sorted(data.content for data in pipeline_scraper.scraped_data) == sorted(
+            data.content for data in sequential_scraper.scraped_data
+        )
+        assert pipeline_scraper.visited_urls == sequential_scraper.visited_urls
+        assert pipeline_scraper.found_urls == sequential_scraper.found_urls
+        # 取得と解析の途中のページ数は、取得スレッド数と解析プロセス数の2倍の和を超えない
+        assert 0 < max(in_flight_counts) <= 3 + 2 * 2